@@ -0,0 +1,96 @@
+"""Time to first byte of /generate-audio, buffered vs streamed, with a fake TTS client.
+
+Also compares a long transcript synthesized in one request with the sentence-chunked
+pipeline, using a fake client whose synthesis time grows with the text length.
+
+Run from the backend folder: python -m benchmarks.audio_streaming
+"""
+import time
+import asyncio
+import argparse
+import tempfile
+import httpx
+from src.api.routes import sessions
+from src.api.workflows.audio_generator import AudioGenerator
+from src.cache.audio_cache import AudioCache
+from benchmarks.fakes import FakeElevenLabs
+from benchmarks.server import BenchmarkServer
+
+
+def timed_request(http_client: httpx.Client, method: str, url: str, **kwargs) -> dict:
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    with http_client.stream(method, url, **kwargs) as response:
+        for chunk in response.iter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+    return {
+        "status": response.status_code,
+        "first_byte": first_byte or 0.0,
+        "total": time.perf_counter() - start,
+        "bytes": size,
+    }
+
+
+async def timed_stream(audio_stream) -> dict:
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+    async for chunk in audio_stream:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    return {"status": "-", "first_byte": first_byte or 0.0, "total": time.perf_counter() - start, "bytes": size}
+
+
+async def compare_chunking(transcript: str) -> dict:
+    fake_client = FakeElevenLabs(first_chunk_latency=0.3, chunk_latency=0.05, chars_per_chunk=20)
+    single = AudioGenerator(eleven_labs_client=fake_client, clips_cache=AudioCache(directory=tempfile.mkdtemp()))
+    chunked = AudioGenerator(
+        eleven_labs_client=fake_client,
+        clips_cache=AudioCache(directory=tempfile.mkdtemp()),
+        max_parallel_segments=3
+    )
+    return {
+        "single request": await timed_stream(single.stream_audio(transcript)),
+        "sentence chunks": await timed_stream(chunked.stream_audio_chunked(transcript)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--chunk-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    sessions.audio_gen_handler.eleven_labs_client = FakeElevenLabs(
+        num_chunks=args.chunks,
+        chunk_latency=args.chunk_latency
+    )
+    sessions.audio_gen_handler.clips_cache = AudioCache(directory=tempfile.mkdtemp())
+    with BenchmarkServer(app="main:app") as address, httpx.Client(base_url=f"http://{address}", timeout=60) as http_client:
+        results = {
+            "buffered": timed_request(http_client, "POST", "/generate-audio", json={"text": "Hello there, buffered.", "stream": False}),
+            "streamed": timed_request(http_client, "POST", "/generate-audio", json={"text": "Hello there, streamed."}),
+            "cached replay": timed_request(http_client, "POST", "/generate-audio", json={"text": "Hello there, streamed."}),
+            "range replay": timed_request(
+                http_client, "GET", "/generate-audio",
+                params={"text": "Hello there, streamed."},
+                headers={"Range": "bytes=1000-"}
+            ),
+        }
+    transcript = " ".join(
+        f"Lesson {index} walks through one more idea of the course with a short example." for index in range(12)
+    )
+    results.update(asyncio.run(compare_chunking(transcript)))
+    for name, result in results.items():
+        print(
+            f"{name:<15} status {result['status']}  first byte {result['first_byte']:.3f}s"
+            f"  total {result['total']:.3f}s  {result['bytes']} bytes"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Deterministic stand-ins with fixed latency for the external services used by the workflows."""
+import copy
+import time
+import asyncio
+from pydantic import BaseModel
+from agno.run.response import RunResponse
+from src.agents import lesson_planner
+from src.api.workflows.research_topic import Report
+
+
+def make_report() -> Report:
+    return Report(
+        title="Photosynthesis",
+        abstract="How plants turn light into chemical energy.",
+        introduction={"background": "Plants need energy.", "objective": "Understand photosynthesis."},
+        content={"key_points": ["Light reactions", "Calvin cycle"], "steps": ["Absorb light", "Fix carbon"]},
+        conclusion={"summary": "Light becomes sugar.", "next_steps": "Study respiration."},
+        references=["https://en.wikipedia.org/wiki/Photosynthesis"],
+    )
+
+
+def make_report_markdown() -> str:
+    """The report of ``make_report()`` written with the report template."""
+    return """# Photosynthesis
+
+## Abstract
+How plants turn light into chemical energy.
+
+## Introduction
+- **Background:** Plants need energy.
+- **Objective:** Understand photosynthesis.
+
+## Content
+- **Key Points:**
+- Light reactions
+- Calvin cycle
+- **Details/Steps:**
+1. Absorb light
+2. Fix carbon
+
+## Conclusion
+- **Summary:** Light becomes sugar.
+- **Next Steps:** Study respiration.
+
+## References
+- https://en.wikipedia.org/wiki/Photosynthesis
+"""
+
+
+def make_lessons(num_lessons: int = 3, num_sub_topics: int = 2) -> lesson_planner.Lessons:
+    return lesson_planner.Lessons(lessons=[
+        lesson_planner.LessonPlan(
+            title=f"Lesson {lesson_index + 1}",
+            description=f"Concepts covered in lesson {lesson_index + 1}.",
+            learning_objectives=["Explain the idea", "Apply the idea"],
+            lesson_introduction="A hook and a real-world application.",
+            sub_topics=[
+                lesson_planner.SubTopic(
+                    title=f"Sub topic {lesson_index + 1}.{sub_index + 1}",
+                    brief_summary="A short summary of the sub topic.",
+                    analogies="Like a kitchen turning groceries into meals.",
+                    real_world_applications=["Farming", "Biofuels"],
+                )
+                for sub_index in range(num_sub_topics)
+            ],
+        )
+        for lesson_index in range(num_lessons)
+    ])
+
+
+class FakeAgent:
+    """Agent returning a fixed content after a fixed latency.
+
+    With ``stream=True`` the content is streamed word by word, the first word after
+    ``first_token_latency`` and the rest spread over the remaining latency.
+    """
+
+    def __init__(self, content, latency: float = 1.0, first_token_latency: float = 0.2):
+        self.content = content
+        # structured contents come from agents with a response model
+        self.response_model = type(content) if isinstance(content, BaseModel) else None
+        self.latency = latency
+        self.first_token_latency = min(first_token_latency, latency)
+
+    def __get_chunks(self):
+        words = str(self.content).split(" ")
+        chunks = [word if index == 0 else f" {word}" for index, word in enumerate(words)]
+        token_latency = (self.latency - self.first_token_latency) / max(len(chunks) - 1, 1)
+        return chunks, token_latency
+
+    def __stream(self):
+        chunks, token_latency = self.__get_chunks()
+        for index, chunk in enumerate(chunks):
+            time.sleep(self.first_token_latency if index == 0 else token_latency)
+            yield RunResponse(content=chunk)
+
+    async def __astream(self):
+        chunks, token_latency = self.__get_chunks()
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep(self.first_token_latency if index == 0 else token_latency)
+            yield RunResponse(content=chunk)
+
+    def deep_copy(self, update=None):
+        return copy.copy(self)
+
+    def run(self, message=None, stream: bool = False, **kwargs):
+        if stream:
+            return self.__stream()
+        time.sleep(self.latency)
+        return RunResponse(content=self.content)
+
+    async def arun(self, message=None, stream: bool = False, **kwargs):
+        if stream:
+            return self.__astream()
+        await asyncio.sleep(self.latency)
+        return RunResponse(content=self.content)
+
+
+class FakeResearcher:
+    """GPTResearcher with the research already conducted.
+
+    ``conduct_research()`` and ``write_report()`` take ``crawl_latency`` and ``write_latency``
+    when the crawl itself is benchmarked.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        crawl_latency: float = 0.0,
+        write_latency: float = 0.0,
+        report: str = "# Photosynthesis",
+        costs: float = 0.01,
+    ):
+        self.latency = latency
+        self.crawl_latency = crawl_latency
+        self.write_latency = write_latency
+        self.report = report
+        self.costs = costs
+
+    async def conduct_research(self):
+        await asyncio.sleep(self.crawl_latency)
+
+    async def write_report(self) -> str:
+        await asyncio.sleep(self.write_latency)
+        return self.report
+
+    def get_research_context(self):
+        time.sleep(self.latency)
+        return ["Photosynthesis converts light energy into chemical energy."]
+
+    def get_research_sources(self):
+        time.sleep(self.latency)
+        return [{"url": "https://en.wikipedia.org/wiki/Photosynthesis", "title": "Photosynthesis"}]
+
+    def get_research_images(self):
+        time.sleep(self.latency)
+        return ["https://upload.wikimedia.org/photosynthesis.png"]
+
+    def get_costs(self):
+        return self.costs
+
+
+class FakeTextToSpeech:
+    """ElevenLabs ``text_to_speech`` yielding chunks after fixed delays.
+
+    A request takes ``first_chunk_latency`` to start, then yields ``num_chunks`` chunks (or one
+    chunk per ``chars_per_chunk`` characters of text when set), each after ``chunk_latency``.
+    """
+
+    def __init__(
+        self,
+        num_chunks: int = 20,
+        chunk_size: int = 4096,
+        chunk_latency: float = 0.05,
+        first_chunk_latency: float = 0.0,
+        chars_per_chunk: int = None,
+    ):
+        self.num_chunks = num_chunks
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.first_chunk_latency = first_chunk_latency
+        self.chars_per_chunk = chars_per_chunk
+        self.calls = 0
+
+    def convert(self, text: str, voice_id: str = None, model_id: str = None, output_format: str = None, **kwargs):
+        self.calls += 1
+        num_chunks = self.num_chunks
+        if self.chars_per_chunk:
+            num_chunks = max(1, -(-len(text) // self.chars_per_chunk))
+        time.sleep(self.first_chunk_latency)
+        for index in range(num_chunks):
+            time.sleep(self.chunk_latency)
+            yield bytes([index % 256]) * self.chunk_size
+
+
+class FakeElevenLabs:
+    def __init__(self, **kwargs):
+        self.text_to_speech = FakeTextToSpeech(**kwargs)
@@ -0,0 +1,92 @@
+"""Time to first transcript token and to WHITEBOARD_UPDATE for LessonsPlanGenerator with stubbed agents.
+
+With ``--stream-lessons`` the plan streams as JSON and the first WHITEBOARD_UPDATE comes
+with the first lesson, the planner latency is spread over the ``--lessons`` of the plan.
+``--two-pass`` plans markdown then extracts the lessons instead of planning them as JSON.
+
+Run from the backend folder: python -m benchmarks.lessons_plan --stream-lessons --lessons 10
+"""
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from agno.storage.workflow.sqlite import SqliteWorkflowStorage
+from src.api.workflows.lessons_plan_generator import LessonsPlanGenerator
+from src.api.workflows.session_manager import SessionManager
+from benchmarks.fakes import FakeAgent, make_lessons
+
+CONFIRMATION_MSG = (
+    "What a fantastic journey we have ahead! We start with the basics of light reactions, "
+    "move on to the Calvin cycle and finish with real-world applications in farming."
+)
+
+
+def new_handler(storage) -> LessonsPlanGenerator:
+    session_handler = SessionManager(session_state={"session": {"research": {"report": "# Photosynthesis"}}}, storage=storage)
+    session_handler.run()
+    return LessonsPlanGenerator(session_id=session_handler.session_id, storage=storage)
+
+
+def run_sync(storage, stream_lessons: bool) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    for response in new_handler(storage).run(stream_lessons=stream_lessons):
+        timings.setdefault(str(response.event), time.perf_counter() - start)
+    timings["done"] = time.perf_counter() - start
+    return timings
+
+
+async def run_async(storage, stream_lessons: bool) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    async for response in new_handler(storage).arun(stream_lessons=stream_lessons):
+        timings.setdefault(str(response.event), time.perf_counter() - start)
+    timings["done"] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--planner-latency", type=float, default=0.5)
+    parser.add_argument("--confirmation-latency", type=float, default=1.5)
+    parser.add_argument("--first-token-latency", type=float, default=0.2)
+    parser.add_argument("--extraction-latency", type=float, default=2.0)
+    parser.add_argument("--lessons", type=int, default=3)
+    parser.add_argument("--stream-lessons", action="store_true", help="stream the plan as JSON, lesson by lesson")
+    parser.add_argument("--two-pass", action="store_true", help="plan markdown then extract the lessons")
+    args = parser.parse_args()
+
+    LessonsPlanGenerator.single_pass = not args.two_pass
+    LessonsPlanGenerator.lesson_planning_agent = FakeAgent("# Lessons", latency=args.planner_latency)
+    LessonsPlanGenerator.confirmation_agent = FakeAgent(
+        CONFIRMATION_MSG,
+        latency=args.confirmation_latency,
+        first_token_latency=args.first_token_latency
+    )
+    lessons = make_lessons(num_lessons=args.lessons)
+    LessonsPlanGenerator.extraction_agent = FakeAgent(lessons, latency=args.extraction_latency)
+    # the JSON plan takes as long as the markdown one
+    LessonsPlanGenerator.lesson_streaming_agent = FakeAgent(
+        json.dumps(lessons.model_dump()),
+        latency=args.planner_latency,
+        first_token_latency=args.first_token_latency
+    )
+    storage = SqliteWorkflowStorage(table_name="bench", db_file=f"{tempfile.mkdtemp()}/workflows.db")
+
+    sequential = args.planner_latency + args.confirmation_latency + args.extraction_latency
+    print(f"sequential WHITEBOARD_UPDATE: {sequential:.2f}s, first transcript: {args.planner_latency + args.confirmation_latency:.2f}s")
+    for name, timings in (
+        ("sync", run_sync(storage, args.stream_lessons)),
+        ("async", asyncio.run(run_async(storage, args.stream_lessons)))
+    ):
+        print(
+            f"{name:<6} AUDIO_TRANSCRIPT_DELTA {timings['AUDIO_TRANSCRIPT_DELTA']:.2f}s"
+            f"  AUDIO_TRANSCRIPT {timings['AUDIO_TRANSCRIPT']:.2f}s"
+            f"  WHITEBOARD_UPDATE {timings['WHITEBOARD_UPDATE']:.2f}s"
+            f"  done {timings['done']:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
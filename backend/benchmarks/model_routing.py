@@ -0,0 +1,169 @@
+"""Latency and errors of the chat route against local fake Groq and OpenAI endpoints.
+
+The fake endpoints answer chat completions, streamed or not, after a latency drawn per
+model, with a share of slow requests, and rate limit a model past its requests per second.
+Compares the confirmation agent pinned to llama-3.3-70b-versatile with the chat route,
+without and with hedging, and prints the route stats of the last run.
+
+Run from the backend folder: python -m benchmarks.model_routing --requests 200 --concurrency 8
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from agno.agent import Agent
+from benchmarks.server import BenchmarkServer
+
+# model id: latency in seconds, share of slow requests, latency of a slow request, requests per second
+FAKE_MODELS = {
+    "llama-3.1-8b-instant": (0.25, 0.1, 3.0, 20.0),
+    "llama-3.3-70b-versatile": (0.8, 0.1, 4.0, 20.0),
+    "gpt-4o-mini": (0.6, 0.02, 2.0, 100.0),
+    "gpt-4o": (1.2, 0.02, 3.0, 100.0),
+}
+
+
+class FakeModelEndpoints:
+    """OpenAI compatible chat completions of the ``FAKE_MODELS`` under the Groq and OpenAI paths."""
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.requests: Dict[str, List[float]] = {}
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.complete)
+        self.app.post("/openai/v1/chat/completions")(self.complete)
+
+    def __is_rate_limited(self, model: str) -> bool:
+        now = time.monotonic()
+        recent = [started for started in self.requests.get(model, []) if now - started < 1.0]
+        self.requests[model] = recent + [now]
+        return len(recent) >= FAKE_MODELS[model][3]
+
+    async def complete(self, request: Request):
+        body = await request.json()
+        model = body["model"]
+        if self.__is_rate_limited(model):
+            error = {"error": {"message": f"Rate limit reached for {model}", "type": "rate_limit_error"}}
+            return JSONResponse(error, status_code=429, headers={"retry-after": "1"})
+        latency, slow_share, slow_latency, _ = FAKE_MODELS[model]
+        latency = slow_latency if self.rng.random() < slow_share else latency * self.rng.uniform(0.8, 1.2)
+        words = f"What a joy, {model} can't wait to teach you this topic!".split(" ")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        usage = {"prompt_tokens": 120, "completion_tokens": len(words), "total_tokens": 120 + len(words)}
+        if not body.get("stream", False):
+            await asyncio.sleep(latency)
+            return {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def chunks():
+            # the first word after a third of the latency, the rest spread over the remaining latency
+            await asyncio.sleep(latency / 3)
+            for index, word in enumerate(words):
+                delta = {"content": word if index == 0 else f" {word}"}
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(latency * 2 / 3 / len(words))
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage,
+            }
+            yield f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+def percentile(latencies: List[float], quantile: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[min(int(quantile * len(latencies)), len(latencies) - 1)]
+
+
+async def run_requests(agent: Agent, num_requests: int, concurrency: int, stream: bool) -> Dict[str, float]:
+    from src.cache.agent_cache import agent_cache
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(index: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if stream:
+                    # time to the first chunk, the rest of the stream is drained
+                    first = None
+                    async for _ in agent_cache.astream(agent, f"topic {index}"):
+                        first = first or time.perf_counter() - start
+                    latencies.append(first)
+                else:
+                    await agent_cache.arun(agent, f"topic {index}")
+                    latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(request(index) for index in range(num_requests)))
+    return {
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p95": percentile(latencies, 0.95) if latencies else float("nan"),
+        "p99": percentile(latencies, 0.99) if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stream", action="store_true", help="time the first chunk of streamed runs")
+    parser.add_argument("--min-samples", type=int, default=20)
+    parser.add_argument("--cooldown", type=float, default=2.0)
+    parser.add_argument("--groq-rps", type=float, default=20.0, help="requests per second of each Groq model")
+    args = parser.parse_args()
+    for model in ("llama-3.1-8b-instant", "llama-3.3-70b-versatile"):
+        FAKE_MODELS[model] = FAKE_MODELS[model][:3] + (args.groq_rps,)
+
+    endpoints = FakeModelEndpoints()
+    with BenchmarkServer(app=endpoints.app) as address:
+        # the SDK clients are created on the first run, after the endpoints are known
+        os.environ["OPENAI_BASE_URL"] = f"http://{address}/v1"
+        os.environ["GROQ_BASE_URL"] = f"http://{address}"
+        from src.agents import confirmation_message_generator
+        from src.cache import agent_cache as agent_cache_module
+        from src.config.model_router import DEFAULT_ROUTES, ModelRoute, ModelRouter
+
+        chat = DEFAULT_ROUTES["chat"]
+        scenarios = {
+            "pinned to 70b": (ModelRoute("chat", ["groq/llama-3.3-70b-versatile"], chat["latency_budget"], chat["cost_budget"]), False),
+            "chat route": (ModelRoute("chat", **chat), False),
+            "chat route, hedged": (ModelRoute("chat", **chat), True),
+        }
+
+        async def run_scenarios():
+            # one event loop for all scenarios, the async HTTP client of the worker is bound to it
+            print(f"{'':<22}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'errors':>8}{'hedges':>8}{'fallbacks':>11}")
+            for name, (route, hedging) in scenarios.items():
+                router = ModelRouter(routes={"chat": route}, hedging=hedging, cooldown=args.cooldown, min_samples=args.min_samples)
+                agent_cache_module.model_router = router
+                agent = confirmation_message_generator.agent.deep_copy(update={"model": router.get_model("chat")})
+                results = await run_requests(agent, args.requests, args.concurrency, args.stream)
+                stats = router.stats()["chat"]
+                print(
+                    f"{name:<22}{results['p50']:>8.2f}{results['p95']:>8.2f}{results['p99']:>8.2f}"
+                    f"{results['errors']:>8}{stats['hedges']:>8}{stats['fallbacks']:>11}"
+                )
+            print(json.dumps(stats, indent=2))
+        asyncio.run(run_scenarios())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Cross-worker rate limiting of RateLimiter with worker processes sharing one SQLite file.
+
+Every process runs threads that keep calling ``acquire`` for one provider, half of them
+in the interactive lane and half in the bulk lane. The bucket is drained first, so every
+call after it waits for the refill. Reports the uncontended cost of a call, the rate the
+processes got together against the limit, the waits per lane and the QUEUED positions.
+
+Run from the backend folder: python -m benchmarks.rate_limits --processes 4 --threads 4
+"""
+import os
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from typing import Dict, List
+
+
+def new_limiter(db_file: str, requests_per_minute: float, promote_after: float):
+    from src.config.rate_limiter import RateLimiter
+    return RateLimiter(
+        limits={"groq": {"requests_per_minute": requests_per_minute, "tokens_per_minute": 1_000_000}},
+        db_file=db_file,
+        promote_after=promote_after,
+    )
+
+
+def run_worker(db_file: str, requests_per_minute: float, promote_after: float, threads: int, duration: float, results):
+    import threading
+    from src.config.rate_limiter import queue_listener
+    limiter = new_limiter(db_file, requests_per_minute, promote_after)
+    calls: List[Dict] = []
+    lock = threading.Lock()
+
+    def call_repeatedly(lane: str):
+        positions = []
+        queue_listener.set(lambda event: positions.append(event))
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            waited = limiter.acquire("groq", tokens=100, lane=lane)
+            with lock:
+                calls.append({"lane": lane, "at": time.time(), "wait": waited, "queued": len(positions)})
+            positions.clear()
+
+    workers = [threading.Thread(target=call_repeatedly, args=("interactive" if index % 2 == 0 else "bulk",)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="calling threads per process")
+    parser.add_argument("--requests-per-minute", type=float, default=600)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--promote-after", type=float, default=30.0, help="seconds until a waiter moves up a lane")
+    args = parser.parse_args()
+
+    db_file = f"{tempfile.mkdtemp()}/rate_limits.db"
+    limiter = new_limiter(db_file, args.requests_per_minute, args.promote_after)
+    start = time.perf_counter()
+    for _ in range(int(args.requests_per_minute)):
+        limiter.acquire("groq")
+    per_call = (time.perf_counter() - start) / int(args.requests_per_minute)
+    print(f"uncontended acquire: {per_call * 1e6:.0f} us")
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(db_file, args.requests_per_minute, args.promote_after, args.threads, args.duration, results))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    calls = [call for _ in processes for call in results.get()]
+    for process in processes:
+        process.join()
+
+    # the first and last seconds are spent starting and stopping the processes
+    calls.sort(key=lambda call: call["at"])
+    first, last = calls[0]["at"], calls[-1]["at"]
+    steady = [call for call in calls if first + 1 <= call["at"] <= last - 1]
+    rate = len(steady) / max(last - first - 2, 1e-9) * 60
+    print(f"{args.processes} processes x {args.threads} threads, {len(calls)} calls in {last - first:.1f}s")
+    print(f"rate: {rate:.0f} requests/min, limit {args.requests_per_minute:.0f}")
+    print(f"{'lane':<13}{'calls':>7}{'p50 wait s':>12}{'p95 wait s':>12}{'queued':>8}")
+    for lane in ("interactive", "bulk"):
+        lane_calls = [call for call in steady if call["lane"] == lane]
+        waits = sorted(call["wait"] for call in lane_calls)
+        if not waits:
+            continue
+        print(
+            f"{lane:<13}{len(lane_calls):>7}{statistics.median(waits):>12.3f}"
+            f"{waits[min(int(0.95 * len(waits)), len(waits) - 1)]:>12.3f}"
+            f"{sum(1 for call in lane_calls if call['queued']):>8}"
+        )
+    os.remove(db_file)
+
+
+if __name__ == "__main__":
+    main()
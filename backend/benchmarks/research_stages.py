@@ -0,0 +1,69 @@
+"""Wall clock of DeepResearcher with stubbed agents of fixed latency.
+
+Run from the backend folder: python -m benchmarks.research_stages
+"""
+import time
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from agno.storage.workflow.sqlite import SqliteWorkflowStorage
+from src.api.workflows import stages
+from src.api.workflows.research_topic import DeepResearcher
+from src.api.workflows.session_manager import SessionManager
+from benchmarks.fakes import FakeAgent, FakeResearcher, make_report
+
+
+def new_handler(storage) -> DeepResearcher:
+    session_handler = SessionManager(storage=storage)
+    session_handler.run()
+    return DeepResearcher(session_id=session_handler.session_id, storage=storage)
+
+
+def run_sync(storage, researcher) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    for response in new_handler(storage).run(topic="photosynthesis", researcher=researcher, report="# Photosynthesis"):
+        timings.setdefault(str(response.event), time.perf_counter() - start)
+    return timings
+
+
+async def run_async(storage, researcher) -> dict:
+    timings = {}
+    start = time.perf_counter()
+    async for response in new_handler(storage).arun(topic="photosynthesis", researcher=researcher, report="# Photosynthesis"):
+        timings.setdefault(str(response.event), time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--summary-latency", type=float, default=1.0)
+    parser.add_argument("--extraction-latency", type=float, default=2.0)
+    parser.add_argument("--researcher-latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    DeepResearcher.confirmation_agent = FakeAgent("A short summary of the report.", latency=args.summary_latency)
+    DeepResearcher.extraction_agent = FakeAgent(make_report(), latency=args.extraction_latency)
+    researcher = FakeResearcher(latency=args.researcher_latency)
+    storage = SqliteWorkflowStorage(table_name="bench", db_file=f"{tempfile.mkdtemp()}/workflows.db")
+
+    sequential_sum = args.summary_latency + args.extraction_latency + 3 * args.researcher_latency
+    print(f"sum of stage latencies: {sequential_sum:.2f}s, max: {max(args.summary_latency, args.extraction_latency):.2f}s")
+
+    concurrent_executor = stages.stage_executor
+    stages.stage_executor = ThreadPoolExecutor(max_workers=1)
+    results = {"sync, one stage at a time": run_sync(storage, researcher)}
+    stages.stage_executor = concurrent_executor
+    results["sync, concurrent stages"] = run_sync(storage, researcher)
+    results["async, concurrent stages"] = asyncio.run(run_async(storage, researcher))
+
+    for name, timings in results.items():
+        print(
+            f"{name:<28} AUDIO_TRANSCRIPT {timings['AUDIO_TRANSCRIPT']:.2f}s"
+            f"  WHITEBOARD_UPDATE {timings['WHITEBOARD_UPDATE']:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""Runs main.app with uvicorn on a free local port in a background thread."""
+import time
+import threading
+import uvicorn
+
+
+class BenchmarkServer:
+    def __init__(self, app: str = "main:app", **config):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", **config))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> str:
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"{host}:{port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
@@ -0,0 +1,108 @@
+"""Cost of saving and reopening a session with a large research context.
+
+Compares the whole session state saved by agno with the research and lessons fields kept
+in session documents, for a save after the lessons step and for reopening the session to
+read ``lessons.markdown``.
+
+Run from the backend folder: python -m benchmarks.session_state
+"""
+import json
+import time
+import argparse
+import tempfile
+from agno.storage.workflow.sqlite import SqliteWorkflowStorage
+from src.api.workflows.lessons_plan_generator import LessonsPlanGenerator
+from benchmarks.fakes import make_lessons, make_report
+
+
+def make_session(context_size: int) -> dict:
+    return {
+        "is_validated": True,
+        "topic": "photosynthesis",
+        "research": {
+            "report": "# Photosynthesis\n" + "Plants turn light into sugar. " * 200,
+            "report_summary": "A short summary of the report.",
+            "context": "Photosynthesis converts light energy into chemical energy. " * (context_size // 60),
+            "sources": [{"url": f"https://example.com/{index}", "title": f"Source {index}"} for index in range(50)],
+            "images": [f"https://example.com/{index}.png" for index in range(20)],
+            "parsed_data": make_report().model_dump(),
+        },
+        "lessons": {
+            "markdown": "# Lessons\n" + "- Light reactions\n" * 100,
+            "parsed_data": make_lessons().model_dump(),
+        },
+    }
+
+
+def open_workflow(storage, session_id: str) -> LessonsPlanGenerator:
+    workflow = LessonsPlanGenerator(session_id=session_id, storage=storage)
+    workflow.read_from_storage()
+    return workflow
+
+
+def session_row_size(storage, session_id: str) -> int:
+    return len(json.dumps(storage.read(session_id).session_data))
+
+
+def bench_blob(storage, session: dict, repeats: int) -> dict:
+    workflow = LessonsPlanGenerator(session_id="blob", session_state={"session": session}, storage=storage)
+    workflow.write_to_storage()
+
+    start = time.perf_counter()
+    for index in range(repeats):
+        workflow.session_state["session"]["lessons"]["confirmation"] = f"Welcome {index}"
+        workflow.write_to_storage()
+    save = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        open_workflow(storage, "blob").session_state["session"]["lessons"]["markdown"]
+    reopen = (time.perf_counter() - start) / repeats
+    return {"save": save, "reopen": reopen, "written": session_row_size(storage, "blob")}
+
+
+def bench_documents(storage, session: dict, repeats: int) -> dict:
+    workflow = LessonsPlanGenerator(session_id="documents", session_state={"session": session}, storage=storage)
+    # the legacy fields move to their own rows on the first flush
+    documents = workflow.open_session_documents()
+    documents.load(*[f"{section}.{field}" for section in ["research", "lessons"] for field in session[section]])
+    documents.flush()
+    workflow.write_to_storage()
+
+    start = time.perf_counter()
+    for index in range(repeats):
+        documents = workflow.open_session_documents()
+        documents.set("lessons.confirmation", f"Welcome {index}")
+        documents.flush()
+        workflow.write_to_storage()
+    save = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        open_workflow(storage, "documents").open_session_documents().get("lessons.markdown")
+    reopen = (time.perf_counter() - start) / repeats
+    written = session_row_size(storage, "documents") + len(json.dumps(f"Welcome {repeats - 1}"))
+    return {"save": save, "reopen": reopen, "written": written}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--context-kb", type=int, default=2048, help="size of the research context")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    storage = SqliteWorkflowStorage(table_name="bench", db_file=f"{tempfile.mkdtemp()}/workflows.db")
+    results = {
+        "session state blob": bench_blob(storage, make_session(args.context_kb * 1024), args.repeats),
+        "session documents": bench_documents(storage, make_session(args.context_kb * 1024), args.repeats),
+    }
+    print(f"research context of {args.context_kb} KB")
+    for name, result in results.items():
+        print(
+            f"{name:<19} save {result['save'] * 1000:7.2f}ms ({result['written']:>9} bytes)"
+            f"  reopen for lessons.markdown {result['reopen'] * 1000:7.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Session writes per second of the workflow storage modes under concurrent sessions.
+
+Every thread owns a session and writes its session state in a loop, the way the workflows
+do after each stage. Postgres is only measured when PG_DB_URL is set.
+
+Run from the backend folder: python -m benchmarks.storage_writes
+"""
+import os
+import time
+import uuid
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from agno.storage.workflow.session import WorkflowSession
+
+
+def write_sessions(mode: str, db_file: str, num_sessions: int, writes_per_session: int, payload_size: int) -> dict:
+    os.environ["WORKFLOW_SQLITE_DB"] = db_file
+    # imported here so every process reads the benchmark database settings
+    from src.config.llm_config import LlmConfigs
+
+    storage = LlmConfigs().get_workflow_storage("bench", mode=mode)
+    payload = "x" * payload_size
+    counters = {"writes": 0, "lost": 0}
+
+    def write_session(_):
+        session_id = str(uuid.uuid4())
+        for index in range(writes_per_session):
+            session = WorkflowSession(
+                session_id=session_id,
+                workflow_id="bench",
+                session_data={"session_state": {"stage": index, "payload": payload}},
+            )
+            # agno logs and swallows failed upserts, count them as lost writes
+            if storage.upsert(session) is None:
+                counters["lost"] += 1
+            else:
+                counters["writes"] += 1
+
+    with ThreadPoolExecutor(max_workers=num_sessions) as executor:
+        list(executor.map(write_session, range(num_sessions)))
+    return counters
+
+
+def run_mode(mode: str, db_file: str, args) -> dict:
+    # creates the table before the clock starts
+    write_sessions(mode, db_file, 1, 1, args.payload_size)
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(
+            write_sessions,
+            [(mode, db_file, args.sessions, args.writes, args.payload_size)] * args.processes
+        )
+    elapsed = time.perf_counter() - start
+    return {
+        "writes": sum(result["writes"] for result in results),
+        "lost": sum(result["lost"] for result in results),
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=2, help="workers sharing the database")
+    parser.add_argument("--sessions", type=int, default=16, help="concurrent sessions per worker")
+    parser.add_argument("--writes", type=int, default=20, help="writes per session")
+    parser.add_argument("--payload-size", type=int, default=20_000, help="bytes of session state")
+    args = parser.parse_args()
+
+    modes = ["sqlite", "sqlite_wal"]
+    if os.getenv("PG_DB_URL"):
+        modes.append("postgres")
+    print(f"{args.processes} workers x {args.sessions} sessions x {args.writes} writes of {args.payload_size} bytes")
+    for mode in modes:
+        db_file = os.path.join(tempfile.mkdtemp(), "workflows.db")
+        result = run_mode(mode, db_file, args)
+        print(
+            f"{mode:<11} {result['writes'] / result['elapsed']:8.0f} writes/s"
+            f"  lost {result['lost']:5d}  total {result['elapsed']:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
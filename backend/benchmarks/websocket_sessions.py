@@ -0,0 +1,238 @@
+"""Concurrent WebSocket sessions against main.app with fake research, agents and TTS.
+
+Every session creates a session, sends RESEARCH_TOPIC then PLAN_LESSONS over its WebSocket
+and optionally fetches the audio of each AUDIO_TRANSCRIPT. Reports p50/p95/p99 of the time
+to the first event and to WHITEBOARD_UPDATE, the session throughput, the RSS of the process
+(server included) and the latency of /health polled during the run, which grows when the
+event loop is blocked. ``--protocol`` selects the wire protocol of the sessions, the bytes
+reported are the event payloads before permessage-deflate. ``--replan`` plans the lessons a
+second time, with ``--whiteboard-patch`` the board is then sent as a patch. ``--stream-lessons``
+sends the lessons to the board one by one, the board timings are those of the first board.
+``--template-report`` has the crawl write a report following the report template, which is
+parsed without the extraction agent, and ``--two-pass`` plans the lessons as markdown then
+extracts them.
+
+Run from the backend folder: python -m benchmarks.websocket_sessions --sessions 50
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+from collections import defaultdict
+from typing import Dict, List
+
+# the session, research and audio stores of the run are thrown away afterwards
+_data_dir = tempfile.mkdtemp()
+os.environ.setdefault("WORKFLOW_SQLITE_DB", f"{_data_dir}/workflows.db")
+os.environ.setdefault("RESEARCH_CACHE_DB", f"{_data_dir}/research_cache.db")
+os.environ.setdefault("AGENT_CACHE_DB", f"{_data_dir}/agent_cache.db")
+os.environ.setdefault("AUDIO_CACHE_DIR", f"{_data_dir}/audio")
+os.environ.setdefault("EVENT_LOG_DB", f"{_data_dir}/session_events.db")
+os.environ.setdefault("RESEARCH_JOB_DB", f"{_data_dir}/research_jobs.db")
+os.environ.setdefault("RATE_LIMIT_DB", f"{_data_dir}/rate_limits.db")
+
+import httpx
+import msgpack
+import websockets
+from src.api.routes import sessions
+from src.api.workflows.research_topic import DeepResearcher
+from src.api.workflows.lessons_plan_generator import LessonsPlanGenerator
+from src.cache import research_cache
+from src.cache.audio_cache import AudioCache
+from benchmarks.fakes import FakeAgent, FakeElevenLabs, FakeResearcher, make_lessons, make_report, make_report_markdown
+from benchmarks.server import BenchmarkServer
+
+CONFIRMATION_MSG = (
+    "What a fantastic journey we have ahead! We start with the basics of light reactions, "
+    "move on to the Calvin cycle and finish with real-world applications in farming."
+)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))]
+
+
+def get_rss_mb() -> Dict[str, float]:
+    current = 0.0
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as statm:
+            current = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    # kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"current": round(current, 1), "peak": round(peak, 1)}
+
+
+def install_fakes(args):
+    DeepResearcher.confirmation_agent = FakeAgent("A short summary.", latency=args.agent_latency)
+    DeepResearcher.extraction_agent = FakeAgent(make_report(), latency=args.extraction_latency)
+    LessonsPlanGenerator.lesson_planning_agent = FakeAgent("# Lessons", latency=args.agent_latency)
+    LessonsPlanGenerator.lesson_streaming_agent = FakeAgent(json.dumps(make_lessons().model_dump()), latency=args.agent_latency)
+    LessonsPlanGenerator.confirmation_agent = FakeAgent(
+        CONFIRMATION_MSG,
+        latency=args.agent_latency,
+        first_token_latency=args.first_token_latency
+    )
+    LessonsPlanGenerator.extraction_agent = FakeAgent(make_lessons(), latency=args.extraction_latency)
+    # the crawl still goes through the research cache and run_report_generation
+    LessonsPlanGenerator.single_pass = not args.two_pass
+    research_cache.get_researcher = lambda query, report_type="outline_report": FakeResearcher(
+        crawl_latency=args.crawl_latency,
+        write_latency=args.write_latency,
+        report=make_report_markdown() if args.template_report else "# Photosynthesis"
+    )
+    sessions.audio_gen_handler.eleven_labs_client = FakeElevenLabs(
+        num_chunks=10,
+        chunk_latency=args.tts_chunk_latency,
+        first_chunk_latency=args.tts_latency
+    )
+    sessions.audio_gen_handler.clips_cache = AudioCache(directory=os.environ["AUDIO_CACHE_DIR"])
+
+
+async def fetch_audio(http_client: httpx.AsyncClient, text: str) -> float:
+    start = time.perf_counter()
+    first_byte = None
+    async with http_client.stream("POST", "/generate-audio", json={"text": text}) as response:
+        async for _ in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+    return first_byte or 0.0
+
+
+def decode_event(frame, protocol: str) -> Dict:
+    event = msgpack.unpackb(frame) if isinstance(frame, bytes) else json.loads(frame)
+    if protocol == "legacy" and event["type"] not in ["AUDIO_TRANSCRIPT", "AUDIO_TRANSCRIPT_DELTA"]:
+        # the JSON messages are encoded twice
+        event["message"] = json.loads(event["message"])
+    return event
+
+
+async def run_workflow(websocket, message: Dict, prefix: str, timings: Dict[str, List[float]], transcripts: List[str], protocol: str):
+    """Sends a workflow message and waits for the TIMING event sent once the run is over."""
+    start = time.perf_counter()
+    await websocket.send(json.dumps({**message, "timing": True}))
+    first_event = None
+    first_board = None
+    received_bytes = 0
+    while True:
+        frame = await websocket.recv()
+        received_bytes += len(frame)
+        event = decode_event(frame, protocol)
+        elapsed = time.perf_counter() - start
+        # job status events are sent right away, they don't show the work being done
+        if first_event is None and event["type"] != "RESEARCH_JOB":
+            first_event = elapsed
+            timings[f"{prefix} first event"].append(elapsed)
+        if first_board is None and event["type"] in ["WHITEBOARD_UPDATE", "WHITEBOARD_PATCH"]:
+            first_board = elapsed
+            timings[f"{prefix} {event['type']}"].append(elapsed)
+        elif event["type"] == "AUDIO_TRANSCRIPT":
+            transcripts.append(event["message"])
+        elif event["type"] == "TIMING":
+            timings[f"{prefix} total"].append(elapsed)
+            timings[f"{prefix} KB received"].append(received_bytes / 1024)
+            for stage in event["message"]:
+                timings[f"{prefix} stage {stage['stage']}"].append(stage["wall_time"])
+            return
+
+
+async def run_session(address: str, http_client: httpx.AsyncClient, topic: str, timings: Dict[str, List[float]], args):
+    session_id = (await http_client.post("/session")).json()["session_id"]
+    transcripts = []
+    async with websockets.connect(
+        f"ws://{address}/session/{session_id}?protocol={args.protocol}",
+        max_size=None,
+        compression=None if args.no_deflate else "deflate"
+    ) as websocket:
+        options = {"topic": topic, "whiteboard_patch": args.whiteboard_patch, "stream_lessons": args.stream_lessons}
+        await run_workflow(websocket, {"type": "RESEARCH_TOPIC", **options}, "research", timings, transcripts, args.protocol)
+        await run_workflow(websocket, {"type": "PLAN_LESSONS", **options}, "lessons", timings, transcripts, args.protocol)
+        if args.replan:
+            await run_workflow(websocket, {"type": "PLAN_LESSONS", **options}, "replan", timings, transcripts, args.protocol)
+    if args.audio:
+        for text in transcripts:
+            timings["audio first byte"].append(await fetch_audio(http_client, text))
+
+
+async def poll_health(http_client: httpx.AsyncClient, latencies: List[float], stopped: asyncio.Event):
+    while not stopped.is_set():
+        start = time.perf_counter()
+        await http_client.get("/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.05)
+
+
+async def run_benchmark(address: str, args) -> Dict:
+    timings: Dict[str, List[float]] = defaultdict(list)
+    health_latencies: List[float] = []
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=f"http://{address}", timeout=300, limits=limits) as http_client, \
+            httpx.AsyncClient(base_url=f"http://{address}", timeout=300) as health_client:
+        stopped = asyncio.Event()
+        health_task = asyncio.ensure_future(poll_health(health_client, health_latencies, stopped))
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def limited_session(index: int):
+            async with slots:
+                topic = "photosynthesis" if args.same_topic else f"photosynthesis {index}"
+                await run_session(address, http_client, topic, timings, args)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[limited_session(index) for index in range(args.sessions)], return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        stopped.set()
+        await health_task
+    timings["health"] = health_latencies
+    failures = [result for result in results if isinstance(result, Exception)]
+    return {"timings": timings, "elapsed": elapsed, "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--crawl-latency", type=float, default=1.0)
+    parser.add_argument("--write-latency", type=float, default=0.5)
+    parser.add_argument("--agent-latency", type=float, default=0.5)
+    parser.add_argument("--first-token-latency", type=float, default=0.1)
+    parser.add_argument("--extraction-latency", type=float, default=1.0)
+    parser.add_argument("--tts-latency", type=float, default=0.2)
+    parser.add_argument("--tts-chunk-latency", type=float, default=0.02)
+    parser.add_argument("--same-topic", action="store_true", help="every session researches the same topic")
+    parser.add_argument("--audio", action="store_true", help="fetch the audio of every transcript")
+    parser.add_argument("--protocol", default="legacy", choices=["legacy", "json", "msgpack"])
+    parser.add_argument("--no-deflate", action="store_true", help="don't offer permessage-deflate")
+    parser.add_argument("--whiteboard-patch", action="store_true", help="get the boards as WHITEBOARD_PATCH events")
+    parser.add_argument("--replan", action="store_true", help="plan the lessons a second time")
+    parser.add_argument("--stream-lessons", action="store_true", help="send the lessons to the board one by one")
+    parser.add_argument("--template-report", action="store_true", help="write reports that parse without the extractor")
+    parser.add_argument("--two-pass", action="store_true", help="plan the lessons as markdown then extract them")
+    args = parser.parse_args()
+
+    install_fakes(args)
+    rss_before = get_rss_mb()
+    with BenchmarkServer(app="main:app") as address:
+        result = asyncio.run(run_benchmark(address, args))
+    rss_after = get_rss_mb()
+
+    completed = args.sessions - len(result["failures"])
+    print(f"{completed}/{args.sessions} sessions in {result['elapsed']:.2f}s, "
+          f"{completed / result['elapsed']:.2f} sessions/s at concurrency {args.concurrency}")
+    print(f"{'metric':<34}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, values in result["timings"].items():
+        print(f"{name:<34}" + "".join(f"{value:>9.3f}" for value in [
+            percentile(values, 50), percentile(values, 95), percentile(values, 99), max(values, default=0.0)
+        ]))
+    print(f"RSS MB before {rss_before['current']}, after {rss_after['current']}, peak {rss_after['peak']}")
+    for failure in result["failures"][:5]:
+        print(f"failed session: {failure!r}")
+
+
+if __name__ == "__main__":
+    main()
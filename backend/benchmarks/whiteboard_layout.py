@@ -0,0 +1,96 @@
+"""Whiteboard layout time of LessonsPlanGenerator boards for synthetic courses of increasing size.
+
+Lessons get 1 to 6 subtopics and texts of random length. Reports the median time to build
+the board and, of that, to size and place its boxes, then checks no two boxes overlap.
+
+Run from the backend folder: python -m benchmarks.whiteboard_layout --lessons 10 100 500
+"""
+import time
+import random
+import argparse
+import statistics
+import numpy as np
+from typing import Dict, List
+from src.agents import lesson_planner
+from src.api.workflows.lessons_plan_generator import LessonsPlanGenerator
+from src.api.workflows.whiteboard_layout import whiteboard_layout
+
+WORDS = "light energy plants sugar carbon water leaf cell chlorophyll oxygen cycle reaction".split()
+
+
+def make_text(rng: random.Random, min_words: int, max_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def make_course(num_lessons: int, seed: int = 0) -> lesson_planner.Lessons:
+    rng = random.Random(seed)
+    return lesson_planner.Lessons(lessons=[
+        lesson_planner.LessonPlan(
+            title=f"Lesson {lesson_index + 1}: {make_text(rng, 2, 8)}",
+            description=make_text(rng, 10, 60),
+            learning_objectives=[make_text(rng, 4, 15) for _ in range(rng.randint(1, 5))],
+            lesson_introduction=make_text(rng, 10, 80),
+            sub_topics=[
+                lesson_planner.SubTopic(
+                    title=make_text(rng, 2, 8),
+                    brief_summary=make_text(rng, 10, 50),
+                    analogies=make_text(rng, 5, 30) if rng.random() < 0.7 else None,
+                    real_world_applications=[make_text(rng, 2, 10) for _ in range(rng.randint(0, 4))],
+                )
+                for _ in range(rng.randint(1, 6))
+            ],
+        )
+        for lesson_index in range(num_lessons)
+    ])
+
+
+def count_overlaps(items: List[Dict]) -> int:
+    boxes = np.array([
+        [item["position"]["x"], item["position"]["y"],
+         item["position"]["x"] + item["size"]["width"], item["position"]["y"] + item["size"]["height"]]
+        for item in items
+    ])
+    overlaps = (
+        (boxes[:, None, 0] < boxes[None, :, 2]) & (boxes[None, :, 0] < boxes[:, None, 2]) &
+        (boxes[:, None, 1] < boxes[None, :, 3]) & (boxes[None, :, 1] < boxes[:, None, 3])
+    )
+    return int((overlaps.sum() - len(items)) // 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lessons", type=int, nargs="+", default=[10, 50, 100, 250, 500, 1000])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    handler = LessonsPlanGenerator()
+    generate_board = handler._LessonsPlanGenerator__generate_whiteboard_state_lessons
+    original_layout_rows = whiteboard_layout.layout_rows
+    layout_times = []
+
+    def timed_layout_rows(*layout_args, **layout_kwargs):
+        start = time.perf_counter()
+        result = original_layout_rows(*layout_args, **layout_kwargs)
+        layout_times.append(time.perf_counter() - start)
+        return result
+    whiteboard_layout.layout_rows = timed_layout_rows
+
+    print(f"{'lessons':>8}{'boxes':>8}{'board ms':>10}{'layout ms':>11}{'overlaps':>10}")
+    for num_lessons in args.lessons:
+        course = make_course(num_lessons)
+        board_times = []
+        layout_times.clear()
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            items = generate_board(course)
+            board_times.append(time.perf_counter() - start)
+        print(
+            f"{num_lessons:>8}{len(items):>8}"
+            f"{statistics.median(board_times) * 1000:>10.2f}"
+            f"{statistics.median(layout_times) * 1000:>11.2f}"
+            f"{count_overlaps(items):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Time to WHITEBOARD_UPDATE of LessonsPlanGenerator with and without write-behind session writes.
+
+Every SQL statement is delayed by ``--db-latency-ms`` to stand in for a remote database.
+
+Run from the backend folder: python -m benchmarks.write_behind
+"""
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from sqlalchemy import event
+from agno.storage.workflow.sqlite import SqliteWorkflowStorage
+from src.api.workflows.lessons_plan_generator import LessonsPlanGenerator
+from src.api.workflows.session_manager import SessionManager
+from src.api.workflows.session_writer import session_writer
+from benchmarks.fakes import FakeAgent, make_lessons
+
+
+async def run_session(storage) -> float:
+    session_handler = SessionManager(session_state={"session": {"research": {"report": "# Photosynthesis"}}}, storage=storage)
+    session_handler.run()
+    start = time.perf_counter()
+    whiteboard_update = None
+    async for response in LessonsPlanGenerator(session_id=session_handler.session_id, storage=storage).arun():
+        if response.event == "WHITEBOARD_UPDATE":
+            whiteboard_update = time.perf_counter() - start
+    # the durable flush the WebSocket route does once the workflow is over
+    await session_writer.aflush(session_handler.session_id)
+    return whiteboard_update
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-latency-ms", type=float, default=20.0)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--two-pass", action="store_true", help="plan markdown then extract the lessons")
+    args = parser.parse_args()
+
+    LessonsPlanGenerator.single_pass = not args.two_pass
+    LessonsPlanGenerator.lesson_planning_agent = FakeAgent("# Lessons", latency=0.05)
+    LessonsPlanGenerator.lesson_streaming_agent = FakeAgent(json.dumps(make_lessons().model_dump()), latency=0.05)
+    LessonsPlanGenerator.confirmation_agent = FakeAgent("Welcome to the lessons.", latency=0.05, first_token_latency=0.01)
+    LessonsPlanGenerator.extraction_agent = FakeAgent(make_lessons(), latency=0.05)
+    storage = SqliteWorkflowStorage(table_name="bench", db_file=f"{tempfile.mkdtemp()}/workflows.db")
+
+    @event.listens_for(storage.db_engine, "before_cursor_execute")
+    def delay_statement(*_):
+        time.sleep(args.db_latency_ms / 1000)
+
+    for enabled in [False, True]:
+        session_writer.enabled = enabled
+        timings = [asyncio.run(run_session(storage)) for _ in range(args.sessions)]
+        name = "write-behind" if enabled else "write-through"
+        print(f"{name:<14} WHITEBOARD_UPDATE {sum(timings) / len(timings):.3f}s (mean of {args.sessions})")
+    print(session_writer.stats())
+
+
+if __name__ == "__main__":
+    main()
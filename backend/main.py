@@ -1,9 +1,22 @@
+import os
+import asyncio
 import uvicorn
 import multiprocessing
 from fastapi import FastAPI
 from fastapi import Response
 from fastapi.middleware.cors import CORSMiddleware
 from src.api.routes import sessions
+from src.api.workflow_runner import workflow_runner
+from src.api.workflows.session_writer import session_writer
+from src.cache.research_cache import research_cache
+from src.cache.agent_cache import agent_cache
+from src.cache.audio_cache import audio_cache
+from src.agents.agent_pool import agent_pools
+from src.config.llm_config import llm_config_handler
+from src.config.model_router import model_router
+from src.config.rate_limiter import rate_limiter
+from src.api.tracing import tracer
+from src.api.event_log import event_log
 
 def calculate_workers():
     return (multiprocessing.cpu_count() * 2) + 1
@@ -27,6 +40,69 @@ app.add_middleware(
 async def health():
     return Response(status_code=200, content="API is Running")
 
+# Workflow runner load on this worker
+@app.get("/health/workflows")
+async def workflows_health():
+    return workflow_runner.stats()
+
+# Research cache usage on this worker
+@app.get("/health/research-cache")
+async def research_cache_health():
+    return research_cache.stats()
+
+# Agent run cache usage on this worker
+@app.get("/health/agent-cache")
+async def agent_cache_health():
+    return agent_cache.stats()
+
+# Audio clips cache usage on this worker
+@app.get("/health/audio-cache")
+async def audio_cache_health():
+    return audio_cache.stats()
+
+# Queued session writes on this worker
+@app.get("/health/session-writer")
+async def session_writer_health():
+    return session_writer.stats()
+
+# Workflow handles and agent copies on this worker
+@app.get("/health/pools")
+async def pools_health():
+    return {
+        "workflows": sessions.workflow_pool.stats(),
+        "agents": agent_pools.stats(),
+    }
+
+# Shared HTTP connection pools on this worker
+@app.get("/health/http")
+async def http_health():
+    return llm_config_handler.get_http_stats()
+
+# Latency, hedges and fallbacks of the model routes on this worker
+@app.get("/health/model-routes")
+async def model_routes_health():
+    return model_router.stats()
+
+# Outbound request budgets shared by the workers, with the calls of this worker
+@app.get("/health/rate-limits")
+async def rate_limits_health():
+    return await asyncio.to_thread(rate_limiter.stats)
+
+# Background research jobs on this worker
+@app.get("/health/research-jobs")
+async def research_jobs_health():
+    return sessions.research_jobs.stats()
+
+# WebSocket events logged for replay on this worker
+@app.get("/health/event-log")
+async def event_log_health():
+    return event_log.stats()
+
+# Stage latency, token and cache metrics of this worker, in the Prometheus text format
+@app.get("/metrics")
+async def metrics():
+    return Response(content=tracer.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(sessions.router)
 
 if __name__ == "__main__":
@@ -36,6 +112,8 @@ if __name__ == "__main__":
         "port": 9000,
         "host": "0.0.0.0",
         "reload": True,
-        "log_level": "debug"
+        "log_level": "debug",
+        # compresses the frames of the clients offering permessage-deflate
+        "ws_per_message_deflate": os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
     }
     uvicorn.run(**uvicorn_config)
\ No newline at end of file
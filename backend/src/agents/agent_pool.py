@@ -0,0 +1,89 @@
+import os
+import threading
+from contextlib import contextmanager
+from agno.agent import Agent
+from src.config.llm_config import llm_config_handler
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class AgentPool:
+    """Copies of a template agent, each used by one run at a time.
+
+    An agno ``Agent`` keeps the state of its current run and the memory of all its runs on
+    the instance, so the module level agents can't serve concurrent sessions. Runs check
+    out an idle copy instead, its memory is cleared when it is checked back in. The copies
+    share one set of model clients on the worker's pooled HTTP clients.
+    """
+
+    def __init__(self, template: Agent, max_idle: int = 32):
+        self.template = template
+        self.max_idle = max_idle
+        self.__idle: List[Agent] = []
+        self.__model_clients: Optional[Dict[str, Any]] = None
+        self.__lock = threading.Lock()
+        self.__created = 0
+        self.__checked_out = 0
+
+    def __new_agent(self) -> Agent:
+        agent = self.template.deep_copy()
+        model = getattr(agent, "model", None)
+        if model is not None and hasattr(model, "get_client"):
+            with self.__lock:
+                if self.__model_clients is None:
+                    # the template keeps no clients, deep_copy would copy them and their pools
+                    self.__model_clients = llm_config_handler.get_model_clients(model)
+            for name, client in self.__model_clients.items():
+                setattr(model, name, client)
+        return agent
+
+    @contextmanager
+    def checkout(self) -> Iterator[Agent]:
+        with self.__lock:
+            agent = self.__idle.pop() if self.__idle else None
+            if agent is None:
+                self.__created += 1
+            self.__checked_out += 1
+        if agent is None:
+            agent = self.__new_agent()
+        try:
+            yield agent
+        finally:
+            if getattr(agent, "memory", None) is not None:
+                agent.memory.clear()
+            with self.__lock:
+                self.__checked_out -= 1
+                if len(self.__idle) < self.max_idle:
+                    self.__idle.append(agent)
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {"created": self.__created, "idle": len(self.__idle), "checked_out": self.__checked_out}
+
+
+class AgentPools:
+    """One ``AgentPool`` per template agent."""
+
+    def __init__(self, max_idle: int = 32):
+        self.max_idle = max_idle
+        self.__pools: Dict[int, AgentPool] = {}
+        self.__lock = threading.Lock()
+
+    def get_pool(self, template: Agent) -> AgentPool:
+        with self.__lock:
+            pool = self.__pools.get(id(template))
+            if pool is None or pool.template is not template:
+                pool = AgentPool(template, max_idle=self.max_idle)
+                self.__pools[id(template)] = pool
+            return pool
+
+    def checkout(self, template: Agent):
+        """Context manager handing out a copy of the template agent for one run."""
+        return self.get_pool(template).checkout()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self.__lock:
+            pools = list(self.__pools.values())
+        return {getattr(pool.template, "name", None) or str(id(pool.template)): pool.stats() for pool in pools}
+
+
+agent_pools = AgentPools(max_idle=int(os.getenv("AGENT_POOL_MAX_IDLE", "32")))
@@ -1,8 +1,8 @@
-from src.config.llm_config import llm_config_handler
+from src.config.model_router import model_router
 from agno.agent import Agent
 
 agent = Agent(
-    model=llm_config_handler.get_groq_base_model(),
+    model=model_router.get_model("chat"),
     description="""You are a passionate and enthusiastic professor who loves sharing knowledge with students. 
         When given a topic, respond with an enthusiastic confirmation message 
         expressing your excitement to curate a course on that topic""",
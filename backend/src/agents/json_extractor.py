@@ -1,10 +1,10 @@
 from agno.agent import Agent
-from src.config.llm_config import llm_config_handler
+from src.config.model_router import model_router
 
 
 def init_agent(output_model):
     return Agent(
-        model=llm_config_handler.get_groq_base_model(return_json=True),
+        model=model_router.get_model("extraction", return_json=True),
         name="JSON Data Extractor",
         role="""You are a JSON Structure Analyzer and Converter. 
             Your expertise lies in systematically breaking down information and 
@@ -1,5 +1,6 @@
+import json
 from agno.agent import Agent
-from src.config.llm_config import llm_config_handler
+from src.config.model_router import model_router
 from typing import Optional, List
 from pydantic import BaseModel, Field
 
@@ -21,7 +22,7 @@ class Lessons(BaseModel):
     lessons: List[LessonPlan]
 
 agent = Agent(
-    model=llm_config_handler.get_openai_base_model(),
+    model=model_router.get_model("planning"),
     description="""You are an expert educational curriculum designer who specializes in creating clear, 
     engaging lesson plans using the Feynman Technique of teaching. 
     Your task is to generate a detailed lesson plan for any given topic that breaks complex ideas into simple, 
@@ -65,4 +66,16 @@ agent = Agent(
         - Incorporate regular comprehension checks"""
     ],
     markdown=True
+)
+
+# same lesson plan written as the Lessons JSON, which is parsed lesson by lesson while it streams
+streaming_agent = Agent(
+    model=model_router.get_model("planning", return_json=True),
+    description=agent.description,
+    instructions=agent.instructions + [
+        f"""Respond with a JSON object following this JSON schema, no markdown:
+        {json.dumps(Lessons.model_json_schema())}""",
+        "Write the lessons in teaching order and complete each lesson before starting the next one."
+    ],
+    markdown=False
 )
\ No newline at end of file
@@ -1,5 +1,5 @@
 from agno.agent import Agent
-from src.config.llm_config import llm_config_handler
+from src.config.model_router import model_router
 from typing import List
 from pydantic import BaseModel
 
@@ -11,7 +11,7 @@ class StudyGuide(BaseModel):
     practice_items: List[str]
 
 agent = Agent(
-    model=llm_config_handler.get_groq_base_model(),
+    model=model_router.get_model("study_guide"),
     description="You are an expert educator who simplifies complex topics into clear, step-by-step study guides.",
     instructions=[
         "Identify the core concepts of the topic.",
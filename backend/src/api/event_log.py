@@ -0,0 +1,282 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from typing import Any, Deque, Dict, List, Optional, Union
+from src.config.logging_config import logger
+from src.api.wire_protocol import encode_event
+
+# sent live but neither stored nor replayed, the AUDIO_TRANSCRIPT that follows carries the whole text
+TRANSIENT_EVENTS = {"AUDIO_TRANSCRIPT_DELTA"}
+
+
+class LoggedEvent:
+    """An event of the session log, serialized once for each wire protocol it is sent with."""
+
+    def __init__(
+        self,
+        seq: int,
+        event_type: Optional[str] = None,
+        message: Any = None,
+        payload: Optional[str] = None,
+        transient: bool = False
+    ):
+        self.seq = seq
+        # not stored, its seq is the one of the stored event it follows
+        self.transient = transient
+        self.__event_type = event_type
+        self.__message = message
+        self.__payloads: Dict[str, Union[str, bytes]] = {}
+        if payload is not None:
+            self.__payloads["legacy"] = payload
+
+    @property
+    def payload(self) -> str:
+        """The event in the legacy protocol, the form it is stored in."""
+        return self.encode("legacy")
+
+    def encode(self, protocol: str) -> Union[str, bytes]:
+        payload = self.__payloads.get(protocol)
+        if payload is None:
+            if self.__event_type is None:
+                # read back from storage, only the legacy payload is known
+                event = orjson.loads(self.__payloads["legacy"])
+                self.__event_type, self.__message = event["type"], event["message"]
+            payload = encode_event(protocol, self.__event_type, self.__message, self.seq)
+            self.__payloads[protocol] = payload
+        return payload
+
+
+class _SessionLog:
+    def __init__(self, last_seq: int, events: List[LoggedEvent], max_events: int):
+        self.last_seq = last_seq
+        self.events: Deque[LoggedEvent] = deque(events, maxlen=max_events)
+
+
+class SessionEventLog:
+    """Append-only log of the WebSocket events of every session, numbered by ``seq``.
+
+    An event is serialized once per wire protocol and the same payload is sent live and
+    replayed to clients reconnecting with the last ``seq`` they got. The last
+    ``max_events_per_session`` events of recently used sessions are kept in memory. With
+    ``db_file`` set, SQLite is the log: every worker numbers the events of a session in
+    the same transaction that stores them, since a research job on one worker and the
+    reconnected socket on another can append to the same session, and replays read it.
+    Events are stored on a writer thread, off the event loop, ``TRANSIENT_EVENTS`` aren't.
+    """
+
+    def __init__(
+        self,
+        db_file: Optional[str] = "tmp/session_events.db",
+        max_events_per_session: int = 1000,
+        max_sessions_in_memory: int = 1024,
+        ttl_seconds: int = 24 * 3600,
+        cleanup_interval: float = 600.0,
+    ):
+        self.db_file = db_file
+        self.max_events_per_session = max_events_per_session
+        self.max_sessions_in_memory = max_sessions_in_memory
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval = cleanup_interval
+        self.__sessions: "OrderedDict[str, _SessionLog]" = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__last_cleanup = 0.0
+        self.__counters = {"appended": 0, "replayed": 0, "replayed_from_db": 0}
+        self.__db_executor: Optional[ThreadPoolExecutor] = None
+        if db_file:
+            self.__create_tables()
+            # the writer thread, it stores the events of this worker in the order they were submitted
+            self.__db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-events")
+
+    def __connect(self) -> sqlite3.Connection:
+        # one connection per thread, appends on the event loop don't reopen the file
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            # transactions are started explicitly, an append takes the write lock right away
+            connection = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+        return connection
+
+    def __create_tables(self):
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        connection = self.__connect()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS session_events (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            )
+        """)
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS session_events_created_at ON session_events (created_at)"
+        )
+
+    def __read(self, session_id: str, after_seq: int, limit: int) -> List[LoggedEvent]:
+        rows = self.__connect().execute(
+            """SELECT seq, payload FROM (
+                SELECT seq, payload FROM session_events WHERE session_id = ? AND seq > ?
+                ORDER BY seq DESC LIMIT ?
+            ) ORDER BY seq""",
+            (session_id, after_seq, limit)
+        ).fetchall()
+        return [LoggedEvent(seq, payload=payload) for seq, payload in rows]
+
+    def __read_last_seq(self, session_id: str) -> int:
+        return self.__connect().execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM session_events WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+    def __insert(self, session_id: str, event: Dict[str, Any]) -> LoggedEvent:
+        """Numbers the event after the last one stored by any worker and stores it, in one transaction."""
+        connection = self.__connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            logged = LoggedEvent(self.__read_last_seq(session_id) + 1, event_type=event["type"], message=event["message"])
+            connection.execute(
+                "INSERT INTO session_events VALUES (?, ?, ?, ?)",
+                (session_id, logged.seq, logged.payload, time.time())
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        return logged
+
+    def __trim(self, session_id: str, last_seq: int):
+        self.__connect().execute(
+            "DELETE FROM session_events WHERE session_id = ? AND seq <= ?",
+            (session_id, last_seq - self.max_events_per_session)
+        )
+
+    def __cleanup(self):
+        expired = self.__connect().execute(
+            "DELETE FROM session_events WHERE created_at <= ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        if expired:
+            logger.info(f"Session event log: {expired} expired events deleted")
+
+    def __load(self, session_id: str) -> _SessionLog:
+        events = self.__read(session_id, 0, self.max_events_per_session) if self.db_file else []
+        return _SessionLog(
+            last_seq=events[-1].seq if events else 0,
+            events=events,
+            max_events=self.max_events_per_session
+        )
+
+    def __remember(self, session_id: str, session_log: _SessionLog) -> _SessionLog:
+        with self.__lock:
+            # another caller may have loaded it meanwhile, keep the first one
+            session_log = self.__sessions.setdefault(session_id, session_log)
+            self.__sessions.move_to_end(session_id)
+            while len(self.__sessions) > self.max_sessions_in_memory:
+                self.__sessions.popitem(last=False)
+        return session_log
+
+    def __get_session_log(self, session_id: str) -> _SessionLog:
+        with self.__lock:
+            session_log = self.__sessions.get(session_id)
+            if session_log is not None:
+                self.__sessions.move_to_end(session_id)
+                return session_log
+        # not opened on this worker, read the stored events now
+        return self.__remember(session_id, self.__load(session_id))
+
+    async def open(self, session_id: str):
+        """Loads the stored events of the session off the event loop, before its socket appends.
+
+        A session log already loaded on this worker rereads the last ``seq`` stored by any worker.
+        """
+        with self.__lock:
+            session_log = self.__sessions.get(session_id)
+        if session_log is None:
+            self.__remember(session_id, await asyncio.to_thread(self.__load, session_id))
+        elif self.db_file:
+            last_seq = await asyncio.to_thread(self.__read_last_seq, session_id)
+            with self.__lock:
+                session_log.last_seq = max(session_log.last_seq, last_seq)
+        if self.db_file and time.time() - self.__last_cleanup > self.cleanup_interval:
+            self.__last_cleanup = time.time()
+            self.__db_executor.submit(self.__cleanup)
+
+    def __store(self, session_id: str, event: Dict[str, Any]) -> LoggedEvent:
+        session_log = self.__get_session_log(session_id)
+        if self.db_file:
+            logged = self.__insert(session_id, event)
+            if logged.seq % 100 == 0:
+                self.__trim(session_id, logged.seq)
+        with self.__lock:
+            if not self.db_file:
+                logged = LoggedEvent(session_log.last_seq + 1, event_type=event["type"], message=event["message"])
+            # the events other workers appended in between are only in SQLite, see replay
+            session_log.last_seq = max(session_log.last_seq, logged.seq)
+            session_log.events.append(logged)
+            self.__counters["appended"] += 1
+        return logged
+
+    def __get_transient(self, event: Dict[str, Any], session_id: str) -> LoggedEvent:
+        # numbered like the last event of the session known here, a client keeping the highest seq misses nothing
+        with self.__lock:
+            session_log = self.__sessions.get(session_id)
+            last_seq = session_log.last_seq if session_log is not None else 0
+        return LoggedEvent(last_seq, event_type=event["type"], message=event["message"], transient=True)
+
+    def submit(self, session_id: str, event: Dict[str, Any]) -> "asyncio.Future[LoggedEvent]":
+        """Numbers the ``{"type", "message"}`` event, the future gets it once it is stored.
+
+        Called on the event loop. With ``db_file`` set the event is stored on the writer
+        thread, in one transaction with its ``seq`` so that it is unique across workers, and
+        the events of this worker keep the order they were submitted in.
+        """
+        loop = asyncio.get_running_loop()
+        if event["type"] in TRANSIENT_EVENTS or not self.db_file:
+            future = loop.create_future()
+            logged = self.__get_transient(event, session_id) if event["type"] in TRANSIENT_EVENTS else self.__store(session_id, event)
+            future.set_result(logged)
+            return future
+        return asyncio.wrap_future(self.__db_executor.submit(self.__store, session_id, event), loop=loop)
+
+    async def aappend(self, session_id: str, event: Dict[str, Any]) -> LoggedEvent:
+        """Numbers and stores the event, its encodings are what goes over the socket."""
+        return await self.submit(session_id, event)
+
+    async def replay(self, session_id: str, after_seq: int) -> List[LoggedEvent]:
+        """Events of the session with a ``seq`` above ``after_seq``, oldest first."""
+        await self.open(session_id)
+        session_log = await asyncio.to_thread(self.__get_session_log, session_id)
+        with self.__lock:
+            events = [event for event in session_log.events if event.seq > after_seq]
+            last_seq = session_log.last_seq
+        # the events in memory miss the older ones and those appended by other workers
+        if self.db_file and [event.seq for event in events] != list(range(after_seq + 1, last_seq + 1)):
+            events = await asyncio.to_thread(self.__read, session_id, after_seq, self.max_events_per_session)
+            self.__counters["replayed_from_db"] += len(events)
+        self.__counters["replayed"] += len(events)
+        return events
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {**self.__counters, "sessions_in_memory": len(self.__sessions)}
+
+
+def __create_event_log() -> SessionEventLog:
+    return SessionEventLog(
+        db_file=os.getenv("EVENT_LOG_DB", "tmp/session_events.db") or None,
+        max_events_per_session=int(os.getenv("EVENT_LOG_MAX_EVENTS", "1000")),
+        max_sessions_in_memory=int(os.getenv("EVENT_LOG_MEMORY_SESSIONS", "1024")),
+        ttl_seconds=int(os.getenv("EVENT_LOG_TTL_SECONDS", str(24 * 3600))),
+    )
+
+
+event_log = __create_event_log()
@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from src.config.logging_config import logger
+from src.api.event_log import LoggedEvent, SessionEventLog
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class ResearchJob:
+    """A research run in the background, its WebSocket events are kept for its subscribers.
+
+    Events are appended to the session event log when published, a subscriber gets them
+    from the start of the job or after the last ``seq`` it got, so a socket attaching late
+    misses nothing. Status and progress changes are published as ``RESEARCH_JOB`` events.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        session_id: str,
+        params: Dict[str, Any],
+        event_log: SessionEventLog,
+        on_progress: Callable[["ResearchJob"], None]
+    ):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.params = params
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.events: List["asyncio.Future[LoggedEvent]"] = []
+        self.task: Optional[asyncio.Task] = None
+        self.__event_log = event_log
+        self.__on_progress = on_progress
+        self.__changed = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "error": self.error,
+        }
+
+    async def __notify(self):
+        async with self.__changed:
+            self.__changed.notify_all()
+
+    def publish(self, event: Dict[str, Any]):
+        """Adds a ``{"type", "message"}`` event, sent to the subscribers in order once it is stored."""
+        self.events.append(self.__event_log.submit(self.session_id, event))
+        asyncio.ensure_future(self.__notify())
+
+    def __publish_status(self):
+        self.publish({"type": "RESEARCH_JOB", "message": json.dumps(self.to_dict())})
+        self.__on_progress(self)
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        if status == "completed":
+            self.progress = 1.0
+        self.__publish_status()
+
+    def set_progress(self, stage: str, progress: float):
+        self.stage = stage
+        self.progress = progress
+        self.__publish_status()
+
+    async def subscribe(self, after_seq: int = 0) -> AsyncIterator[LoggedEvent]:
+        """Yields the events of the job numbered above ``after_seq``, then the new ones until it is finished."""
+        index = 0
+        while True:
+            while index < len(self.events):
+                event = await self.events[index]
+                # a transient event numbered after_seq came after the last event the subscriber got
+                if event.seq > after_seq or (event.transient and event.seq == after_seq):
+                    yield event
+                index += 1
+            if self.finished:
+                return
+            async with self.__changed:
+                await self.__changed.wait_for(lambda: index < len(self.events) or self.finished)
+
+    async def wait(self):
+        """Waits until the job is finished, whatever its outcome."""
+        if self.task is not None:
+            await asyncio.wait([self.task])
+
+
+class RemoteResearchJob:
+    """The unfinished job of a session run by another worker, followed through the shared SQLite files.
+
+    Its events are read from the session event log and its status from the job table every
+    ``poll_interval`` seconds. Once the lease of the other worker expires the job is resumed
+    on this worker and followed there.
+    """
+
+    def __init__(self, row: sqlite3.Row, queue: "ResearchJobQueue", event_log: SessionEventLog, poll_interval: float):
+        self.job_id = row["job_id"]
+        self.session_id = row["session_id"]
+        self.params = json.loads(row["params"])
+        self.status = row["status"]
+        self.progress = row["progress"]
+        self.task: Optional[asyncio.Task] = None
+        self.__expires_at = row["expires_at"]
+        self.__queue = queue
+        self.__event_log = event_log
+        self.__poll_interval = poll_interval
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def __is_job_start(self, event: LoggedEvent) -> bool:
+        event = json.loads(event.payload)
+        return event["type"] == "RESEARCH_JOB" and json.loads(event["message"])["job_id"] == self.job_id
+
+    async def __get_start_seq(self) -> int:
+        """``seq`` of the first event of the job, 0 when it is no longer in the log."""
+        for event in await self.__event_log.replay(self.session_id, after_seq=0):
+            if self.__is_job_start(event):
+                return event.seq
+        return 0
+
+    async def subscribe(self, after_seq: int = 0) -> AsyncIterator[LoggedEvent]:
+        """Yields the events of the job numbered above ``after_seq``, then the new ones until it is finished."""
+        after_seq = max(after_seq, await self.__get_start_seq() - 1)
+        while True:
+            for event in await self.__event_log.replay(self.session_id, after_seq=after_seq):
+                after_seq = event.seq
+                yield event
+            if self.finished:
+                return
+            await asyncio.sleep(self.__poll_interval)
+            row = await self.__queue.read_job(self.job_id)
+            self.status, self.progress, self.__expires_at = row["status"], row["progress"], row["expires_at"]
+            if not self.finished and self.__expires_at <= time.time():
+                # the other worker went away, the job goes on here
+                resumed = await self.__queue.attach(self.session_id)
+                if isinstance(resumed, ResearchJob):
+                    async for event in resumed.subscribe(after_seq=after_seq):
+                        yield event
+                    self.status = resumed.status
+                    return
+
+
+class ResearchJobQueue:
+    """Research jobs of this worker, run by ``run_job`` with at most ``max_workers`` at once.
+
+    A session has at most one unfinished job: submitting the same params again attaches to
+    it, other params cancel it. With ``db_file`` set, jobs are also recorded in SQLite with
+    a lease refreshed while they run, so a job left unfinished by a worker that went away
+    is resumed when its session reconnects. Resumed jobs rerun from the start, the research
+    cache and the stored session fields make the finished steps cheap. A session reconnecting
+    to another worker while its job still runs follows it as a ``RemoteResearchJob``.
+    """
+
+    def __init__(
+        self,
+        run_job: Callable[[ResearchJob], Awaitable[None]],
+        event_log: SessionEventLog,
+        max_workers: int = 8,
+        db_file: Optional[str] = None,
+        lease_seconds: int = 30,
+        poll_interval: float = 0.5,
+    ):
+        self.max_workers = max_workers
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.__run_job = run_job
+        self.__event_log = event_log
+        self.__owner = uuid.uuid4().hex
+        self.__slots = asyncio.Semaphore(max_workers)
+        self.__jobs: Dict[str, ResearchJob] = {}
+        self.__session_jobs: Dict[str, ResearchJob] = {}
+        # one follower per session, a topic sent again gets the one that is already forwarded
+        self.__remote_jobs: Dict[str, RemoteResearchJob] = {}
+        self.__counters = {
+            "submitted": 0, "attached": 0, "resumed": 0, "followed": 0, "completed": 0, "failed": 0, "cancelled": 0
+        }
+        self.__db_executor: Optional[ThreadPoolExecutor] = None
+        if db_file:
+            self.__create_tables()
+            # a single thread keeps the status writes of a job in order
+            self.__db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="research-jobs")
+
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_file, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def __create_tables(self):
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self.__connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS research_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS research_jobs_session_id ON research_jobs (session_id)"
+            )
+        connection.close()
+
+    def __insert(self, job_id: str, session_id: str, params: Dict[str, Any]):
+        now = time.time()
+        with self.__connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO research_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, session_id, json.dumps(params), "queued", 0.0,
+                 self.__owner, now + self.lease_seconds, now, now)
+            )
+        connection.close()
+
+    def __update(self, job_id: str, status: str, progress: float):
+        now = time.time()
+        with self.__connect() as connection:
+            connection.execute(
+                "UPDATE research_jobs SET status = ?, progress = ?, expires_at = ?, updated_at = ? WHERE job_id = ? AND owner = ?",
+                (status, progress, now + self.lease_seconds, now, job_id, self.__owner)
+            )
+        connection.close()
+
+    def __read_job(self, job_id: str) -> sqlite3.Row:
+        with self.__connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute("SELECT * FROM research_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        connection.close()
+        return row
+
+    def __claim_orphan(self, session_id: str) -> Tuple[Optional[sqlite3.Row], bool]:
+        """The unfinished job of another worker for the session, and whether it was taken over.
+
+        A job is taken over when its lease expired, else it still runs on the other worker.
+        """
+        now = time.time()
+        with self.__connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute(
+                f"""SELECT * FROM research_jobs WHERE session_id = ?
+                    AND status NOT IN ({",".join("?" * len(FINISHED_STATUSES))})
+                    ORDER BY created_at DESC LIMIT 1""",
+                (session_id, *FINISHED_STATUSES)
+            ).fetchone()
+            claimed = False
+            if row is not None and row["owner"] == self.__owner:
+                # finished here, its status is not written yet
+                row = None
+            elif row is not None and row["expires_at"] <= now:
+                claimed = connection.execute(
+                    "UPDATE research_jobs SET owner = ?, expires_at = ? WHERE job_id = ? AND expires_at <= ?",
+                    (self.__owner, now + self.lease_seconds, row["job_id"], now)
+                ).rowcount == 1
+                if not claimed:
+                    # another worker took it over first, follow it there
+                    row = connection.execute("SELECT * FROM research_jobs WHERE job_id = ?", (row["job_id"],)).fetchone()
+        connection.close()
+        return row, claimed
+
+    async def __call_db(self, func: Callable, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.__db_executor, func, *args)
+
+    async def read_job(self, job_id: str) -> sqlite3.Row:
+        """The stored row of a job, for following a job of another worker."""
+        return await self.__call_db(self.__read_job, job_id)
+
+    def __record(self, job: ResearchJob):
+        if self.db_file:
+            # status rows are small, written off the loop without waiting for them
+            self.__db_executor.submit(self.__update, job.job_id, job.status, job.progress)
+
+    async def __heartbeat(self, job: ResearchJob):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self.__call_db(self.__update, job.job_id, job.status, job.progress)
+
+    async def __run(self, job: ResearchJob):
+        heartbeat = asyncio.ensure_future(self.__heartbeat(job)) if self.db_file else None
+        try:
+            async with self.__slots:
+                job.set_status("running")
+                await self.__run_job(job)
+            job.set_status("completed")
+        except asyncio.CancelledError:
+            job.set_status("cancelled")
+        except Exception as e:
+            logger.error(f"Research job {job.job_id} failed, Error: {e}")
+            job.set_status("failed", error=str(e))
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+
+    def __on_done(self, job: ResearchJob):
+        if not job.finished:
+            # cancelled before it started running
+            job.set_status("cancelled")
+        self.__counters[job.status] += 1
+        self.__jobs.pop(job.job_id, None)
+        if self.__session_jobs.get(job.session_id) is job:
+            self.__session_jobs.pop(job.session_id, None)
+
+    def __start(self, job_id: str, session_id: str, params: Dict[str, Any]) -> ResearchJob:
+        job = ResearchJob(
+            job_id=job_id,
+            session_id=session_id,
+            params=params,
+            event_log=self.__event_log,
+            on_progress=self.__record
+        )
+        self.__jobs[job_id] = job
+        self.__session_jobs[session_id] = job
+        job.task = asyncio.ensure_future(self.__run(job))
+        job.task.add_done_callback(lambda _: self.__on_done(job))
+        job.publish({"type": "RESEARCH_JOB", "message": json.dumps(job.to_dict())})
+        return job
+
+    async def submit(self, session_id: str, params: Dict[str, Any]) -> Union[ResearchJob, RemoteResearchJob]:
+        """Starts a job for the session, or returns its unfinished job with the same params.
+
+        The unfinished job of another worker is not cancelled, it is left to finish there.
+        """
+        current = await self.__find(session_id)
+        if current is not None and not current.finished:
+            if current.params == params:
+                self.__counters["attached"] += 1
+                return current
+            if isinstance(current, RemoteResearchJob):
+                logger.warning(f"Research job {current.job_id} of session {session_id} runs on another worker, it is not cancelled")
+            else:
+                self.cancel(current.job_id)
+        self.__counters["submitted"] += 1
+        job_id = uuid.uuid4().hex
+        if self.db_file:
+            await self.__call_db(self.__insert, job_id, session_id, params)
+        return self.__start(job_id, session_id, params)
+
+    async def __find(self, session_id: str) -> Optional[Union[ResearchJob, RemoteResearchJob]]:
+        current = self.__session_jobs.get(session_id)
+        if current is not None and not current.finished:
+            return current
+        if not self.db_file:
+            return None
+        row, claimed = await self.__call_db(self.__claim_orphan, session_id)
+        if row is None:
+            return None
+        if claimed:
+            logger.info(f"Resuming research job {row['job_id']} of session {session_id}")
+            self.__counters["resumed"] += 1
+            self.__remote_jobs.pop(session_id, None)
+            return self.__start(row["job_id"], session_id, json.loads(row["params"]))
+        remote = self.__remote_jobs.get(session_id)
+        if remote is None or remote.job_id != row["job_id"] or remote.finished:
+            self.__counters["followed"] += 1
+            self.__remote_jobs = {key: job for key, job in self.__remote_jobs.items() if not job.finished}
+            remote = RemoteResearchJob(row, self, self.__event_log, self.poll_interval)
+            self.__remote_jobs[session_id] = remote
+        return remote
+
+    async def attach(self, session_id: str) -> Optional[Union[ResearchJob, RemoteResearchJob]]:
+        """Returns the unfinished job of the session, resuming it when its worker went away.
+
+        The job of another worker that is still running is followed, not resumed.
+        """
+        current = self.__session_jobs.get(session_id)
+        if current is not None and not current.finished:
+            self.__counters["attached"] += 1
+            return current
+        return await self.__find(session_id)
+
+    def get(self, job_id: str) -> Optional[ResearchJob]:
+        return self.__jobs.get(job_id)
+
+    def get_session_job(self, session_id: str) -> Optional[ResearchJob]:
+        return self.__session_jobs.get(session_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.__jobs.get(job_id)
+        if job is None or job.finished or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        statuses = [job.status for job in self.__jobs.values()]
+        return {
+            **self.__counters,
+            "max_workers": self.max_workers,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "following": sum(1 for job in self.__remote_jobs.values() if not job.finished),
+        }
@@ -1,25 +1,40 @@
-import io
+import os
 import uuid
 import json
+import asyncio
+from contextlib import aclosing
 from src.config.llm_config import llm_config_handler
 from src.config.logging_config import logger
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Request, Response, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from typing import Iterator
+from typing import AsyncIterator, Optional, Union
 from agno.workflow import RunResponse
 from src.api.workflows.session_manager import SessionManager
 from src.api.workflows.lessons_plan_generator import LessonsPlanGenerator
 from src.api.workflows.research_topic import DeepResearcher
-from src.api.workflows.audio_generator import AudioGenerator
+from src.api.workflows.audio_generator import AudioGenerator, tts_executor
+from src.api.workflow_runner import workflow_runner
+from src.api.workflows.session_writer import session_writer
+from src.api.workflows.workflow_pool import WorkflowPool
+from src.api.tracing import RunTrace, tracer
+from src.api.research_jobs import RemoteResearchJob, ResearchJob, ResearchJobQueue
+from src.api.event_log import LoggedEvent, event_log
+from src.api.wire_protocol import PROTOCOLS, encode_message
+from src.config.rate_limiter import is_rate_limited, listen_queue
 from dotenv import load_dotenv
-from fastapi.responses import StreamingResponse
-from src.utils import get_researcher, run_report_generation
+from fastapi.responses import FileResponse, StreamingResponse
+from src.cache.research_cache import research_cache
 
 load_dotenv()
 
 router = APIRouter()
 
 session_storage = llm_config_handler.get_workflow_storage("lesson_gen")
+# workflow handles are reused across connections
+workflow_pool = WorkflowPool(
+    storage=session_storage,
+    max_idle_per_workflow=int(os.getenv("WORKFLOW_POOL_MAX_IDLE", "256"))
+)
 
 audio_gen_handler = AudioGenerator()
 class SessionResponse(BaseModel):
@@ -31,98 +46,295 @@ class AudiogenRequest(BaseModel):
 
 class AudioGenRequest(BaseModel):
     text: str
+    stream: bool = True
 
 @router.post("/session")
 async def create_new_session():
     """Creates a new session and returns the session ID."""
     session_id = str(uuid.uuid4())
     # init session
-    session_handler = SessionManager(
-        session_id=session_id,
-        storage=session_storage
-
-    )
-    session_handler.run()
+    with workflow_pool.checkout(SessionManager, session_id) as session_handler:
+        await workflow_runner.call(session_handler.run)
     return SessionResponse(
-        session_id=session_handler.session_id
+        session_id=session_id
     )
 
+def __get_audio_error_response(e: Exception) -> Response:
+    logger.error(f"Audio Generation Failed, Error: {e}")
+    if is_rate_limited(e):
+        return Response(status_code=429, content="Audio Generation Rate Limited", headers={"Retry-After": "5"})
+    return Response(status_code=502, content="Audio Generation Failed")
+
+
+async def __get_audio_response(text: str, stream: bool, range_header: Optional[str]) -> Response:
+    audio_path = audio_gen_handler.get_cached_audio_path(text)
+    if audio_path is None and (range_header or not stream):
+        # ranges are served from the complete clip
+        loop = asyncio.get_running_loop()
+        try:
+            audio_path = await loop.run_in_executor(tts_executor, audio_gen_handler.generate_audio_file, text)
+        except Exception as e:
+            return __get_audio_error_response(e)
+    if audio_path is not None:
+        # handles Range requests and uses sendfile when the server supports it
+        return FileResponse(audio_path, media_type="audio/mpeg")
+
+    audio_stream = audio_gen_handler.stream_audio_chunked(text)
+    # wait for the first chunk so a failing synthesis still gets an error status
+    try:
+        first_chunk = await audio_stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except Exception as e:
+        return __get_audio_error_response(e)
+
+    async def audio_chunks():
+        yield first_chunk
+        async for chunk in audio_stream:
+            yield chunk
+
+    return StreamingResponse(audio_chunks(), media_type="audio/mpeg")
+
+
 @router.post("/generate-audio")
-async def generate_audio_endpoint(audio_gen_request: AudioGenRequest):
-    audio_bytes = audio_gen_handler.generate_audio(text=audio_gen_request.text)  # Adjust parameters as needed
-    
-    # Wrap the bytes in a BytesIO stream.
-    audio_stream = io.BytesIO(audio_bytes)
-    
-    # Return the stream as a StreamingResponse with the appropriate media type.
-    return StreamingResponse(audio_stream, media_type="audio/mpeg")
+async def generate_audio_endpoint(audio_gen_request: AudioGenRequest, request: Request):
+    """Streams the audio for the text as it is synthesized, set stream to false to get the complete clip."""
+    return await __get_audio_response(
+        text=audio_gen_request.text,
+        stream=audio_gen_request.stream,
+        range_header=request.headers.get("range")
+    )
+
+
+@router.get("/generate-audio")
+async def replay_audio_endpoint(text: str, request: Request):
+    """Same as the POST endpoint for audio elements, which replay with Range requests."""
+    return await __get_audio_response(
+        text=text,
+        stream=True,
+        range_header=request.headers.get("range")
+    )
+
+
+def __get_timing_event(*traces: Optional[RunTrace]) -> dict:
+    """The stage timings of the traces as a single TIMING event."""
+    stages = [stage for trace in traces if trace is not None for stage in trace.to_list()]
+    return {
+        "type": "TIMING",
+        "message": json.dumps(stages)
+    }
+
+
+async def __run_research_job(job: ResearchJob):
+    """Crawls the topic then runs DeepResearcher, publishing its events on the job."""
+    topic = job.params["topic"]
+    job.set_progress("research_crawl", 0.0)
+    crawl_trace = tracer.start_trace(workflow=DeepResearcher.__name__)
+    with crawl_trace.stage("research_crawl") as span:
+        researcher, report = await research_cache.get_or_research(topic=topic, span=span)
+
+    # the job keeps its own handle, it outlives the socket that submitted it
+    # calls waiting for the rate limiter are published as QUEUED events of the job
+    with listen_queue(job.publish), workflow_pool.checkout(DeepResearcher, job.session_id) as deep_research_handler:
+        stage_done_events = deep_research_handler.research_stage_done_events
+        done_events = {event: stage for stage, events in stage_done_events.items() for event in events}
+        job.set_progress("research_stages", 0.5)
+        study_guide_resp_iterator: AsyncIterator[RunResponse] = workflow_runner.run(
+            deep_research_handler,
+            topic=topic,
+            researcher=researcher,
+            report=report,
+            emit_as_completed=job.params["emit_as_completed"],
+            whiteboard_patch=job.params["whiteboard_patch"]
+        )
+        completed_stages = 0
+        async with aclosing(study_guide_resp_iterator):
+            async for response in study_guide_resp_iterator:
+                if response.event in deep_research_handler.custom_events:
+                    job.publish({
+                        "type": response.event,
+                        "message": response.content
+                    })
+                if response.event in done_events:
+                    completed_stages += 1
+                    job.set_progress("research_stages", 0.5 + 0.5 * completed_stages / len(stage_done_events))
+        # queued session writes are durable once the workflow is over
+        await session_writer.aflush(job.session_id)
+        if job.params["timing"]:
+            job.publish(__get_timing_event(crawl_trace, deep_research_handler.trace))
+
+
+research_jobs = ResearchJobQueue(
+    run_job=__run_research_job,
+    event_log=event_log,
+    max_workers=int(os.getenv("RESEARCH_JOB_WORKERS", "8")),
+    db_file=os.getenv("RESEARCH_JOB_DB", "tmp/research_jobs.db") or None,
+    lease_seconds=int(os.getenv("RESEARCH_JOB_LEASE_SECONDS", "30")),
+    poll_interval=float(os.getenv("RESEARCH_JOB_POLL_SECONDS", "0.5")),
+)
+
+
+async def __send(websocket: WebSocket, payload: Union[str, bytes]):
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+
+
+async def __send_logged(websocket: WebSocket, logged: "asyncio.Future[LoggedEvent]", protocol: str):
+    await __send(websocket, (await logged).encode(protocol))
+
+
+async def __forward_job_events(websocket: WebSocket, job: Union[ResearchJob, RemoteResearchJob], protocol: str, after_seq: int):
+    async for event in job.subscribe(after_seq=after_seq):
+        await __send(websocket, event.encode(protocol))
+
+
+def __get_queue_publisher(websocket: WebSocket, session_id: str, protocol: str):
+    def publish(event: dict):
+        # submitted right away, the events keep their order while they are stored
+        task = asyncio.ensure_future(__send_logged(websocket, event_log.submit(session_id, event), protocol))
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return publish
+
+
+def __start_forwarding(
+    websocket: WebSocket, job: Union[ResearchJob, RemoteResearchJob], protocol: str, after_seq: int = 0
+) -> asyncio.Task:
+    task = asyncio.ensure_future(__forward_job_events(websocket, job, protocol, after_seq))
+    # a closed socket ends the forwarding, not the job
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return task
 
 
 @router.websocket("/session/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    """Handles WebSocket connections and requires a valid session ID."""
-    
+async def websocket_endpoint(websocket: WebSocket, session_id: str, last_seq: Optional[int] = None, protocol: str = "legacy"):
+    """Handles WebSocket connections and requires a valid session ID.
+
+    Events carry a ``seq``, a client reconnecting with ``?last_seq=`` gets the events it missed.
+    ``?protocol=`` selects how events are framed, see ``wire_protocol``. Clients offering
+    permessage-deflate get compressed frames unless WS_PER_MESSAGE_DEFLATE is off.
+    Workflow messages with ``"whiteboard_patch": true`` get the board as a ``WHITEBOARD_PATCH``
+    against the last board of the session, see ``whiteboard_diff``. ``PLAN_LESSONS`` with
+    ``"stream_lessons": true`` sends the board again each time a lesson of the plan is complete.
+    While a model call waits for the rate limiter shared by the workers the client gets
+    ``QUEUED`` events with its position in the queue, position 0 once the call is made.
+    ``PLAN_LESSONS`` waits for the research job of the session, on whichever worker it runs,
+    and gets an ``ERROR`` event instead of a plan when the research did not complete.
+    """
+    if protocol not in PROTOCOLS:
+        await websocket.close(code=1008, reason=f"Unknown protocol, expected one of {', '.join(PROTOCOLS)}")
+        return
+
     await websocket.accept()
 
-    # if session is accepted then initialize lessons and study guide handler
-    deep_research_handler = DeepResearcher(
-        session_id=session_id,
-        storage=session_storage
-    )
+    await event_log.open(session_id)
+    replayed_seq = 0
+    if last_seq is not None:
+        replayed_seq = last_seq
+        for event in await event_log.replay(session_id, after_seq=last_seq):
+            await __send(websocket, event.encode(protocol))
+            replayed_seq = event.seq
 
-    lessons_planning_handler = LessonsPlanGenerator(
-        session_id=session_id,
-        storage=session_storage
-    )
-    
-    while True:
-        try:
-            raw_data = await websocket.receive_text()
-            logger.info(f"Received from {session_id}: {raw_data}")
+    # research runs as a background job, the socket only forwards its events, also of a job on another worker
+    research_job: Optional[Union[ResearchJob, RemoteResearchJob]] = await research_jobs.attach(session_id)
+    research_forwarder: Optional[asyncio.Task] = None
+    if research_job is not None:
+        research_forwarder = __start_forwarding(websocket, research_job, protocol, after_seq=replayed_seq)
 
-            # Attempt to parse JSON
+    # if session is accepted then check out the lessons handler for the connection
+    with workflow_pool.checkout(LessonsPlanGenerator, session_id) as lessons_planning_handler:
+        while True:
             try:
-                data = json.loads(raw_data)
-            except json.JSONDecodeError:
-                await websocket.send_text(json.dumps({"error": "Invalid JSON format"}))
-                continue
-
-            # Process message type
-            if isinstance(data, dict) and "type" in data:
-                message_type = data["type"].upper()
-
-                if message_type == "RESEARCH_TOPIC":
-                    topic = data["topic"]
-                    researcher = get_researcher(query=topic)
-                    report = await run_report_generation(researcher=researcher)
-                    study_guide_resp_iterator: Iterator[RunResponse] = deep_research_handler.run(
-                        topic=topic,
-                        researcher=researcher,
-                        report=report
-                    )
-                    for response in study_guide_resp_iterator:
-                        # You might want to serialize the response to JSON or format it as needed
-                        if response.event in deep_research_handler.custom_events:
-                            await websocket.send_text(json.dumps({
-                                "type": response.event,
-                                "message": response.content
-                            }))
-
-                elif message_type == "PLAN_LESSONS":
-                    topic = data["topic"]
-                    study_guide_resp_iterator: Iterator[RunResponse] = lessons_planning_handler.run()
-                    for response in study_guide_resp_iterator:
-                        # You might want to serialize the response to JSON or format it as needed
-                        if response.event in lessons_planning_handler.custom_events:
-                            await websocket.send_text(json.dumps({
-                                "type": response.event,
-                                "message": response.content
-                            }))
-                else:
-                    response = {"type": "ECHO", "message": f"Received: {data}"}
-
-        except WebSocketDisconnect:
-            logger.info(f"Session {session_id} disconnected")
-            break
-        except Exception as e:
-            logger.error(f"Error in session {session_id}: {e}")
\ No newline at end of file
+                raw_data = await websocket.receive_text()
+                logger.info(f"Received from {session_id}: {raw_data}")
+
+                # Attempt to parse JSON
+                try:
+                    data = json.loads(raw_data)
+                except json.JSONDecodeError:
+                    await __send(websocket, encode_message(protocol, {"error": "Invalid JSON format"}))
+                    continue
+
+                # Process message type
+                if isinstance(data, dict) and "type" in data:
+                    message_type = data["type"].upper()
+
+                    if message_type == "RESEARCH_TOPIC":
+                        job = await research_jobs.submit(session_id, {
+                            "topic": data["topic"],
+                            "emit_as_completed": bool(data.get("emit_as_completed", False)),
+                            "timing": bool(data.get("timing", False)),
+                            "whiteboard_patch": bool(data.get("whiteboard_patch", False)),
+                        })
+                        # the same job is already forwarded when the topic is sent again
+                        if job is not research_job or research_forwarder.done():
+                            if research_forwarder is not None:
+                                research_forwarder.cancel()
+                            research_job = job
+                            research_forwarder = __start_forwarding(websocket, job, protocol)
+
+                    elif message_type == "CANCEL_RESEARCH":
+                        job = research_jobs.get(data["job_id"]) if data.get("job_id") else research_jobs.get_session_job(session_id)
+                        if job is not None and job.session_id == session_id:
+                            research_jobs.cancel(job.job_id)
+
+                    elif message_type == "PLAN_LESSONS":
+                        topic = data["topic"]
+                        # lessons are planned from the research, let its job and events finish first
+                        if research_job is None or research_job.finished:
+                            # a job may have started on another worker since the socket connected
+                            job = await research_jobs.attach(session_id)
+                            if job is not None:
+                                research_job = job
+                                research_forwarder = __start_forwarding(websocket, job, protocol)
+                        if research_forwarder is not None:
+                            await asyncio.wait([research_forwarder])
+                        if research_job is not None and research_job.status != "completed":
+                            # planning now would run without the report of the research
+                            where = " on another worker" if isinstance(research_job, RemoteResearchJob) else ""
+                            reason = research_job.status if research_job.finished else f"still running{where}"
+                            error_event = await event_log.aappend(session_id, {
+                                "type": "ERROR",
+                                "message": json.dumps({"error": f"Research {reason}", "job_id": research_job.job_id})
+                            })
+                            await __send(websocket, error_event.encode(protocol))
+                            continue
+                        study_guide_resp_iterator: AsyncIterator[RunResponse] = workflow_runner.run(
+                            lessons_planning_handler,
+                            whiteboard_patch=bool(data.get("whiteboard_patch", False)),
+                            stream_lessons=bool(data.get("stream_lessons", False))
+                        )
+                        # closed before the handler is used again, also when the socket fails mid run
+                        with listen_queue(__get_queue_publisher(websocket, session_id, protocol)):
+                            async with aclosing(study_guide_resp_iterator):
+                                async for response in study_guide_resp_iterator:
+                                    # You might want to serialize the response to JSON or format it as needed
+                                    if response.event in lessons_planning_handler.custom_events:
+                                        logged = await event_log.aappend(session_id, {
+                                            "type": response.event,
+                                            "message": response.content
+                                        })
+                                        await __send(websocket, logged.encode(protocol))
+                        await session_writer.aflush(session_id)
+                        if data.get("timing", False):
+                            timing_event = __get_timing_event(lessons_planning_handler.trace)
+                            await __send(websocket, (await event_log.aappend(session_id, timing_event)).encode(protocol))
+                    else:
+                        response = {"type": "ECHO", "message": f"Received: {data}"}
+
+            except WebSocketDisconnect:
+                logger.info(f"Session {session_id} disconnected")
+                # the research job goes on, a reconnecting socket attaches to it again
+                if research_forwarder is not None:
+                    research_forwarder.cancel()
+                await session_writer.aflush(session_id)
+                break
+            except Exception as e:
+                logger.error(f"Error in session {session_id}: {e}")
+                # the client would otherwise keep waiting for the events of the message
+                error = "Rate limit reached, try again later" if is_rate_limited(e) else "Failed to process the message"
+                try:
+                    await __send(websocket, encode_message(protocol, {"error": error}))
+                except Exception:
+                    pass
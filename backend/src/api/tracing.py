@@ -0,0 +1,211 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+# seconds, from a cached lookup to a full research crawl
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class StageSpan:
+    """Measurements of one stage of a workflow run."""
+
+    def __init__(self, workflow: str, stage: str):
+        self.workflow = workflow
+        self.stage = stage
+        self.wall_time: Optional[float] = None
+        self.queue_wait: Optional[float] = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache: Optional[str] = None
+        self.cost = 0.0
+        self.failed = False
+
+    def record_tokens(self, input_tokens: int, output_tokens: int):
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+
+    def record_run_metrics(self, metrics: Optional[Dict[str, Any]]):
+        """Adds the token counts of an agno ``RunResponse.metrics``, one value per model call."""
+        if not metrics:
+            return
+        self.record_tokens(
+            input_tokens=sum(metrics.get("input_tokens", None) or []),
+            output_tokens=sum(metrics.get("output_tokens", None) or []),
+        )
+
+    def record_cache(self, hit: bool):
+        self.cache = "hit" if hit else "miss"
+
+    def record_cost(self, cost: Optional[float]):
+        self.cost += cost or 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.stage,
+            "wall_time": round(self.wall_time, 4) if self.wall_time is not None else None,
+            "queue_wait": round(self.queue_wait, 4) if self.queue_wait is not None else None,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache": self.cache,
+            "cost": self.cost,
+            "failed": self.failed,
+        }
+
+
+class RunTrace:
+    """Stage spans of one workflow run, every finished span is also added to the worker metrics."""
+
+    def __init__(self, tracer: "Tracer", workflow: str):
+        self.workflow = workflow
+        self.__tracer = tracer
+        self.__spans: List[StageSpan] = []
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, stage: str, queued_at: Optional[float] = None) -> Iterator[StageSpan]:
+        """Times the block as ``stage``, ``queued_at`` is the ``perf_counter()`` it was scheduled at."""
+        span = StageSpan(self.workflow, stage)
+        started = time.perf_counter()
+        if queued_at is not None:
+            span.queue_wait = started - queued_at
+        try:
+            yield span
+        except BaseException:
+            span.failed = True
+            raise
+        finally:
+            span.wall_time = time.perf_counter() - started
+            with self.__lock:
+                self.__spans.append(span)
+            self.__tracer.observe(span)
+
+    def traced(self, stage: str, func: Callable[[StageSpan], Any]) -> Callable[[], Any]:
+        """Wraps ``func(span)`` for a pool, the time until it starts is its queue wait."""
+        queued_at = time.perf_counter()
+
+        def run_stage():
+            with self.stage(stage, queued_at=queued_at) as span:
+                return func(span)
+        return run_stage
+
+    def atraced(self, stage: str, func: Callable[[StageSpan], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        """Async counterpart of ``traced``, the time until the task starts is its queue wait."""
+        queued_at = time.perf_counter()
+
+        async def run_stage():
+            with self.stage(stage, queued_at=queued_at) as span:
+                return await func(span)
+        return run_stage
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        with self.__lock:
+            return [span.to_dict() for span in self.__spans]
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Tracer:
+    """Stage latency, token and cache metrics of this worker, rendered in the Prometheus text format.
+
+    Every uvicorn worker keeps its own metrics, like the ``/health`` endpoints.
+    """
+
+    def __init__(self, prefix: str = "elevare"):
+        self.prefix = prefix
+        self.__lock = threading.Lock()
+        self.__histograms: Dict[str, Dict[Tuple, Histogram]] = {}
+        self.__counters: Dict[str, Dict[Tuple, float]] = {}
+
+    def start_trace(self, workflow: str) -> RunTrace:
+        return RunTrace(self, workflow)
+
+    def __observe(self, name: str, labels: Tuple, value: float):
+        self.__histograms.setdefault(name, {}).setdefault(labels, Histogram()).observe(value)
+
+    def __count(self, name: str, labels: Tuple, value: float = 1):
+        counters = self.__counters.setdefault(name, {})
+        counters[labels] = counters.get(labels, 0) + value
+
+    def observe(self, span: StageSpan):
+        labels = (("workflow", span.workflow), ("stage", span.stage))
+        with self.__lock:
+            self.__observe("stage_duration_seconds", labels, span.wall_time)
+            if span.queue_wait is not None:
+                self.__observe("stage_queue_wait_seconds", labels, span.queue_wait)
+            if span.input_tokens:
+                self.__count("stage_tokens_total", labels + (("direction", "input"),), span.input_tokens)
+            if span.output_tokens:
+                self.__count("stage_tokens_total", labels + (("direction", "output"),), span.output_tokens)
+            if span.cache is not None:
+                self.__count("stage_cache_total", labels + (("result", span.cache),))
+            if span.cost:
+                self.__count("stage_cost_usd_total", labels, span.cost)
+            if span.failed:
+                self.__count("stage_failures_total", labels)
+
+    def observe_admission_wait(self, seconds: float):
+        """Time a workflow run waited for a free run slot of the workflow runner."""
+        with self.__lock:
+            self.__observe("workflow_admission_wait_seconds", (), seconds)
+
+    def observe_model_request(self, route: str, kind: str, model: str, seconds: float, outcome: str):
+        """One request of a model route, only successful requests are added to the latency histogram."""
+        labels = (("route", route), ("kind", kind), ("model", model))
+        with self.__lock:
+            if outcome == "ok":
+                self.__observe("model_request_seconds", labels, seconds)
+            self.__count("model_requests_total", labels + (("outcome", outcome),))
+
+    def observe_rate_limit_wait(self, provider: str, lane: str, seconds: float):
+        """Time an outbound call waited for the rate limiter, 0 when it went through right away."""
+        with self.__lock:
+            self.__observe("rate_limit_wait_seconds", (("provider", provider), ("lane", lane)), seconds)
+
+    def count_model_route_event(self, route: str, event: str):
+        """A hedge, hedge win or fallback of a model route."""
+        with self.__lock:
+            self.__count("model_route_events_total", (("route", route), ("event", event)))
+
+    @staticmethod
+    def __format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+        if not labels and not extra:
+            return ""
+        escaped = []
+        for name, value in labels + extra:
+            value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            escaped.append(f'{name}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        lines = []
+        with self.__lock:
+            for name, series in sorted(self.__histograms.items()):
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                for labels, histogram in series.items():
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{self.prefix}_{name}_bucket{self.__format_labels(labels, (('le', bound),))} {count}")
+                    lines.append(f"{self.prefix}_{name}_bucket{self.__format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{self.prefix}_{name}_sum{self.__format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{self.prefix}_{name}_count{self.__format_labels(labels)} {histogram.count}")
+            for name, series in sorted(self.__counters.items()):
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{self.prefix}_{name}{self.__format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
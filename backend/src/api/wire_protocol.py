@@ -0,0 +1,34 @@
+import orjson
+import msgpack
+from typing import Any, Dict, Union
+
+# legacy: text frames, JSON messages sent as JSON encoded strings (the default)
+# json: text frames, JSON messages embedded as they are
+# msgpack: binary frames, JSON messages decoded into the msgpack document
+PROTOCOLS = ("legacy", "json", "msgpack")
+
+# events whose message is plain text, the message of the others is a JSON document
+TEXT_MESSAGE_EVENTS = {"AUDIO_TRANSCRIPT", "AUDIO_TRANSCRIPT_DELTA"}
+
+
+def encode_message(protocol: str, message: Dict[str, Any]) -> Union[str, bytes]:
+    """Encodes a message sent outside the session event log."""
+    if protocol == "msgpack":
+        return msgpack.packb(message)
+    return orjson.dumps(message).decode("utf-8")
+
+
+def encode_event(protocol: str, event_type: str, message: Any, seq: int) -> Union[str, bytes]:
+    if protocol == "legacy":
+        return orjson.dumps({"type": event_type, "message": message, "seq": seq}).decode("utf-8")
+    is_document = isinstance(message, str) and event_type not in TEXT_MESSAGE_EVENTS
+    if protocol == "msgpack":
+        return msgpack.packb({
+            "type": event_type,
+            "message": orjson.loads(message) if is_document else message,
+            "seq": seq,
+        })
+    # the message already is JSON, it is written into the event without being parsed
+    message_json = message if is_document else orjson.dumps(message).decode("utf-8")
+    event_type_json = orjson.dumps(event_type).decode("utf-8")
+    return f'{{"type":{event_type_json},"message":{message_json},"seq":{seq}}}'
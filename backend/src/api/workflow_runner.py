@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator
+from agno.workflow import RunResponse
+from src.config.logging_config import logger
+from src.api.tracing import tracer
+
+_ITERATOR_DONE = object()
+
+
+class WorkflowRunner:
+    """Runs workflows without blocking the event loop.
+
+    In ``async`` mode the workflow ``arun()`` generator is consumed directly on the loop.
+    In ``thread`` mode every step of the sync ``run()`` iterator (each ``next()``) is
+    executed on a bounded thread pool and the produced ``RunResponse`` is handed back to
+    the event loop, so a slow LLM call only holds a pool thread instead of the worker.
+    Both modes share the per-worker limit on concurrent runs.
+    """
+
+    def __init__(self, max_concurrent_runs: int = 32, max_threads: int = None, execution_mode: str = "async"):
+        self.execution_mode = execution_mode
+        self.max_concurrent_runs = max_concurrent_runs
+        self.max_threads = max_threads or max_concurrent_runs
+        self.__executor = ThreadPoolExecutor(
+            max_workers=self.max_threads,
+            thread_name_prefix="workflow-runner"
+        )
+        self.__slots = asyncio.Semaphore(max_concurrent_runs)
+        self.__waiting = 0
+        self.__active = 0
+        self.__completed = 0
+        self.__failed = 0
+
+    @asynccontextmanager
+    async def admit(self):
+        """Waits for a free run slot, limiting the concurrent runs on this worker."""
+        self.__waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await self.__slots.acquire()
+        finally:
+            self.__waiting -= 1
+        tracer.observe_admission_wait(time.perf_counter() - queued_at)
+        self.__active += 1
+        try:
+            yield
+        finally:
+            self.__active -= 1
+            self.__slots.release()
+
+    async def call(self, func: Callable, *args: Any) -> Any:
+        """Runs a single blocking call on the pool, in a copy of the caller's context."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, contextvars.copy_context().run, func, *args)
+
+    async def stream(self, start: Callable[[], Iterator[RunResponse]]) -> AsyncIterator[RunResponse]:
+        """Streams the responses of a workflow run produced off the event loop.
+
+        ``start`` creates the iterator (e.g. ``lambda: handler.run(...)``), it is called on
+        the pool too since the workflow reads its session from storage when it starts.
+        """
+        async with self.admit():
+            iterator = await self.call(start)
+            try:
+                while True:
+                    response = await self.call(next, iterator, _ITERATOR_DONE)
+                    if response is _ITERATOR_DONE:
+                        break
+                    yield response
+                self.__completed += 1
+            except Exception:
+                self.__failed += 1
+                raise
+            finally:
+                # release the generator on the pool, closing it runs its cleanup code
+                if hasattr(iterator, "close"):
+                    await self.call(iterator.close)
+
+    async def astream(self, responses: AsyncIterator[RunResponse]) -> AsyncIterator[RunResponse]:
+        """Streams the responses of a workflow ``arun()`` within the run limit."""
+        async with self.admit():
+            try:
+                async for response in responses:
+                    yield response
+                self.__completed += 1
+            except Exception:
+                self.__failed += 1
+                raise
+            finally:
+                await responses.aclose()
+
+    def run(self, workflow, **kwargs: Any) -> AsyncIterator[RunResponse]:
+        """Streams a workflow run in the configured execution mode."""
+        if self.execution_mode == "thread" or not hasattr(workflow, "arun"):
+            return self.stream(lambda: workflow.run(**kwargs))
+        return self.astream(workflow.arun(**kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "execution_mode": self.execution_mode,
+            "max_concurrent_runs": self.max_concurrent_runs,
+            "max_threads": self.max_threads,
+            "active_runs": self.__active,
+            "waiting_runs": self.__waiting,
+            "queued_steps": self.__executor._work_queue.qsize(),
+            "completed_runs": self.__completed,
+            "failed_runs": self.__failed,
+        }
+
+
+def __create_runner() -> WorkflowRunner:
+    max_concurrent_runs = int(os.getenv("WORKFLOW_MAX_CONCURRENT_RUNS", "32"))
+    max_threads = int(os.getenv("WORKFLOW_MAX_THREADS", str(max_concurrent_runs)))
+    execution_mode = os.getenv("WORKFLOW_EXECUTION_MODE", "async").lower()
+    logger.info(f"Workflow runner: {max_concurrent_runs} concurrent runs in {execution_mode} mode")
+    return WorkflowRunner(
+        max_concurrent_runs=max_concurrent_runs,
+        max_threads=max_threads,
+        execution_mode=execution_mode
+    )
+
+
+workflow_runner = __create_runner()
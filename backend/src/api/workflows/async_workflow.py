@@ -0,0 +1,110 @@
+import json
+import asyncio
+from uuid import uuid4
+from agno.memory.workflow import WorkflowRun
+from agno.workflow import Workflow, RunResponse
+from agno.utils.log import logger
+from src.api.workflows.session_documents import SessionDocuments
+from src.api.workflows.session_writer import session_writer
+from src.api.workflows.whiteboard_diff import WHITEBOARD_STATE_PATH, get_whiteboard_patch, next_whiteboard_state
+from src.api.tracing import RunTrace, tracer
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+
+class AsyncWorkflow(Workflow):
+    """Workflow with an ``arun()`` async generator next to the sync ``run()``.
+
+    agno only wraps ``run()`` with the session bookkeeping (``run_workflow``), so the same
+    is done here for ``arun()``, with the storage round trips moved off the event loop.
+    """
+    # stage timings of the last run
+    trace: Optional[RunTrace] = None
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._subclass_arun: Optional[Callable] = None
+        if self.__class__.arun is not AsyncWorkflow.arun:
+            self._subclass_arun = self.__class__.arun.__get__(self)
+            object.__setattr__(self, "arun", self.arun_workflow)
+
+    async def arun(self, **kwargs: Any) -> AsyncIterator[RunResponse]:
+        raise NotImplementedError(f"{self.__class__.__name__}.arun() method not implemented.")
+        yield
+
+    def start_trace(self) -> RunTrace:
+        """Starts the stage timings of a run, they stay on ``trace`` once the run is over."""
+        self.trace = tracer.start_trace(workflow=self.__class__.__name__)
+        return self.trace
+
+    def open_session_documents(self) -> SessionDocuments:
+        """Large session fields of this session, fields saved before are read from the session state."""
+        return SessionDocuments(
+            storage=self.storage,
+            session_id=self.session_id,
+            legacy_state=self.session_state.get("session", None)
+        )
+
+    def get_whiteboard_responses(self, documents: SessionDocuments, items: List[Dict], as_patch: bool) -> List[RunResponse]:
+        """Sends the board as a ``WHITEBOARD_PATCH`` against the last one of the session, or in full.
+
+        The board is recorded either way, ``WHITEBOARD_STATE_PATH`` should be loaded with the
+        other fields of the run so this doesn't read the storage.
+        """
+        state = documents.get(WHITEBOARD_STATE_PATH)
+        documents.set(WHITEBOARD_STATE_PATH, next_whiteboard_state(state, items))
+        if as_patch:
+            return [RunResponse(event="WHITEBOARD_PATCH", content=json.dumps(get_whiteboard_patch(state, items)))]
+        return [
+            RunResponse(event="WHITEBOARD_RESET", content=json.dumps({})),
+            RunResponse(event="WHITEBOARD_UPDATE", content=json.dumps(items)),
+        ]
+
+    def read_from_storage(self):
+        # queued writes of the session go out first
+        session_writer.flush(self.session_id)
+        return super().read_from_storage()
+
+    def write_to_storage(self):
+        if session_writer.enabled and self.storage is not None:
+            self.workflow_session = session_writer.submit_session(self.storage, self.get_workflow_session())
+            return self.workflow_session
+        return super().write_to_storage()
+
+    async def aread_from_storage(self):
+        return await asyncio.to_thread(self.read_from_storage)
+
+    async def awrite_to_storage(self):
+        return await asyncio.to_thread(self.write_to_storage)
+
+    async def arun_workflow(self, **kwargs: Any) -> AsyncIterator[RunResponse]:
+        """Async counterpart of ``Workflow.run_workflow`` for ``arun()`` generators"""
+        self.set_debug()
+        self.set_workflow_id()
+        self.set_session_id()
+        self.initialize_memory()
+
+        self.run_id = str(uuid4())
+        self.run_input = kwargs
+        self.run_response = RunResponse(
+            run_id=self.run_id,
+            session_id=self.session_id,
+            workflow_id=self.workflow_id,
+            content=""
+        )
+
+        await self.aread_from_storage()
+        self.update_agent_session_ids()
+
+        logger.debug(f"*********** Workflow Async Run Start: {self.run_id} ***********")
+        async for item in self._subclass_arun(**kwargs):
+            if isinstance(item, RunResponse):
+                item.run_id = self.run_id
+                item.session_id = self.session_id
+                item.workflow_id = self.workflow_id
+                if item.content is not None and isinstance(item.content, str):
+                    self.run_response.content += item.content
+            yield item
+
+        self.memory.add_run(WorkflowRun(input=self.run_input, response=self.run_response))
+        await self.awrite_to_storage()
+        logger.debug(f"*********** Workflow Async Run End: {self.run_id} ***********")
@@ -1,48 +1,240 @@
 import os
+import re
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
 from agno.utils.log import logger
 from elevenlabs.client import ElevenLabs
-from typing import Iterator
+from src.cache.audio_cache import AudioCache, audio_cache
+from src.config.llm_config import llm_config_handler
+from src.config.rate_limiter import is_rate_limited, rate_limiter
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional
 
 load_dotenv()
 client = ElevenLabs(
-    api_key=os.getenv("ELEVEN_LABS_API_KEY")
+    api_key=os.getenv("ELEVEN_LABS_API_KEY"),
+    # keep-alive connections shared with the model clients
+    httpx_client=llm_config_handler.get_http_client()
 )
+# the ElevenLabs SDK iterators are blocking, they are consumed on this pool
+tts_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TTS_MAX_THREADS", "8")),
+    thread_name_prefix="tts"
+)
+_STREAM_DONE = object()
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
 class AudioGenerator():
-    def __init__(self, 
+    def __init__(self,
                  voice_id: str = "JBFqnCBsd6RMkjVDRZzb",
                  model_id: str = "eleven_multilingual_v2",
-                 output_format: str = "mp3_44100_128"
+                 output_format: str = "mp3_44100_128",
+                 eleven_labs_client: Optional[ElevenLabs] = None,
+                 clips_cache: Optional[AudioCache] = None,
+                 stream_buffer_chunks: int = 64,
+                 max_segment_chars: int = int(os.getenv("TTS_MAX_SEGMENT_CHARS", "300")),
+                 max_parallel_segments: int = int(os.getenv("TTS_MAX_PARALLEL_SEGMENTS", "3"))
                 ):
         self.__tts_config = {
             "voice_id": voice_id,
             "model_id": model_id,
             "output_format": output_format
         }
-        self.eleven_labs_client = client
+        self.eleven_labs_client = eleven_labs_client or client
+        # completed clips are stored for replays
+        self.clips_cache = clips_cache or audio_cache
+        self.__stream_buffer_chunks = stream_buffer_chunks
+        self.__max_segment_chars = max_segment_chars
+        self.__max_parallel_segments = max_parallel_segments
+
 
-   
     def __get_tts_body(self, text: str):
         return {
             "text": text,
             **self.__tts_config
         }
-                
-    
+
+    def __get_clip_path(self, text: str) -> str:
+        key = self.clips_cache.get_key(text=text, **self.__tts_config)
+        return self.clips_cache.get_file_path(key, self.__tts_config["output_format"])
+
+    def get_cached_audio_path(self, text: str) -> Optional[str]:
+        """Path of the stored clip for the text, None when it was never synthesized."""
+        return self.clips_cache.get(self.__get_clip_path(text))
+
+    def __convert(self, text: str, **tts_params):
+        """Synthesizes the text within the ElevenLabs rate limits shared by the workers."""
+        rate_limiter.acquire("elevenlabs", len(text), lane="interactive")
+        try:
+            return self.eleven_labs_client.text_to_speech.convert(**self.__get_tts_body(text), **tts_params)
+        except Exception as e:
+            if is_rate_limited(e):
+                rate_limiter.penalize("elevenlabs")
+            raise
+
+
+    def __generate(self, text: str) -> bytes:
+        audio_path = self.get_cached_audio_path(text)
+        if audio_path is not None:
+            with open(audio_path, "rb") as audio_file:
+                return audio_file.read()
+        logger.info("Audio Generation Started...")
+        audio = self.__convert(text)
+        logger.info("Audio Generation Finished...")
+        if isinstance(audio, Iterator):
+            audio = b"".join(audio)
+        clip_writer = self.clips_cache.open_writer(self.__get_clip_path(text))
+        clip_writer.write(audio)
+        clip_writer.commit()
+        return audio
+
     def generate_audio(self, text: str):
         try:
-            tts_body = self.__get_tts_body(text)
-            logger.info("Audio Generation Started...")
-            audio = self.eleven_labs_client.text_to_speech.convert(**tts_body)
-            logger.info("Audio Generation Finished...")
-            if isinstance(audio, Iterator):
-                audio = b"".join(audio)
-            return audio
+            return self.__generate(text)
         except Exception as e:
-            logger.info(f"Audio Generation Failed, Error: {e}")
+            if is_rate_limited(e):
+                logger.error(f"Audio Generation Failed, ElevenLabs rate limit reached: {e}")
+            else:
+                logger.error(f"Audio Generation Failed, Error: {e}")
             return None
 
-        
-        
-    
-        
+    def generate_audio_file(self, text: str) -> str:
+        """Synthesizes the text into the clips cache unless stored already, returns the clip path.
+
+        Raises the provider error, a rate limited synthesis can be told apart with ``is_rate_limited``.
+        """
+        audio_path = self.get_cached_audio_path(text)
+        if audio_path is not None:
+            return audio_path
+        self.__generate(text)
+        return self.get_cached_audio_path(text)
+
+    def __synthesize(self, text: str, put: Callable[[Any], None], stopped: threading.Event, **tts_params):
+        """Pushes the audio chunks of the text through ``put``, then the end marker or the error."""
+        try:
+            audio = self.__convert(text, **tts_params)
+            if isinstance(audio, bytes):
+                audio = iter([audio])
+            try:
+                for chunk in audio:
+                    if stopped.is_set():
+                        return
+                    put(chunk)
+            finally:
+                if hasattr(audio, "close"):
+                    audio.close()
+        except Exception as e:
+            put(e)
+            return
+        put(_STREAM_DONE)
+
+    async def __drain(self, chunks: asyncio.Queue) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await chunks.get()
+            if chunk is _STREAM_DONE:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    async def stream_audio(self, text: str) -> AsyncIterator[bytes]:
+        """Streams the synthesized audio chunks as ElevenLabs produces them.
+
+        The SDK iterator is consumed on the TTS pool, the completed clip is kept for replays.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue(maxsize=self.__stream_buffer_chunks)
+        stopped = threading.Event()
+
+        def put(chunk):
+            # blocks while the queue is full, so a slow client slows down the download
+            asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+
+        logger.info("Audio Streaming Started...")
+        producer = loop.run_in_executor(tts_executor, self.__synthesize, text, put, stopped)
+        clip_writer = self.clips_cache.open_writer(self.__get_clip_path(text))
+        try:
+            async for chunk in self.__drain(chunks):
+                clip_writer.write(chunk)
+                yield chunk
+            logger.info("Audio Streaming Finished...")
+            clip_writer.commit()
+        finally:
+            clip_writer.abort()
+            stopped.set()
+            # unblock the producer if it waits on a full queue, it stops at its next chunk
+            if not producer.done():
+                while not chunks.empty():
+                    chunks.get_nowait()
+
+    async def stream_audio_chunked(self, text: str) -> AsyncIterator[bytes]:
+        """Streams the audio of long texts synthesized sentence chunk by sentence chunk.
+
+        Up to ``max_parallel_segments`` segments are synthesized at once, their chunks are
+        buffered and emitted in segment order, so the first segment plays while the next
+        ones are being synthesized. The MP3 streams are concatenated as is.
+        """
+        segments = split_sentences(text, max_chars=self.__max_segment_chars)
+        if len(segments) <= 1:
+            async for chunk in self.stream_audio(text):
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.__max_parallel_segments)
+        stopped = threading.Event()
+        segment_chunks = [asyncio.Queue() for _ in segments]
+
+        async def synthesize(index: int):
+            chunks = segment_chunks[index]
+            tts_params = {
+                # neighbouring text keeps the intonation continuous across segments
+                "previous_text": segments[index - 1] if index > 0 else None,
+                "next_text": segments[index + 1] if index + 1 < len(segments) else None,
+            }
+            async with slots:
+                await loop.run_in_executor(
+                    tts_executor,
+                    partial(
+                        self.__synthesize,
+                        segments[index],
+                        lambda chunk: loop.call_soon_threadsafe(chunks.put_nowait, chunk),
+                        stopped,
+                        **{key: value for key, value in tts_params.items() if value is not None}
+                    )
+                )
+
+        logger.info(f"Audio Streaming Started ({len(segments)} segments)...")
+        producers = [asyncio.ensure_future(synthesize(index)) for index in range(len(segments))]
+        clip_writer = self.clips_cache.open_writer(self.__get_clip_path(text))
+        try:
+            for chunks in segment_chunks:
+                async for chunk in self.__drain(chunks):
+                    clip_writer.write(chunk)
+                    yield chunk
+            logger.info("Audio Streaming Finished...")
+            clip_writer.commit()
+        finally:
+            clip_writer.abort()
+            stopped.set()
+            for producer in producers:
+                producer.cancel()
+
+
+def split_sentences(text: str, max_chars: int = 300) -> List[str]:
+    """Splits the text at sentence boundaries into segments of up to ``max_chars``.
+
+    The first sentence is its own segment so the first audio is ready as soon as possible,
+    a single sentence longer than ``max_chars`` is kept whole.
+    """
+    sentences = [sentence for sentence in _SENTENCE_BOUNDARY.split(text.strip()) if sentence]
+    segments: List[str] = []
+    for sentence in sentences:
+        if len(segments) > 1 and len(segments[-1]) + len(sentence) + 1 <= max_chars:
+            segments[-1] = f"{segments[-1]} {sentence}"
+        else:
+            segments.append(sentence)
+    return segments
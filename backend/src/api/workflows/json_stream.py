@@ -0,0 +1,78 @@
+import re
+import json
+from typing import Any, List, Optional
+
+# characters that change the structure, everything else is skipped in one go
+_STRUCTURE = re.compile(r'["\\{}\[\]]')
+
+
+class JsonArrayStream:
+    """Parses the elements of an array of a streamed JSON object as soon as each one is complete.
+
+    ``key`` names the array in the top level object, text around the object such as a
+    markdown fence is ignored. Only object or array elements are returned. The text is
+    scanned once and only the element being streamed is kept in memory.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.__text = ""
+        self.__pos = 0
+        self.__depth = 0
+        self.__in_string = False
+        self.__string_start: Optional[int] = None
+        self.__last_key: Optional[str] = None
+        self.__in_array = False
+        self.__element_start: Optional[int] = None
+
+    def __trim(self):
+        starts = [start for start in (self.__element_start, self.__string_start) if start is not None]
+        offset = min(starts + [self.__pos, len(self.__text)])
+        if offset:
+            self.__text = self.__text[offset:]
+            self.__pos -= offset
+            if self.__element_start is not None:
+                self.__element_start -= offset
+            if self.__string_start is not None:
+                self.__string_start -= offset
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Adds the next chunk of the text, returns the elements completed by it."""
+        self.__text += chunk
+        elements = []
+        for match in _STRUCTURE.finditer(self.__text, self.__pos):
+            index = match.start()
+            if index < self.__pos:
+                # escaped by the backslash before it
+                continue
+            char = match.group()
+            self.__pos = index + 1
+            if self.__in_string:
+                if char == "\\":
+                    self.__pos = index + 2
+                elif char == '"':
+                    self.__in_string = False
+                    if self.__depth == 1:
+                        # keys and values of the top level object, a key comes right before its array
+                        self.__last_key = self.__text[self.__string_start:index]
+                    self.__string_start = None
+                continue
+            if char == '"':
+                self.__in_string = True
+                if self.__depth == 1:
+                    self.__string_start = index + 1
+            elif char in "{[":
+                self.__depth += 1
+                if self.__depth == 2 and char == "[" and self.__last_key == self.key:
+                    self.__in_array = True
+                elif self.__depth == 3 and self.__in_array:
+                    self.__element_start = index
+            else:
+                if self.__depth == 3 and self.__in_array:
+                    elements.append(json.loads(self.__text[self.__element_start:index + 1]))
+                    self.__element_start = None
+                elif self.__depth == 2:
+                    self.__in_array = False
+                self.__depth = max(self.__depth - 1, 0)
+        self.__trim()
+        return elements
@@ -1,43 +1,48 @@
-import json
+import os
+import asyncio
+import contextvars
 from agno.agent import Agent
-from agno.workflow import Workflow, RunResponse, RunEvent
+from agno.workflow import RunResponse, RunEvent
 from agno.utils.log import logger
 from src.agents import lesson_planner
 from src.agents import confirmation_message_generator
 from src.agents.json_extractor import init_agent
-from typing import Iterator, List, Dict
+from src.api.workflows.async_workflow import AsyncWorkflow
+from src.api.workflows.json_stream import JsonArrayStream
+from src.api.workflows.session_documents import SessionDocuments
+from src.api.workflows.stages import stage_executor
+from src.api.workflows.whiteboard_diff import WHITEBOARD_STATE_PATH
+from src.api.workflows.whiteboard_layout import whiteboard_layout
+from src.cache.agent_cache import agent_cache
+from src.api.tracing import StageSpan
+from pydantic import ValidationError
+from typing import Any, Iterator, AsyncIterator, List, Dict
 
-class LessonsPlanGenerator(Workflow):
+class LessonsPlanGenerator(AsyncWorkflow):
     # create base voice agent for feedback
     confirmation_agent: Agent = confirmation_message_generator.agent
     lesson_planning_agent: Agent = lesson_planner.agent
+    lesson_streaming_agent: Agent = lesson_planner.streaming_agent
     extraction_agent: Agent = init_agent(output_model=lesson_planner.Lessons)
+    # plan as JSON with the markdown rendered locally, one LLM call instead of planner and extractor
+    single_pass: bool = os.getenv("LESSONS_SINGLE_PASS", "true").lower() == "true"
 
     custom_events = [
+        "AUDIO_TRANSCRIPT_DELTA",
         "AUDIO_TRANSCRIPT", 
         "WHITEBOARD_RESET",
-        "WHITEBOARD_UPDATE"]
+        "WHITEBOARD_UPDATE",
+        "WHITEBOARD_PATCH"]
+    lessons_plan_paths = ["lessons.markdown", "lessons.confirmation", "lessons.parsed_data"]
     
     def __generate_whiteboard_state_lessons(self, lessons_obj: lesson_planner.Lessons) -> List[Dict]:
-        items = []
-        
-        # Set initial positions and spacing parameters
-        base_x = 50
-        base_y = 50
-        lesson_gap_y = 300      # vertical gap between lesson plans
-        subtopic_gap_y = 150    # vertical gap between subtopic boxes within the same lesson
-        lesson_box_width = 600
-        lesson_box_height = 200
-        subtopic_box_width = 400
-        subtopic_box_height = 140
-        subtopic_x_offset = base_x + lesson_box_width + 20  # position subtopic boxes to the right of lesson box
+        rows = []
 
         # Loop over each lesson plan
         for lesson_index, lesson in enumerate(lessons_obj.lessons):
-            lesson_y = base_y + lesson_index * lesson_gap_y
-
             # Create a box for the LessonPlan
             lesson_box = {
+                "id": f"lesson:{lesson_index}",
                 "type": "box",
                 "title": lesson.title,
                 "contents": [
@@ -47,15 +52,11 @@ class LessonsPlanGenerator(Workflow):
                     {"type": "text", "text": "Introduction:"},
                     {"type": "sticky", "text": lesson.lesson_introduction},
                 ],
-                "position": {"x": base_x, "y": lesson_y},
-                "size": {"width": lesson_box_width, "height": lesson_box_height}
             }
-            items.append(lesson_box)
 
             # For each subtopic in the lesson plan, create a subtopic box
+            subtopic_boxes = []
             for sub_index, sub in enumerate(lesson.sub_topics):
-                subtopic_y = lesson_y + sub_index * subtopic_gap_y
-
                 # Build contents for the subtopic box
                 sub_contents = [{"type": "sticky", "text": sub.brief_summary}]
                 if sub.analogies:
@@ -64,77 +65,291 @@ class LessonsPlanGenerator(Workflow):
                     sub_contents.append({"type": "sticky", "text": "Real-world Applications:"})
                     for app in sub.real_world_applications:
                         sub_contents.append({"type": "sticky", "text": f"- {app}"})
-                
-                subtopic_box = {
+
+                subtopic_boxes.append({
+                    "id": f"lesson:{lesson_index}:subtopic:{sub_index}",
                     "type": "box",
                     "title": sub.title,
                     "contents": sub_contents,
-                    "position": {"x": subtopic_x_offset, "y": subtopic_y},
-                    "size": {"width": subtopic_box_width, "height": subtopic_box_height}
-                }
-                items.append(subtopic_box)
-        
-        return items
-
-    def __generate_lessons_plan_md(self, topic: str) -> str:
+                })
+            rows.append((lesson_box, subtopic_boxes))
+
+        # lesson boxes in a column, their subtopic boxes stacked to the right, sized to their text
+        return whiteboard_layout.layout_rows(rows, origin=(50, 50), widths=(600, 400))
+
+    def __generate_lessons_plan_md(self, topic: str, span: StageSpan) -> str:
         logger.info("lessons Plan Generation Started (Attempt 1)...")
-        lessons_plan_md = self.lesson_planning_agent.run(topic).content
+        lessons_plan_md = agent_cache.run(self.lesson_planning_agent, topic, span=span)
         logger.info("lessons Plan Generation Finished...")
         return lessons_plan_md
     
-    def __generate_confirmation_msg(self, topic: str) -> str:
+    def __stream_confirmation_msg(self, topic: str, span: StageSpan) -> Iterator[str]:
         logger.info("Confirmation Msg Generation Started (Attempt 1)...")
-        confirmation_msg_response = self.confirmation_agent.run(topic)
+        yield from agent_cache.stream(self.confirmation_agent, topic, span=span)
         logger.info("Confirmation Msg Generation Finished...")
-        return confirmation_msg_response.content
 
-    def run(self) -> Iterator[RunResponse]:
-        # init study plan
-        lessons_plan = self.session_state["session"].get("lessons", {})
-        # fetch current research data
-        research_report = self.session_state["session"]["research"]["report"]
+    async def __agenerate_lessons_plan_md(self, topic: str, span: StageSpan) -> str:
+        logger.info("lessons Plan Generation Started (Attempt 1)...")
+        lessons_plan_md = await agent_cache.arun(self.lesson_planning_agent, topic, span=span)
+        logger.info("lessons Plan Generation Finished...")
+        return lessons_plan_md
+
+    async def __astream_confirmation_msg(self, topic: str, span: StageSpan) -> AsyncIterator[str]:
+        logger.info("Confirmation Msg Generation Started (Attempt 1)...")
+        async for chunk in agent_cache.astream(self.confirmation_agent, topic, span=span):
+            yield chunk
+        logger.info("Confirmation Msg Generation Finished...")
+
+    async def __aextract_lessons(self, lessons_plan_md: str, span: StageSpan) -> lesson_planner.Lessons:
+        return await agent_cache.arun(self.extraction_agent, lessons_plan_md, span=span)
+
+    def __get_confirmation_prompt(self, lessons_plan_md: str) -> str:
+        return f"""Generate a fiendly message walking user through the study plan for lessons:
+                {lessons_plan_md}"""
+
+    def __get_parsed_lessons(self, parsed_lessons) -> lesson_planner.Lessons:
+        if isinstance(parsed_lessons, dict):
+            # parsed data read back from storage is a plain dict
+            return lesson_planner.Lessons.model_validate(parsed_lessons)
+        return parsed_lessons
+
+    def __render_lessons_plan_md(self, lessons_obj: lesson_planner.Lessons) -> str:
+        """Markdown of a streamed plan, for the confirmation message and the stored plan."""
+        lines = []
+        for lesson_index, lesson in enumerate(lessons_obj.lessons):
+            lines += [f"## Lesson {lesson_index + 1}: {lesson.title}", "", lesson.description, "", "### Learning Objectives"]
+            lines += [f"- {obj}" for obj in lesson.learning_objectives]
+            lines += ["", "### Introduction", "", lesson.lesson_introduction, ""]
+            for sub in lesson.sub_topics:
+                lines += [f"### {sub.title}", "", sub.brief_summary, ""]
+                if sub.analogies:
+                    lines += [f"**Analogies:** {sub.analogies}", ""]
+                if sub.real_world_applications:
+                    lines += ["**Real-world Applications:**"] + [f"- {app}" for app in sub.real_world_applications] + [""]
+        return "\n".join(lines).strip()
+
+    def __get_board_responses(self, documents: SessionDocuments, lessons_obj: lesson_planner.Lessons, whiteboard_patch: bool) -> List[RunResponse]:
+        with self.trace.stage("whiteboard_layout"):
+            tl_draw_items = self.__generate_whiteboard_state_lessons(lessons_obj)
+            return self.get_whiteboard_responses(documents, tl_draw_items, as_patch=whiteboard_patch)
+
+    def __add_streamed_lessons(self, lessons: List[lesson_planner.LessonPlan], elements: List[Any]) -> int:
+        """Adds the lessons completed by a chunk of the plan, returns how many were added."""
+        added = 0
+        for element in elements:
+            try:
+                lessons.append(lesson_planner.LessonPlan.model_validate(element))
+                added += 1
+            except ValidationError as e:
+                logger.warning(f"Streamed lesson skipped, Error: {e}")
+        return added
+
+    def __store_streamed_lessons(self, documents: SessionDocuments, lessons_obj: lesson_planner.Lessons):
+        documents.set("lessons.parsed_data", lessons_obj)
+        documents.set("lessons.markdown", self.__render_lessons_plan_md(lessons_obj))
+
+    def __stream_lessons_plan(
+        self,
+        documents: SessionDocuments,
+        research_report,
+        whiteboard_patch: bool,
+        progressive: bool
+    ) -> Iterator[RunResponse]:
+        """Plans the lessons as JSON in a single pass.
+
+        With ``progressive`` every lesson goes to the board as soon as it is complete,
+        otherwise the run sends the board after the confirmation, as with the two-pass plan.
+        """
+        logger.info("Lessons JSON Plan Generation Started (Attempt 1)...")
+        parser = JsonArrayStream("lessons")
+        chunks, lessons = [], []
+        with self.trace.stage("lessons_plan") as span:
+            for chunk in agent_cache.stream(self.lesson_streaming_agent, f"{research_report}", span=span):
+                chunks.append(chunk)
+                if self.__add_streamed_lessons(lessons, parser.feed(chunk)) and progressive:
+                    yield from self.__get_board_responses(documents, lesson_planner.Lessons(lessons=lessons), whiteboard_patch)
+        logger.info("Lessons JSON Plan Generation Finished...")
 
-        if lessons_plan.get("markdown", None):
-            lessons_plan_md = lessons_plan["markdown"]
+        if lessons:
+            lessons_obj = lesson_planner.Lessons(lessons=lessons)
         else:
-            lessons_plan_md = self.__generate_lessons_plan_md(topic=f"{research_report}")
-            lessons_plan["markdown"] = lessons_plan_md
+            # not the expected JSON, extract the lessons from whatever was written
+            with self.trace.stage("extraction") as span:
+                lessons_obj = agent_cache.run(self.extraction_agent, "".join(chunks), span=span)
+        if not lessons and progressive:
+            yield from self.__get_board_responses(documents, lessons_obj, whiteboard_patch)
+        self.__store_streamed_lessons(documents, lessons_obj)
 
+    async def __astream_lessons_plan(
+        self,
+        documents: SessionDocuments,
+        research_report,
+        whiteboard_patch: bool,
+        progressive: bool
+    ) -> AsyncIterator[RunResponse]:
+        """Async counterpart of ``__stream_lessons_plan``."""
+        logger.info("Lessons JSON Plan Generation Started (Attempt 1)...")
+        parser = JsonArrayStream("lessons")
+        chunks, lessons = [], []
+        with self.trace.stage("lessons_plan") as span:
+            async for chunk in agent_cache.astream(self.lesson_streaming_agent, f"{research_report}", span=span):
+                chunks.append(chunk)
+                if self.__add_streamed_lessons(lessons, parser.feed(chunk)) and progressive:
+                    for response in self.__get_board_responses(documents, lesson_planner.Lessons(lessons=lessons), whiteboard_patch):
+                        yield response
+        logger.info("Lessons JSON Plan Generation Finished...")
 
+        if lessons:
+            lessons_obj = lesson_planner.Lessons(lessons=lessons)
+        else:
+            # not the expected JSON, extract the lessons from whatever was written
+            with self.trace.stage("extraction") as span:
+                lessons_obj = await self.__aextract_lessons("".join(chunks), span)
+        if not lessons and progressive:
+            for response in self.__get_board_responses(documents, lessons_obj, whiteboard_patch):
+                yield response
+        self.__store_streamed_lessons(documents, lessons_obj)
+
+    def run(self, whiteboard_patch: bool = False, stream_lessons: bool = False) -> Iterator[RunResponse]:
+        trace = self.start_trace()
+        # study plan and research fields are stored apart from the session state
+        documents = self.open_session_documents()
+        stored = documents.load(*self.lessons_plan_paths, "research.report", WHITEBOARD_STATE_PATH)
+        # fetch current research data
+        research_report = stored["research.report"]
+        if research_report is None:
+            yield RunResponse(event=RunEvent.workflow_completed)
+            return
 
-        if lessons_plan.get("confirmation", None):
-            confirmation_msg = lessons_plan["confirmation"]
+        board_sent = False
+        if stored["lessons.markdown"]:
+            lessons_plan_md = stored["lessons.markdown"]
+        elif (stream_lessons or self.single_pass) and not stored["lessons.parsed_data"]:
+            # the plan comes as JSON, streamed lessons go to the board one by one
+            yield from self.__stream_lessons_plan(documents, research_report, whiteboard_patch, progressive=stream_lessons)
+            lessons_plan_md = documents.get("lessons.markdown")
+            board_sent = stream_lessons
         else:
-            confirmation_msg = self.__generate_confirmation_msg(f"""Generate a fiendly message walking user through the study plan for lessons:
-                {lessons_plan_md}""")
-            lessons_plan["confirmation"] = confirmation_msg
-        
-        yield RunResponse(
-            event="AUDIO_TRANSCRIPT",
-            content=confirmation_msg
-        )
-
-        yield RunResponse(
-            event="WHITEBOARD_RESET",
-            content=json.dumps({})
-        )
-
-        if lessons_plan.get("parsed_data", None):
-            parsed_lessons = lessons_plan["parsed_data"]
+            with trace.stage("lessons_plan") as span:
+                lessons_plan_md = self.__generate_lessons_plan_md(topic=f"{research_report}", span=span)
+            documents.set("lessons.markdown", lessons_plan_md)
+
+        # parse lessons into json format while the confirmation message streams
+        parsed_lessons_future = None
+        if not documents.get("lessons.parsed_data"):
+            parsed_lessons_future = stage_executor.submit(contextvars.copy_context().run, trace.traced(
+                "extraction",
+                lambda span: agent_cache.run(self.extraction_agent, lessons_plan_md, span=span)
+            ))
+
+        try:
+            if stored["lessons.confirmation"]:
+                confirmation_msg = stored["lessons.confirmation"]
+            else:
+                confirmation_chunks = []
+                with trace.stage("confirmation") as span:
+                    for chunk in self.__stream_confirmation_msg(self.__get_confirmation_prompt(lessons_plan_md), span):
+                        confirmation_chunks.append(chunk)
+                        yield RunResponse(
+                            event="AUDIO_TRANSCRIPT_DELTA",
+                            content=chunk
+                        )
+                confirmation_msg = "".join(confirmation_chunks)
+                documents.set("lessons.confirmation", confirmation_msg)
+
+            yield RunResponse(
+                event="AUDIO_TRANSCRIPT",
+                content=confirmation_msg
+            )
+
+            if parsed_lessons_future is not None:
+                documents.set("lessons.parsed_data", parsed_lessons_future.result())
+        finally:
+            if parsed_lessons_future is not None:
+                parsed_lessons_future.cancel()
+        parsed_lessons = self.__get_parsed_lessons(documents.get("lessons.parsed_data"))
+
+        # the board of a streamed plan is already sent
+        whiteboard_responses = [] if board_sent else self.__get_board_responses(documents, parsed_lessons, whiteboard_patch)
+
+        with trace.stage("storage_write"):
+            documents.flush()
+            self.write_to_storage()
+
+        yield from whiteboard_responses
+
+
+        yield RunResponse(event=RunEvent.workflow_completed)
+
+    async def arun(self, whiteboard_patch: bool = False, stream_lessons: bool = False) -> AsyncIterator[RunResponse]:
+        trace = self.start_trace()
+        # study plan and research fields are stored apart from the session state
+        documents = self.open_session_documents()
+        stored = await documents.aload(*self.lessons_plan_paths, "research.report", WHITEBOARD_STATE_PATH)
+        # fetch current research data
+        research_report = stored["research.report"]
+        if research_report is None:
+            yield RunResponse(event=RunEvent.workflow_completed)
+            return
+
+        board_sent = False
+        if stored["lessons.markdown"]:
+            lessons_plan_md = stored["lessons.markdown"]
+        elif (stream_lessons or self.single_pass) and not stored["lessons.parsed_data"]:
+            # the plan comes as JSON, streamed lessons go to the board one by one
+            async for response in self.__astream_lessons_plan(documents, research_report, whiteboard_patch, progressive=stream_lessons):
+                yield response
+            lessons_plan_md = documents.get("lessons.markdown")
+            board_sent = stream_lessons
         else:
-            # parse report inso json format
-            parsed_lessons = self.extraction_agent.run(lessons_plan_md).content
-            lessons_plan["parsed_data"] = parsed_lessons
-        
-        self.session_state["session"]["lessons"] = lessons_plan
-        self.write_to_storage()
-
-        tl_draw_items = self.__generate_whiteboard_state_lessons(parsed_lessons)
-
-        yield RunResponse(
-            event="WHITEBOARD_UPDATE",
-            content=json.dumps(tl_draw_items)
-        )
+            with trace.stage("lessons_plan") as span:
+                lessons_plan_md = await self.__agenerate_lessons_plan_md(topic=f"{research_report}", span=span)
+            documents.set("lessons.markdown", lessons_plan_md)
+
+        # parse lessons into json format while the confirmation message streams
+        parsed_lessons_task = None
+        if not documents.get("lessons.parsed_data"):
+            parsed_lessons_task = asyncio.ensure_future(trace.atraced(
+                "extraction",
+                lambda span: self.__aextract_lessons(lessons_plan_md, span)
+            )())
+
+        try:
+            if stored["lessons.confirmation"]:
+                confirmation_msg = stored["lessons.confirmation"]
+            else:
+                confirmation_chunks = []
+                with trace.stage("confirmation") as span:
+                    async for chunk in self.__astream_confirmation_msg(self.__get_confirmation_prompt(lessons_plan_md), span):
+                        confirmation_chunks.append(chunk)
+                        yield RunResponse(
+                            event="AUDIO_TRANSCRIPT_DELTA",
+                            content=chunk
+                        )
+                confirmation_msg = "".join(confirmation_chunks)
+                documents.set("lessons.confirmation", confirmation_msg)
+
+            yield RunResponse(
+                event="AUDIO_TRANSCRIPT",
+                content=confirmation_msg
+            )
+
+            if parsed_lessons_task is not None:
+                documents.set("lessons.parsed_data", await parsed_lessons_task)
+        finally:
+            if parsed_lessons_task is not None:
+                parsed_lessons_task.cancel()
+        parsed_lessons = self.__get_parsed_lessons(documents.get("lessons.parsed_data"))
+
+        # the board of a streamed plan is already sent
+        whiteboard_responses = [] if board_sent else self.__get_board_responses(documents, parsed_lessons, whiteboard_patch)
+
+        with trace.stage("storage_write"):
+            await documents.aflush()
+            await self.awrite_to_storage()
+
+        for response in whiteboard_responses:
+            yield response
 
 
         yield RunResponse(event=RunEvent.workflow_completed)
@@ -0,0 +1,129 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+TITLE = re.compile(r"^#\s+(.+?)\s*#*$")
+SECTION = re.compile(r"^##\s+(.+?)\s*#*$")
+# "- **Background:** text", "**Key Points**:" or "### Details/Steps"
+LABEL = re.compile(r"^(?:[-*+]\s+)?(?:\*\*|__)([^*_]+?)(?:\*\*|__)\s*:?\s*(.*)$|^#{3,6}\s+(.+?)\s*$")
+LIST_ITEM = re.compile(r"^(?:[-*+]|\d+[.)])\s+(.*)$")
+
+SECTION_NAMES = ("abstract", "introduction", "content", "conclusion", "references")
+LABEL_FIELDS = {
+    "background": "background",
+    "context": "background",
+    "objective": "objective",
+    "objectives": "objective",
+    "goal": "objective",
+    "key points": "key_points",
+    "details/steps": "steps",
+    "details / steps": "steps",
+    "steps": "steps",
+    "details": "steps",
+    "summary": "summary",
+    "key takeaways": "summary",
+    "next steps": "next_steps",
+    "future directions": "next_steps",
+}
+
+
+class ReportParseError(ValueError):
+    """The report doesn't follow the report template closely enough to be parsed locally."""
+
+
+def __normalize(name: str) -> str:
+    # "1. Introduction:" or "**Content**" name the same section as "Content"
+    name = re.sub(r"^[\d.)\s]+", "", name.strip().strip("*_").strip())
+    return name.rstrip(":").strip().lower()
+
+
+def __split_sections(markdown: str) -> Tuple[str, Dict[str, List[str]]]:
+    title = None
+    sections: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    for line in markdown.splitlines():
+        line = line.strip()
+        if title is None:
+            match = TITLE.match(line)
+            if match:
+                title = match.group(1).strip()
+            continue
+        match = SECTION.match(line)
+        if match:
+            name = __normalize(match.group(1))
+            current = sections.setdefault(name, []) if name in SECTION_NAMES else None
+        elif current is not None and line:
+            current.append(line)
+    if title is None:
+        raise ReportParseError("no title heading")
+    return title, sections
+
+
+def __strip_item(line: str) -> str:
+    match = LIST_ITEM.match(line)
+    return match.group(1).strip() if match else line
+
+
+def __split_labels(lines: List[str]) -> Dict[str, List[str]]:
+    """Lines of a section by the template field their label names, label lines included."""
+    fields: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    for line in lines:
+        match = LABEL.match(line)
+        if match:
+            label = __normalize(match.group(1) or match.group(3))
+            if label in LABEL_FIELDS:
+                current = fields.setdefault(LABEL_FIELDS[label], [])
+                text = (match.group(2) or "").strip()
+                if text:
+                    current.append(text)
+                continue
+        if current is not None:
+            current.append(__strip_item(line))
+    return fields
+
+
+def __required_text(fields: Dict[str, List[str]], name: str) -> str:
+    text = " ".join(fields.get(name, [])).strip()
+    if not text:
+        raise ReportParseError(f"missing {name}")
+    return text
+
+
+def parse_report_markdown(markdown: str) -> Dict[str, Any]:
+    """Reads a report written with ``get_report_template()`` into the fields of ``Report``.
+
+    Headings may be numbered and labels may be bold or sub headings, anything further from
+    the template raises ``ReportParseError`` so the caller can fall back to the extractor.
+    """
+    title, sections = __split_sections(markdown)
+    missing = [name for name in SECTION_NAMES if name not in sections]
+    if missing:
+        raise ReportParseError(f"missing sections {', '.join(missing)}")
+
+    introduction = __split_labels(sections["introduction"])
+    content = __split_labels(sections["content"])
+    conclusion = __split_labels(sections["conclusion"])
+    if not content.get("key_points", None):
+        raise ReportParseError("missing key points")
+
+    abstract = " ".join(sections["abstract"]).strip()
+    if not abstract:
+        raise ReportParseError("missing abstract")
+    next_steps = " ".join(conclusion.get("next_steps", [])).strip()
+    return {
+        "title": title,
+        "abstract": abstract,
+        "introduction": {
+            "background": __required_text(introduction, "background"),
+            "objective": __required_text(introduction, "objective"),
+        },
+        "content": {
+            "key_points": content["key_points"],
+            "steps": content.get("steps", []),
+        },
+        "conclusion": {
+            "summary": __required_text(conclusion, "summary"),
+            "next_steps": next_steps or None,
+        },
+        "references": [__strip_item(line) for line in sections["references"]],
+    }
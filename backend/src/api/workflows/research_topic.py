@@ -1,12 +1,21 @@
 import json
+import asyncio
 from agno.agent import Agent
-from agno.workflow import Workflow, RunResponse, RunEvent
+from agno.workflow import RunResponse, RunEvent
 from agno.utils.log import logger
 from src.agents import confirmation_message_generator
 from gpt_researcher import GPTResearcher
 from src.agents.json_extractor import init_agent
-from pydantic import BaseModel
-from typing import List, Dict, Optional, Iterator
+from src.api.workflows.async_workflow import AsyncWorkflow
+from src.api.workflows.session_documents import SessionDocuments
+from src.api.workflows.report_parser import ReportParseError, parse_report_markdown
+from src.api.workflows.stages import run_stages, arun_stages
+from src.api.workflows.whiteboard_diff import WHITEBOARD_STATE_PATH
+from src.api.workflows.whiteboard_layout import whiteboard_layout
+from src.cache.agent_cache import agent_cache
+from src.api.tracing import StageSpan
+from pydantic import BaseModel, ValidationError
+from typing import Callable, List, Dict, Optional, Iterator, AsyncIterator
 
 
 class Introduction(BaseModel):
@@ -29,7 +38,7 @@ class Report(BaseModel):
     conclusion: Conclusion
     references: List[str]
 
-class DeepResearcher(Workflow):
+class DeepResearcher(AsyncWorkflow):
     # create base voice agent for feedback
     confirmation_agent: Agent = confirmation_message_generator.agent
     extraction_agent: Agent = init_agent(output_model=Report)
@@ -40,44 +49,67 @@ class DeepResearcher(Workflow):
         "RESEARCH_SOURCES", 
         "RESEARCH_IMAGES",
         "WHITEBOARD_RESET",
-        "WHITEBOARD_UPDATE"]
+        "WHITEBOARD_UPDATE",
+        "WHITEBOARD_PATCH"]
+    # documented order of the research events, keyed by the session field behind them
+    research_stage_order = ["report_summary", "context", "sources", "images", "parsed_data"]
+    research_stage_events = {
+        "context": "RESEARCH_CONTEXT",
+        "sources": "RESEARCH_SOURCES",
+        "images": "RESEARCH_IMAGES",
+    }
+    # last event of every research stage, they measure the progress of a research job
+    research_stage_done_events = {
+        "report_summary": ["AUDIO_TRANSCRIPT"],
+        "context": ["RESEARCH_CONTEXT"],
+        "sources": ["RESEARCH_SOURCES"],
+        "images": ["RESEARCH_IMAGES"],
+        # the board is sent in full or as a patch
+        "parsed_data": ["WHITEBOARD_UPDATE", "WHITEBOARD_PATCH"],
+    }
+    # stage names in the traces and metrics
+    research_stage_spans = {
+        "report_summary": "summary",
+        "context": "context",
+        "sources": "sources",
+        "images": "images",
+        "parsed_data": "extraction",
+    }
 
     def __generate_tldraw_items(self, report: Report) -> List[Dict]:
         items = []
         
         # Title: Render as a large header element.
         title_item = {
+            "id": "report:title",
             "type": "header",
-            "text": report.title,
-            "position": {"x": 50, "y": 50},
-            "size": {"width": 400, "height": 60}
+            "text": report.title
         }
         items.append(title_item)
         
         # Abstract/Description: Render as a description text box.
         abstract_item = {
+            "id": "report:abstract",
             "type": "textbox",
-            "text": report.abstract,
-            "position": {"x": 50, "y": 120},
-            "size": {"width": 400, "height": 80}
+            "text": report.abstract
         }
         items.append(abstract_item)
         
         # Introduction: Render as a box with sticky note sub-elements.
         intro_item = {
+            "id": "report:introduction",
             "type": "box",
             "title": "Introduction",
             "contents": [
                 {"type": "sticky", "text": f"Background: {report.introduction.background}"},
                 {"type": "sticky", "text": f"Objective: {report.introduction.objective}"}
-            ],
-            "position": {"x": 500, "y": 50},
-            "size": {"width": 350, "height": 120}
+            ]
         }
         items.append(intro_item)
         
         # Content: Render key points and steps as sticky notes within a box.
         content_item = {
+            "id": "report:content",
             "type": "box",
             "title": "Content",
             "contents": (
@@ -85,9 +117,7 @@ class DeepResearcher(Workflow):
                 [{"type": "sticky", "text": kp} for kp in report.content.key_points] +
                 [{"type": "sticky", "text": "Steps:"}] +
                 [{"type": "sticky", "text": step} for step in report.content.steps]
-            ),
-            "position": {"x": 50, "y": 220},
-            "size": {"width": 400, "height": 200}
+            )
         }
         items.append(content_item)
         
@@ -96,25 +126,30 @@ class DeepResearcher(Workflow):
         if report.conclusion.next_steps:
             conclusion_text += f"\nNext Steps: {report.conclusion.next_steps}"
         conclusion_item = {
+            "id": "report:conclusion",
             "type": "box",
             "title": "Conclusion",
-            "contents": [{"type": "sticky", "text": conclusion_text}],
-            "position": {"x": 500, "y": 220},
-            "size": {"width": 350, "height": 120}
+            "contents": [{"type": "sticky", "text": conclusion_text}]
         }
         items.append(conclusion_item)
         
         # References: Render as a side box.
         references_text = "\n".join(report.references)
         references_item = {
+            "id": "report:references",
             "type": "box",
             "title": "References",
-            "contents": [{"type": "sticky", "text": references_text}],
-            "position": {"x": 900, "y": 50},
-            "size": {"width": 250, "height": 300}
+            "contents": [{"type": "sticky", "text": references_text}]
         }
         items.append(references_item)
-        
+
+        # title, abstract and content on the left, introduction and conclusion next, references last
+        whiteboard_layout.layout_columns(
+            [[title_item, abstract_item, content_item], [intro_item, conclusion_item], [references_item]],
+            widths=[400, 350, 250],
+            origin=(50, 50)
+        )
+
         return items
         
     def __fetch_images(self):
@@ -130,101 +165,155 @@ class DeepResearcher(Workflow):
         return context
     
     def get_current_state(self):
-        current_research = self.session_state["session"].get("research",  None)
-        return current_research
+        paths = [f"research.{key}" for key in ["report", *self.research_stage_order]]
+        current_research = self.open_session_documents().load(*paths)
+        return {path.split(".", 1)[1]: value for path, value in current_research.items()}
 
     
-    def __generate_confirmation_msg(self, topic: str) -> str:
+    def __generate_confirmation_msg(self, topic: str, span: StageSpan) -> str:
+        logger.info("Confirmation Msg Generation Started (Attempt 1)...")
+        confirmation_msg = agent_cache.run(self.confirmation_agent, topic, span=span)
+        logger.info("Confirmation Msg Generation Finished...")
+        return confirmation_msg
+
+    async def __agenerate_confirmation_msg(self, topic: str, span: StageSpan) -> str:
         logger.info("Confirmation Msg Generation Started (Attempt 1)...")
-        confirmation_msg_response = self.confirmation_agent.run(topic)
+        confirmation_msg = await agent_cache.arun(self.confirmation_agent, topic, span=span)
         logger.info("Confirmation Msg Generation Finished...")
-        return confirmation_msg_response.content
+        return confirmation_msg
 
-    def run(self, topic: str, researcher: GPTResearcher, report) -> Iterator[RunResponse]:
+    def __parse_report(self, report) -> Optional[Report]:
+        """The report read locally when it follows the report template, None otherwise."""
+        try:
+            parsed = Report.model_validate(parse_report_markdown(f"{report}"))
+        except (ReportParseError, ValidationError) as e:
+            logger.info(f"Report not parsed locally, falling back to extraction, Error: {e}")
+            return None
+        return parsed
+
+    def __extract_report(self, report, span: StageSpan) -> Report:
+        parsed = self.__parse_report(report)
+        if parsed is not None:
+            return parsed
+        return agent_cache.run(self.extraction_agent, report, span=span)
+
+    async def __aextract_report(self, report, span: StageSpan) -> Report:
+        parsed = self.__parse_report(report)
+        if parsed is not None:
+            return parsed
+        return await agent_cache.arun(self.extraction_agent, report, span=span)
+
+    def __get_summary_prompt(self, report) -> str:
+        return f"Write a short 100 word summary for the report. Report: {report}"
+
+    def __get_research_stages(self, report) -> Dict:
+        # every stage only depends on the report, so they can all run at once
+        return {
+            "report_summary": lambda span: self.__generate_confirmation_msg(self.__get_summary_prompt(report), span),
+            "context": lambda span: self.__fetch_research_context(),
+            "sources": lambda span: self.__fetch_sources(),
+            "images": lambda span: self.__fetch_images(),
+            "parsed_data": lambda span: self.__extract_report(report, span),
+        }
+
+    def __get_async_research_stages(self, report) -> Dict:
+        return {
+            "report_summary": lambda span: self.__agenerate_confirmation_msg(self.__get_summary_prompt(report), span),
+            "context": lambda span: asyncio.to_thread(self.__fetch_research_context),
+            "sources": lambda span: asyncio.to_thread(self.__fetch_sources),
+            "images": lambda span: asyncio.to_thread(self.__fetch_images),
+            "parsed_data": lambda span: self.__aextract_report(report, span),
+        }
+
+    def __get_stage_paths(self, stages: Dict) -> List[str]:
+        # the last board is diffed against once the report is parsed
+        return [f"research.{key}" for key in stages] + [WHITEBOARD_STATE_PATH]
+
+    def __split_known_stages(self, stored: Dict, stages: Dict, traced: Callable):
+        known = {key: stored[f"research.{key}"] for key in stages if stored.get(f"research.{key}", None)}
+        # the stages left to run are timed from here, when they get scheduled
+        pending = {
+            key: traced(self.research_stage_spans[key], stage)
+            for key, stage in stages.items() if key not in known
+        }
+        return known, pending
+
+    def __get_stage_responses(self, documents: SessionDocuments, key: str, result, whiteboard_patch: bool) -> List[RunResponse]:
+        if key == "report_summary":
+            # send report summary for voice
+            return [RunResponse(event="AUDIO_TRANSCRIPT", content=result)]
+        if key == "parsed_data":
+            with self.trace.stage("whiteboard_layout"):
+                tl_draw_items = self.__generate_tldraw_items(report=result)
+                return self.get_whiteboard_responses(documents, tl_draw_items, as_patch=whiteboard_patch)
+        return [RunResponse(event=self.research_stage_events[key], content=json.dumps(result))]
+
+    def __start_research(self, topic: str, researcher: GPTResearcher, report) -> SessionDocuments:
+        # research fields are stored apart from the session state
+        documents = self.open_session_documents()
+        self.researcher = researcher
+        # init report state
+        documents.set("research.report", report)
+        # update the session memory
+        self.session_state["session"]["topic"] = topic
+        return documents
+
+    def __store_stage_result(self, documents: SessionDocuments, key: str, result):
+        if key == "parsed_data" and isinstance(result, dict):
+            # parsed data read back from storage is a plain dict
+            result = Report.model_validate(result)
+        documents.set(f"research.{key}", result)
+        return result
+
+    def run(self, topic: str, researcher: GPTResearcher, report, emit_as_completed: bool = False, whiteboard_patch: bool = False) -> Iterator[RunResponse]:
+        trace = self.start_trace()
         # if sessiond oes not exist end workflow
         if not self.session_state.get("session", None):
             yield RunResponse(event=RunEvent.workflow_completed)
             return
-        # init research state
-        current_research = self.session_state["session"].get("research",  {})
-        self.researcher = researcher
-        
-        # init report state
-        current_research["report"] = report
+        documents = self.__start_research(topic=topic, researcher=researcher, report=report)
         yield RunResponse(
             event="RESEARCH_REPORT",
             content=json.dumps(report)
         )
-        
-        if current_research.get("report_summary", None):
-            resport_gen_msg = current_research["report_summary"]
-        else:
-            resport_gen_msg = self.__generate_confirmation_msg(f"Write a short 100 word summary for the report. Report: {report}")
-            current_research["report_summary"] = resport_gen_msg
-        # send report summary for voice
-        yield RunResponse(
-            event="AUDIO_TRANSCRIPT",
-            content=resport_gen_msg
-        )
-        
-        # fetch context
-        if current_research.get("context", None):
-            context = current_research["context"]
-        else:
-            context = self.__fetch_research_context()
-            current_research["context"] = context
-        yield RunResponse(
-            event="RESEARCH_CONTEXT",
-            content=json.dumps(context)
-        )
 
-        # fetch sources
-        if current_research.get("sources", None):
-            sources = current_research["sources"]
-        else:
-            sources = self.__fetch_sources()
-            current_research["sources"] = sources
-        yield RunResponse(
-            event="RESEARCH_SOURCES",
-            content=json.dumps(sources)
-        )
+        # summary, context, sources, images and the json report run concurrently
+        stages = self.__get_research_stages(report)
+        stored = documents.load(*self.__get_stage_paths(stages))
+        known, pending = self.__split_known_stages(stored, stages, trace.traced)
+        for key, result in run_stages(pending, order=self.research_stage_order, known=known, as_completed=emit_as_completed):
+            result = self.__store_stage_result(documents, key, result)
+            yield from self.__get_stage_responses(documents, key, result, whiteboard_patch)
 
-        # fetch images
-        if current_research.get("images", None):
-            images = current_research["images"]
-        else:
-            images = self.__fetch_images()
-            current_research["images"] = images
-        
-        yield RunResponse(
-            event="RESEARCH_IMAGES",
-            content=json.dumps(images)
-        )
-
-        # update the session memory
-        self.session_state["session"]["topic"] = topic
-        self.session_state["session"]["research"] = current_research
-        self.write_to_storage()
-
-        yield RunResponse(
-            event="WHITEBOARD_RESET",
-            content=json.dumps({})
-        )
-
-        if current_research.get("parsed_data", None):
-            json_report = current_research["parsed_data"]
-        else:
-            # parse report inso json format
-            json_report = self.extraction_agent.run(report).content
-            self.session_state["session"]["research"]["parsed_data"] = json_report
+        with trace.stage("storage_write"):
+            documents.flush()
             self.write_to_storage()
 
-        tl_draw_items = self.__generate_tldraw_items(report=json_report)
+        yield RunResponse(event=RunEvent.workflow_completed)
 
+    async def arun(self, topic: str, researcher: GPTResearcher, report, emit_as_completed: bool = False, whiteboard_patch: bool = False) -> AsyncIterator[RunResponse]:
+        trace = self.start_trace()
+        # if sessiond oes not exist end workflow
+        if not self.session_state.get("session", None):
+            yield RunResponse(event=RunEvent.workflow_completed)
+            return
+        documents = self.__start_research(topic=topic, researcher=researcher, report=report)
         yield RunResponse(
-            event="WHITEBOARD_UPDATE",
-            content=json.dumps(tl_draw_items)
+            event="RESEARCH_REPORT",
+            content=json.dumps(report)
         )
 
+        # summary, context, sources, images and the json report run concurrently
+        stages = self.__get_async_research_stages(report)
+        stored = await documents.aload(*self.__get_stage_paths(stages))
+        known, pending = self.__split_known_stages(stored, stages, trace.atraced)
+        async for key, result in arun_stages(pending, order=self.research_stage_order, known=known, as_completed=emit_as_completed):
+            result = self.__store_stage_result(documents, key, result)
+            for response in self.__get_stage_responses(documents, key, result, whiteboard_patch):
+                yield response
+
+        with trace.stage("storage_write"):
+            await documents.aflush()
+            await self.awrite_to_storage()
 
         yield RunResponse(event=RunEvent.workflow_completed)
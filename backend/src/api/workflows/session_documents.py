@@ -0,0 +1,159 @@
+import json
+import time
+import asyncio
+import threading
+from functools import partial
+from pydantic import BaseModel
+from sqlalchemy import BigInteger, Column, Integer, MetaData, String, Table, Text, delete, insert, inspect, select
+from sqlalchemy.engine import Engine
+from agno.storage.workflow.base import WorkflowStorage
+from src.api.workflows.session_writer import session_writer
+from typing import Any, Dict, List, Optional, Set
+
+_metadata = MetaData()
+session_documents_table = Table(
+    "workflow_session_documents",
+    _metadata,
+    Column("session_id", String, primary_key=True),
+    Column("path", String, primary_key=True),
+    Column("value", Text, nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("updated_at", BigInteger, nullable=False),
+)
+
+
+class SessionDocuments:
+    """Large session fields of a workflow session, stored as one row per field.
+
+    Fields are addressed by paths such as ``research.parsed_data`` or ``lessons.markdown``,
+    they are loaded on first access and ``flush()`` only writes the fields that changed, so
+    the session state saved by agno keeps the small fields only. Sessions saved before keep
+    their fields in ``session_state["session"]``, they are read from there and moved to their
+    own rows on the next flush.
+    """
+
+    __created_tables: Set[int] = set()
+    __create_lock = threading.Lock()
+
+    def __init__(self, storage: WorkflowStorage, session_id: str, legacy_state: Optional[Dict] = None):
+        self.session_id = session_id
+        self.__engine: Engine = storage.db_engine
+        self.__legacy_state = legacy_state if legacy_state is not None else {}
+        self.__values: Dict[str, Any] = {}
+        self.__dirty: Set[str] = set()
+        self.__create_table()
+
+    def __create_table(self):
+        with self.__create_lock:
+            if id(self.__engine) in self.__created_tables:
+                return
+            try:
+                _metadata.create_all(self.__engine, tables=[session_documents_table], checkfirst=True)
+            except Exception:
+                # another worker created it first
+                if not inspect(self.__engine).has_table(session_documents_table.name):
+                    raise
+            self.__created_tables.add(id(self.__engine))
+
+    def __get_legacy(self, path: str) -> Any:
+        section, field = path.split(".", 1)
+        return (self.__legacy_state.get(section) or {}).get(field, None)
+
+    def __drop_legacy(self, path: str):
+        section, field = path.split(".", 1)
+        legacy_section = self.__legacy_state.get(section, None)
+        if isinstance(legacy_section, dict):
+            legacy_section.pop(field, None)
+            if not legacy_section:
+                self.__legacy_state.pop(section, None)
+
+    @staticmethod
+    def __encode(value: Any) -> Any:
+        if isinstance(value, BaseModel):
+            return value.model_dump(mode="json")
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def load(self, *paths: str) -> Dict[str, Any]:
+        """Returns the fields by path, reading the ones not loaded yet in a single query."""
+        missing = [path for path in paths if path not in self.__values]
+        if missing:
+            # queued writes of the session go out first
+            session_writer.flush(self.session_id)
+            table = session_documents_table
+            with self.__engine.connect() as connection:
+                rows = connection.execute(
+                    select(table.c.path, table.c.value).where(
+                        table.c.session_id == self.session_id,
+                        table.c.path.in_(missing)
+                    )
+                ).all()
+            stored = {path: json.loads(value) for path, value in rows}
+            for path in missing:
+                if path in stored:
+                    self.__values[path] = stored[path]
+                    continue
+                self.__values[path] = self.__get_legacy(path)
+                if self.__values[path] is not None:
+                    self.__dirty.add(path)
+        return {path: self.__values[path] for path in paths}
+
+    async def aload(self, *paths: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.load, *paths)
+
+    def get(self, path: str) -> Any:
+        return self.load(path)[path]
+
+    def set(self, path: str, value: Any):
+        if path in self.__values and self.__values[path] == value:
+            return
+        self.__values[path] = value
+        self.__dirty.add(path)
+
+    @staticmethod
+    def write_rows(engine: Engine, rows: List[Dict]):
+        """Replaces the document rows, of one or more sessions, in a single transaction."""
+        table = session_documents_table
+        paths_by_session: Dict[str, List[str]] = {}
+        for row in rows:
+            paths_by_session.setdefault(row["session_id"], []).append(row["path"])
+        with engine.begin() as connection:
+            for session_id, paths in paths_by_session.items():
+                connection.execute(
+                    delete(table).where(table.c.session_id == session_id, table.c.path.in_(paths))
+                )
+            connection.execute(insert(table), rows)
+
+    def flush(self) -> int:
+        """Writes the changed fields, or queues them in write-behind mode, returns how many."""
+        if not self.__dirty:
+            return 0
+        paths = sorted(self.__dirty)
+        now = int(time.time())
+        rows = []
+        for path in paths:
+            value = json.dumps(self.__values[path], default=self.__encode)
+            rows.append({
+                "session_id": self.session_id,
+                "path": path,
+                "value": value,
+                "size": len(value),
+                "updated_at": now,
+            })
+        if session_writer.enabled:
+            for row in rows:
+                session_writer.submit(
+                    session_id=self.session_id,
+                    batch_key=("documents", id(self.__engine)),
+                    item_key=(self.session_id, row["path"]),
+                    value=row,
+                    write_batch=partial(self.write_rows, self.__engine)
+                )
+        else:
+            self.write_rows(self.__engine, rows)
+        for path in paths:
+            self.__drop_legacy(path)
+        self.__dirty.clear()
+        return len(rows)
+
+    async def aflush(self) -> int:
+        return await asyncio.to_thread(self.flush)
@@ -0,0 +1,151 @@
+import os
+import copy
+import time
+import atexit
+import asyncio
+import threading
+from functools import partial
+from sqlalchemy.dialects import postgresql, sqlite
+from agno.storage.workflow.base import WorkflowStorage
+from agno.storage.workflow.session import WorkflowSession
+from agno.utils.log import logger
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def upsert_sessions(storage: WorkflowStorage, sessions: List[WorkflowSession]):
+    """Upserts the sessions in a single transaction, one by one through agno when it fails."""
+    insert = sqlite.insert if storage.db_engine.dialect.name == "sqlite" else postgresql.insert
+    try:
+        with storage.Session() as sess, sess.begin():
+            for session in sessions:
+                values = dict(
+                    workflow_id=session.workflow_id,
+                    user_id=session.user_id,
+                    memory=session.memory,
+                    workflow_data=session.workflow_data,
+                    session_data=session.session_data,
+                    extra_data=session.extra_data,
+                )
+                stmt = insert(storage.table).values(session_id=session.session_id, **values)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["session_id"],
+                    set_=dict(**values, updated_at=int(time.time()))
+                )
+                sess.execute(stmt)
+    except Exception as e:
+        # agno creates the table when it is missing
+        logger.debug(f"Batched session upsert failed, upserting one by one: {e}")
+        for session in sessions:
+            storage.upsert(session)
+
+
+class SessionWriter:
+    """Write-behind queue for workflow session writes.
+
+    When enabled, writes are queued and a background thread writes them every
+    ``flush_interval`` seconds, a newer write of the same session (or the same session
+    document) replaces the queued one and writes to the same table go out in one
+    transaction. ``flush(session_id)`` writes the queued writes of a session right away,
+    it runs before the session is read and once a workflow run is over. When disabled
+    every write goes straight to the database.
+    """
+
+    def __init__(self, enabled: bool = False, flush_interval: float = 0.1):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        # (batch key, item key) -> (session id, value, batch write)
+        self.__pending: Dict[Tuple[Hashable, Hashable], Tuple[str, Any, Callable[[List[Any]], None]]] = {}
+        self.__lock = threading.Condition()
+        # writes of a session are taken and written in order
+        self.__write_lock = threading.Lock()
+        self.__thread: Optional[threading.Thread] = None
+        self.__counters = {"submitted": 0, "coalesced": 0, "written": 0, "batches": 0, "failed": 0}
+
+    def __start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="session-writer", daemon=True)
+            self.__thread.start()
+            atexit.register(self.flush)
+
+    def __run(self):
+        while True:
+            with self.__lock:
+                while not self.__pending:
+                    self.__lock.wait()
+            # let the writes of the next steps coalesce
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Session write-behind flush failed: {e}")
+
+    def submit(
+        self,
+        session_id: str,
+        batch_key: Hashable,
+        item_key: Hashable,
+        value: Any,
+        write_batch: Callable[[List[Any]], None]
+    ):
+        """Queues ``value``, written with the values of the same ``batch_key`` by ``write_batch``."""
+        with self.__lock:
+            self.__start()
+            self.__counters["submitted"] += 1
+            if self.__pending.pop((batch_key, item_key), None) is not None:
+                self.__counters["coalesced"] += 1
+            self.__pending[(batch_key, item_key)] = (session_id, value, write_batch)
+            self.__lock.notify()
+
+    def submit_session(self, storage: WorkflowStorage, session: WorkflowSession) -> WorkflowSession:
+        # the session state is still mutated by the workflow, the queued write keeps a copy
+        session.session_data = copy.deepcopy(session.session_data)
+        self.submit(
+            session_id=session.session_id,
+            batch_key=("sessions", id(storage)),
+            item_key=session.session_id,
+            value=session,
+            write_batch=partial(upsert_sessions, storage)
+        )
+        return session
+
+    def flush(self, session_id: Optional[str] = None):
+        """Writes the queued writes of the session, or all of them, before returning."""
+        with self.__write_lock:
+            with self.__lock:
+                if session_id is None:
+                    taken, self.__pending = self.__pending, {}
+                else:
+                    taken = {key: item for key, item in self.__pending.items() if item[0] == session_id}
+                    for key in taken:
+                        del self.__pending[key]
+            if not taken:
+                return
+            batches: Dict[Hashable, Tuple[Callable, List[Any]]] = {}
+            for (batch_key, _), (_, value, write_batch) in taken.items():
+                batches.setdefault(batch_key, (write_batch, []))[1].append(value)
+
+            error = None
+            for write_batch, values in batches.values():
+                try:
+                    write_batch(values)
+                    self.__counters["written"] += len(values)
+                    self.__counters["batches"] += 1
+                except Exception as e:
+                    logger.error(f"Dropped {len(values)} session writes: {e}")
+                    self.__counters["failed"] += len(values)
+                    error = error or e
+            if error is not None:
+                raise error
+
+    async def aflush(self, session_id: Optional[str] = None):
+        await asyncio.to_thread(self.flush, session_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {**self.__counters, "enabled": self.enabled, "pending": len(self.__pending)}
+
+
+session_writer = SessionWriter(
+    enabled=os.getenv("WORKFLOW_WRITE_BEHIND", "false").lower() == "true",
+    flush_interval=int(os.getenv("WORKFLOW_WRITE_BEHIND_INTERVAL_MS", "100")) / 1000,
+)
@@ -0,0 +1,76 @@
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed as futures_as_completed
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+# pool for the independent stages of a sync workflow run, kept apart from the
+# workflow runner pool since a run blocks on its stages
+stage_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("WORKFLOW_STAGE_THREADS", "16")),
+    thread_name_prefix="workflow-stage"
+)
+
+
+def run_stages(
+    stages: Dict[str, Callable[[], Any]],
+    order: List[str],
+    known: Optional[Dict[str, Any]] = None,
+    as_completed: bool = False,
+) -> Iterator[Tuple[str, Any]]:
+    """Runs independent stages concurrently on the stage pool.
+
+    Yields ``(key, result)`` pairs following ``order``, or as soon as each stage
+    completes when ``as_completed`` is set. ``known`` results are yielded without
+    scheduling anything. Stages run in a copy of the caller's context.
+    """
+    known = known or {}
+    futures = {key: stage_executor.submit(contextvars.copy_context().run, stage) for key, stage in stages.items()}
+    try:
+        if as_completed:
+            for key in order:
+                if key in known:
+                    yield key, known[key]
+            keys = {future: key for key, future in futures.items()}
+            for future in futures_as_completed(keys):
+                yield keys[future], future.result()
+        else:
+            for key in order:
+                if key in known:
+                    yield key, known[key]
+                elif key in futures:
+                    yield key, futures[key].result()
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+async def arun_stages(
+    stages: Dict[str, Callable[[], Awaitable[Any]]],
+    order: List[str],
+    known: Optional[Dict[str, Any]] = None,
+    as_completed: bool = False,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """Async counterpart of ``run_stages``, stages are coroutine factories run as tasks."""
+    known = known or {}
+    tasks = {key: asyncio.ensure_future(stage()) for key, stage in stages.items()}
+    try:
+        if as_completed:
+            for key in order:
+                if key in known:
+                    yield key, known[key]
+            keys = {task: key for key, task in tasks.items()}
+            pending = set(keys)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: order.index(keys[task])):
+                    yield keys[task], task.result()
+        else:
+            for key in order:
+                if key in known:
+                    yield key, known[key]
+                elif key in tasks:
+                    yield key, await tasks[key]
+    finally:
+        for task in tasks.values():
+            task.cancel()
@@ -0,0 +1,49 @@
+from typing import Any, Dict, List, Optional
+
+# session document holding the last board sent to the session, by both workflows
+WHITEBOARD_STATE_PATH = "whiteboard.state"
+
+
+def diff_items(previous: List[Dict[str, Any]], items: List[Dict[str, Any]]) -> Dict[str, List]:
+    """Operations turning the ``previous`` board into ``items``, both lists of items with an ``id``.
+
+    Updates only carry the ``id`` and the top level fields that changed, an item that lost
+    fields is removed and added again. Operations apply as remove, then add, then update.
+    """
+    previous_by_id = {item["id"]: item for item in previous}
+    operations: Dict[str, List] = {"add": [], "update": [], "remove": []}
+    current_ids = set()
+    for item in items:
+        current_ids.add(item["id"])
+        old = previous_by_id.get(item["id"], None)
+        if old == item:
+            continue
+        if old is None or any(key not in item for key in old):
+            if old is not None:
+                operations["remove"].append(item["id"])
+            operations["add"].append(item)
+            continue
+        changed = {key: value for key, value in item.items() if old.get(key, None) != value}
+        operations["update"].append({"id": item["id"], **changed})
+    operations["remove"] += [item_id for item_id in previous_by_id if item_id not in current_ids]
+    return operations
+
+
+def next_whiteboard_state(state: Optional[Dict[str, Any]], items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The state stored once ``items`` are sent, its version goes up with every board sent."""
+    version = state["version"] + 1 if state else 1
+    return {"version": version, "items": items}
+
+
+def get_whiteboard_patch(state: Optional[Dict[str, Any]], items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The ``WHITEBOARD_PATCH`` message from the stored ``state`` to ``items``.
+
+    ``base`` is the version the operations apply to, 0 for an empty board, and ``version``
+    the one they lead to. A client not holding ``base`` asks for the full board instead.
+    """
+    base = state["version"] if state else 0
+    return {
+        "base": base,
+        "version": base + 1,
+        **diff_items(state["items"] if state else [], items),
+    }
@@ -0,0 +1,84 @@
+import threading
+from contextlib import contextmanager
+from agno.workflow import Workflow
+from agno.storage.workflow.base import WorkflowStorage
+from typing import Dict, Iterator, List, Optional, Set, Type
+
+
+class WorkflowPool:
+    """Idle workflow instances, handed out as per-session handles.
+
+    Building a workflow inspects and wraps its run methods, so instead of building one per
+    connection an idle instance is reset to the session and checked out. Once checked back
+    in, the session state, the memory and every attribute set by its runs are dropped, so
+    an idle instance holds no session data. An instance serves one connection at a time.
+    """
+
+    def __init__(self, storage: WorkflowStorage, max_idle_per_workflow: int = 256):
+        self.storage = storage
+        self.max_idle_per_workflow = max_idle_per_workflow
+        self.__idle: Dict[Type[Workflow], List[Workflow]] = {}
+        # attributes of a freshly built instance, the others are set by runs
+        self.__baseline: Dict[Type[Workflow], Set[str]] = {}
+        self.__lock = threading.Lock()
+        self.__created = 0
+        self.__reused = 0
+        self.__checked_out = 0
+
+    def __reset(self, workflow: Workflow, session_id: Optional[str]):
+        for name in list(vars(workflow)):
+            if name not in self.__baseline[type(workflow)]:
+                delattr(workflow, name)
+        workflow.session_id = session_id
+        workflow.workflow_id = None
+        workflow.session_name = None
+        workflow.session_state = {}
+        workflow.memory = None
+        workflow.workflow_session = None
+        workflow.run_id = None
+        workflow.run_input = None
+        workflow.run_response = None
+        workflow.images = None
+        workflow.videos = None
+        workflow.audio = None
+
+    def __new_workflow(self, workflow_class: Type[Workflow], session_id: str) -> Workflow:
+        workflow = workflow_class(session_id=session_id, storage=self.storage)
+        with self.__lock:
+            self.__baseline.setdefault(workflow_class, set(vars(workflow)))
+        return workflow
+
+    @contextmanager
+    def checkout(self, workflow_class: Type[Workflow], session_id: str) -> Iterator[Workflow]:
+        with self.__lock:
+            idle = self.__idle.get(workflow_class, [])
+            workflow = idle.pop() if idle else None
+            if workflow is None:
+                self.__created += 1
+            else:
+                self.__reused += 1
+            self.__checked_out += 1
+        if workflow is None:
+            workflow = self.__new_workflow(workflow_class, session_id)
+        else:
+            workflow.session_id = session_id
+        try:
+            yield workflow
+        finally:
+            # drop the session data before the instance waits for its next session
+            self.__reset(workflow, session_id=None)
+            with self.__lock:
+                self.__checked_out -= 1
+                idle = self.__idle.setdefault(workflow_class, [])
+                if len(idle) < self.max_idle_per_workflow:
+                    idle.append(workflow)
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "created": self.__created,
+                "reused": self.__reused,
+                "checked_out": self.__checked_out,
+                "idle": sum(len(idle) for idle in self.__idle.values()),
+            }
+
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from agno.agent import Agent
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+from src.config.logging_config import logger
+from src.agents.agent_pool import agent_pools
+from src.config.model_router import model_router
+from src.config.rate_limiter import rate_limiter
+from src.api.tracing import StageSpan
+
+
+class AgentRunCache:
+    """Opt-in cache of agent run contents.
+
+    Runs are keyed by the route and its models, or the model id of an agent built outside
+    ``model_router``, the agent description, role and instructions, the input
+    and the response model schema, so a change to any of them is a miss. Hits are served
+    from an in-memory LRU, then from a SQLite file shared by the workers. Structured
+    contents are stored as JSON and validated back into the agent's ``response_model``.
+    When disabled every call goes straight to the agent. Runs use a pooled copy of the
+    agent on the model picked by ``model_router``, the agent passed in only serves as the
+    template.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        db_file: str = "tmp/agent_cache.db",
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = 100_000,
+    ):
+        self.enabled = enabled
+        self.db_file = db_file
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.__memory: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if enabled:
+            self.__create_tables()
+
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_file, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def __create_tables(self):
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self.__connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS agent_cache (
+                    key TEXT PRIMARY KEY,
+                    content_type TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            """)
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS agent_cache_last_accessed ON agent_cache (last_accessed)"
+            )
+        connection.close()
+
+    @staticmethod
+    def get_key(agent: Agent, message: Any) -> str:
+        model = getattr(agent, "model", None)
+        response_model = getattr(agent, "response_model", None)
+        route = model_router.get_route(agent)
+        key_data = {
+            # a routed run may be answered by any tier of its route
+            "model": [tier.name for tier in route.tiers] if route is not None else getattr(model, "id", None),
+            "route": route.name if route is not None else None,
+            "response_format": getattr(model, "response_format", None),
+            "description": getattr(agent, "description", None),
+            "role": getattr(agent, "role", None),
+            "instructions": getattr(agent, "instructions", None),
+            "response_model": response_model.model_json_schema() if response_model is not None else None,
+            "input": message,
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def __serialize(self, agent: Agent, content: Any) -> Optional[Tuple[str, str]]:
+        response_model = getattr(agent, "response_model", None)
+        if response_model is not None:
+            # only cache contents that were parsed into the response model
+            if not isinstance(content, response_model):
+                return None
+            return "model", content.model_dump_json()
+        if isinstance(content, str):
+            return "text", content
+        return None
+
+    def __deserialize(self, agent: Agent, entry: Tuple[str, str]) -> Any:
+        content_type, content = entry
+        if content_type == "model":
+            return agent.response_model.model_validate_json(content)
+        return content
+
+    def __remember(self, key: str, entry: Tuple[str, str]):
+        with self.__lock:
+            self.__memory[key] = entry
+            self.__memory.move_to_end(key)
+            while len(self.__memory) > self.max_memory_entries:
+                self.__memory.popitem(last=False)
+
+    def get(self, agent: Agent, key: str) -> Optional[Any]:
+        with self.__lock:
+            entry = self.__memory.get(key)
+            if entry is not None:
+                self.__memory.move_to_end(key)
+                self.__counters["memory_hits"] += 1
+        if entry is None:
+            with self.__connect() as connection:
+                row = connection.execute(
+                    "SELECT content_type, content FROM agent_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE agent_cache SET last_accessed = ? WHERE key = ?", (time.time(), key))
+            connection.close()
+            if row is None:
+                with self.__lock:
+                    self.__counters["misses"] += 1
+                return None
+            entry = (row[0], row[1])
+            self.__remember(key, entry)
+            with self.__lock:
+                self.__counters["disk_hits"] += 1
+        return self.__deserialize(agent, entry)
+
+    def put(self, agent: Agent, key: str, content: Any):
+        entry = self.__serialize(agent, content)
+        if entry is None:
+            return
+        self.__remember(key, entry)
+        with self.__connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO agent_cache VALUES (?, ?, ?, ?)",
+                (key, entry[0], entry[1], time.time())
+            )
+            connection.execute(
+                """DELETE FROM agent_cache WHERE key IN (
+                    SELECT key FROM agent_cache ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_disk_entries,)
+            )
+        connection.close()
+
+    @staticmethod
+    def __estimate_tokens(agent: Agent, message: Any) -> int:
+        return rate_limiter.estimate_tokens(
+            getattr(agent, "description", None), getattr(agent, "role", None), getattr(agent, "instructions", None), message
+        )
+
+    @staticmethod
+    def __run_pooled(agent: Agent, message: Any):
+        with agent_pools.checkout(agent) as pooled_agent:
+            return pooled_agent.run(message)
+
+    @staticmethod
+    async def __arun_pooled(agent: Agent, message: Any):
+        with agent_pools.checkout(agent) as pooled_agent:
+            return await pooled_agent.arun(message)
+
+    def __run(self, agent: Agent, message: Any, span: Optional[StageSpan]) -> Any:
+        response = model_router.run(
+            agent, lambda routed_agent: self.__run_pooled(routed_agent, message), tokens=self.__estimate_tokens(agent, message)
+        )
+        if span is not None:
+            span.record_run_metrics(response.metrics)
+        return response.content
+
+    async def __arun(self, agent: Agent, message: Any, span: Optional[StageSpan]) -> Any:
+        response = await model_router.arun(
+            agent, lambda routed_agent: self.__arun_pooled(routed_agent, message), tokens=self.__estimate_tokens(agent, message)
+        )
+        if span is not None:
+            span.record_run_metrics(response.metrics)
+        return response.content
+
+    @staticmethod
+    def __record_lookup(span: Optional[StageSpan], content: Any):
+        if span is not None:
+            span.record_cache(hit=content is not None)
+
+    @staticmethod
+    def __record_stream(span: Optional[StageSpan], agent: Agent):
+        # the metrics of a streamed run are set on the agent once the stream is over
+        run_response = getattr(agent, "run_response", None)
+        if span is not None and run_response is not None:
+            span.record_run_metrics(run_response.metrics)
+
+    def __stream_pooled(self, agent: Agent, message: Any, span: Optional[StageSpan]) -> Iterator[str]:
+        with agent_pools.checkout(agent) as pooled_agent:
+            for chunk in pooled_agent.run(message, stream=True):
+                if chunk.content:
+                    yield chunk.content
+            self.__record_stream(span, pooled_agent)
+
+    async def __astream_pooled(self, agent: Agent, message: Any, span: Optional[StageSpan]) -> AsyncIterator[str]:
+        with agent_pools.checkout(agent) as pooled_agent:
+            async for chunk in await pooled_agent.arun(message, stream=True):
+                if chunk.content:
+                    yield chunk.content
+            self.__record_stream(span, pooled_agent)
+
+    def run(self, agent: Agent, message: Any, span: Optional[StageSpan] = None) -> Any:
+        """Returns the content of ``agent.run(message)``, cached when enabled.
+
+        Tokens and cache lookups are recorded on ``span`` when given.
+        """
+        if not self.enabled:
+            return self.__run(agent, message, span)
+        key = self.get_key(agent, message)
+        content = self.get(agent, key)
+        self.__record_lookup(span, content)
+        if content is None:
+            content = self.__run(agent, message, span)
+            self.put(agent, key, content)
+        return content
+
+    async def arun(self, agent: Agent, message: Any, span: Optional[StageSpan] = None) -> Any:
+        """Returns the content of ``await agent.arun(message)``, cached when enabled."""
+        if not self.enabled:
+            return await self.__arun(agent, message, span)
+        key = self.get_key(agent, message)
+        # the disk tier is a blocking call, keep it off the loop
+        content = await asyncio.to_thread(self.get, agent, key)
+        self.__record_lookup(span, content)
+        if content is None:
+            content = await self.__arun(agent, message, span)
+            await asyncio.to_thread(self.put, agent, key, content)
+        return content
+
+    def stream(self, agent: Agent, message: Any, span: Optional[StageSpan] = None) -> Iterator[str]:
+        """Streams the text chunks of the agent run, a cached run comes back as a single chunk."""
+        key = self.get_key(agent, message) if self.enabled else None
+        content = self.get(agent, key) if self.enabled else None
+        if self.enabled:
+            self.__record_lookup(span, content)
+        if content is not None:
+            yield content
+            return
+        chunks = []
+        open_stream = lambda routed_agent: self.__stream_pooled(routed_agent, message, span)
+        for chunk in model_router.stream(agent, open_stream, tokens=self.__estimate_tokens(agent, message)):
+            chunks.append(chunk)
+            yield chunk
+        if self.enabled:
+            self.put(agent, key, "".join(chunks))
+
+    async def astream(self, agent: Agent, message: Any, span: Optional[StageSpan] = None) -> AsyncIterator[str]:
+        """Async counterpart of ``stream``."""
+        key = self.get_key(agent, message) if self.enabled else None
+        content = await asyncio.to_thread(self.get, agent, key) if self.enabled else None
+        if self.enabled:
+            self.__record_lookup(span, content)
+        if content is not None:
+            yield content
+            return
+        chunks = []
+        open_stream = lambda routed_agent: self.__astream_pooled(routed_agent, message, span)
+        async for chunk in model_router.astream(agent, open_stream, tokens=self.__estimate_tokens(agent, message)):
+            chunks.append(chunk)
+            yield chunk
+        if self.enabled:
+            await asyncio.to_thread(self.put, agent, key, "".join(chunks))
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {**self.__counters, "memory_entries": len(self.__memory)}
+
+
+def __create_agent_cache() -> AgentRunCache:
+    enabled = os.getenv("AGENT_CACHE_ENABLED", "false").lower() == "true"
+    if enabled:
+        logger.info("Agent run cache enabled")
+    return AgentRunCache(
+        enabled=enabled,
+        db_file=os.getenv("AGENT_CACHE_DB", "tmp/agent_cache.db"),
+        max_memory_entries=int(os.getenv("AGENT_CACHE_MEMORY_ENTRIES", "1024")),
+        max_disk_entries=int(os.getenv("AGENT_CACHE_DISK_ENTRIES", "100000")),
+    )
+
+
+agent_cache = __create_agent_cache()
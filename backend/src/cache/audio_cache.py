@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from src.config.logging_config import logger
+
+_CACHE_FILE_NAME = re.compile(r"^[0-9a-f]{64}\.\w+$")
+
+
+class AudioCacheWriter:
+    """Writes a clip to a temporary file, it only becomes a cache entry on ``commit()``."""
+
+    def __init__(self, cache: "AudioCache", path: str):
+        self.__cache = cache
+        self.path = path
+        self.__part_path = f"{path}.{uuid.uuid4().hex}.part"
+        self.__file = open(self.__part_path, "wb")
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self.__file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> str:
+        self.__file.close()
+        os.replace(self.__part_path, self.path)
+        self.__cache.add(self.path, self.size)
+        return self.path
+
+    def abort(self):
+        """Drops the temporary file, a no-op after ``commit()``."""
+        self.__file.close()
+        if os.path.exists(self.__part_path):
+            os.remove(self.__part_path)
+
+
+class AudioCache:
+    """Content-addressed store of synthesized clips under ``audio_generations/``.
+
+    A clip is keyed by its text, voice, model and output format. The in-memory index of
+    file sizes is built by scanning the directory at startup and kept in LRU order, file
+    mtimes record the last access so the order survives restarts. Once the files exceed
+    ``max_size_bytes`` the directory is rescanned (other workers write there too) and the
+    least recently used clips are removed.
+    """
+
+    def __init__(self, directory: str = "audio_generations", max_size_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.__index: "OrderedDict[str, int]" = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.__counters = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    @staticmethod
+    def get_key(text: str, voice_id: str, model_id: str, output_format: str) -> str:
+        key_data = json.dumps([text, voice_id, model_id, output_format])
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def get_file_path(self, key: str, output_format: str) -> str:
+        # output formats look like mp3_44100_128 or pcm_16000
+        return os.path.join(self.directory, f"{key}.{output_format.split('_')[0]}")
+
+    def scan(self):
+        """Rebuilds the index from the files in the cache directory, oldest access first."""
+        entries = []
+        with os.scandir(self.directory) as files:
+            for entry in files:
+                # other files in the folder (e.g. from the text_to_voice agent) are left alone
+                if entry.is_file() and _CACHE_FILE_NAME.match(entry.name):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        entries.sort()
+        with self.__lock:
+            self.__index = OrderedDict((path, size) for _, path, size in entries)
+            self.__size = sum(self.__index.values())
+        logger.info(f"Audio cache: {len(entries)} clips, {self.__size} bytes in {self.directory}")
+
+    def get(self, path: str) -> Optional[str]:
+        """Returns the path when the clip is stored and marks it as recently used."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.__lock:
+                self.__size -= self.__index.pop(path, 0)
+                self.__counters["misses"] += 1
+            return None
+        with self.__lock:
+            if path not in self.__index:
+                # written by another worker
+                self.__index[path] = os.path.getsize(path)
+                self.__size += self.__index[path]
+            self.__index.move_to_end(path)
+            self.__counters["hits"] += 1
+        return path
+
+    def open_writer(self, path: str) -> AudioCacheWriter:
+        return AudioCacheWriter(self, path)
+
+    def add(self, path: str, size: int):
+        with self.__lock:
+            self.__size += size - self.__index.pop(path, 0)
+            self.__index[path] = size
+            over_capacity = self.__size > self.max_size_bytes
+        if over_capacity:
+            self.evict()
+
+    def evict(self):
+        self.scan()
+        with self.__lock:
+            while self.__size > self.max_size_bytes and len(self.__index) > 1:
+                path, size = self.__index.popitem(last=False)
+                self.__size -= size
+                self.__counters["evictions"] += 1
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {**self.__counters, "clips": len(self.__index), "size_bytes": self.__size}
+
+
+audio_cache = AudioCache(
+    directory=os.getenv("AUDIO_CACHE_DIR", "audio_generations"),
+    max_size_bytes=int(os.getenv("AUDIO_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+)
@@ -0,0 +1,283 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import hashlib
+import unicodedata
+from typing import Any, Dict, Optional, Tuple
+from src.config.logging_config import logger
+from src.api.tracing import StageSpan
+from src.utils import get_researcher, get_report_template, run_report_generation
+
+
+class CachedResearch:
+    """Research result read from the cache, exposes the getters DeepResearcher uses on GPTResearcher."""
+
+    def __init__(self, report: str, context: Any, sources: Any, images: Any, costs: float = 0.0):
+        self.report = report
+        self.context = context
+        self.sources = sources
+        self.images = images
+        self.costs = costs
+
+    @classmethod
+    def from_researcher(cls, researcher, report: str) -> "CachedResearch":
+        return cls(
+            report=report,
+            context=researcher.get_research_context(),
+            sources=researcher.get_research_sources(),
+            images=researcher.get_research_images(),
+            costs=researcher.get_costs(),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "report": self.report,
+            "context": self.context,
+            "sources": self.sources,
+            "images": self.images,
+            "costs": self.costs,
+        }
+
+    def get_research_context(self):
+        return self.context
+
+    def get_research_sources(self):
+        return self.sources
+
+    def get_research_images(self):
+        return self.images
+
+    def get_costs(self) -> float:
+        # a cache hit costs nothing
+        return 0.0
+
+
+class ResearchCache:
+    """Research results shared by every worker, keyed by the normalized topic and report type.
+
+    Entries live in a SQLite file, expire after ``ttl_seconds`` and the least recently used
+    ones are evicted once the stored payloads exceed ``max_size_bytes``. Concurrent requests
+    for the same key wait on a single crawl: in-process through a shared task and across
+    workers through a lease row, the other workers poll until the entry is stored.
+    """
+
+    def __init__(
+        self,
+        db_file: str = "tmp/research_cache.db",
+        ttl_seconds: int = 7 * 24 * 3600,
+        max_size_bytes: int = 512 * 1024 * 1024,
+        lease_seconds: int = 600,
+        poll_interval: float = 1.0,
+    ):
+        self.db_file = db_file
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.__owner = uuid.uuid4().hex
+        self.__in_flight: Dict[str, asyncio.Task] = {}
+        self.__hits = 0
+        self.__misses = 0
+        self.__deduplicated = 0
+        self.__evictions = 0
+        self.__create_tables()
+
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_file, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def __create_tables(self):
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self.__connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS research_cache (
+                    key TEXT PRIMARY KEY,
+                    topic TEXT NOT NULL,
+                    report_type TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            """)
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS research_cache_last_accessed ON research_cache (last_accessed)"
+            )
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS research_leases (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        connection.close()
+
+    @staticmethod
+    def normalize_topic(topic: str) -> str:
+        topic = unicodedata.normalize("NFKC", topic).casefold()
+        topic = re.sub(r"[^\w\s]", " ", topic)
+        return " ".join(topic.split())
+
+    def get_key(self, topic: str, report_type: str) -> str:
+        # the report template is part of the query sent to GPT Researcher
+        key_data = "\n".join([self.normalize_topic(topic), report_type, get_report_template()])
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResearch]:
+        now = time.time()
+        with self.__connect() as connection:
+            row = connection.execute(
+                "SELECT payload FROM research_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                connection.execute("UPDATE research_cache SET last_accessed = ? WHERE key = ?", (now, key))
+        connection.close()
+        if row is None:
+            return None
+        return CachedResearch(**json.loads(row[0]))
+
+    def put(self, key: str, topic: str, report_type: str, research: CachedResearch):
+        payload = json.dumps(research.to_dict())
+        now = time.time()
+        with self.__connect() as connection:
+            # max_size_bytes counts the stored UTF-8 bytes, not characters
+            connection.execute(
+                "INSERT OR REPLACE INTO research_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, self.normalize_topic(topic), report_type, payload, len(payload.encode("utf-8")), now, now)
+            )
+            self.__evict(connection, now)
+        connection.close()
+
+    def __evict(self, connection: sqlite3.Connection, now: float):
+        expired = connection.execute(
+            "DELETE FROM research_cache WHERE created_at <= ?", (now - self.ttl_seconds,)
+        ).rowcount
+        total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM research_cache").fetchone()[0]
+        evicted = []
+        if total_size > self.max_size_bytes:
+            for key, size in connection.execute("SELECT key, size FROM research_cache ORDER BY last_accessed"):
+                if total_size <= self.max_size_bytes:
+                    break
+                evicted.append((key,))
+                total_size -= size
+            connection.executemany("DELETE FROM research_cache WHERE key = ?", evicted)
+        self.__evictions += expired + len(evicted)
+
+    def __acquire_lease(self, key: str) -> bool:
+        now = time.time()
+        with self.__connect() as connection:
+            connection.execute("DELETE FROM research_leases WHERE key = ? AND expires_at <= ?", (key, now))
+            acquired = connection.execute(
+                "INSERT OR IGNORE INTO research_leases VALUES (?, ?, ?)",
+                (key, self.__owner, now + self.lease_seconds)
+            ).rowcount == 1
+        connection.close()
+        return acquired
+
+    def __release_lease(self, key: str):
+        with self.__connect() as connection:
+            connection.execute("DELETE FROM research_leases WHERE key = ? AND owner = ?", (key, self.__owner))
+        connection.close()
+
+    async def __get_or_research(self, key: str, topic: str, report_type: str) -> Tuple[Any, str]:
+        while True:
+            cached = await asyncio.to_thread(self.get, key)
+            if cached is not None:
+                self.__hits += 1
+                logger.info(f"Research cache hit for '{topic}'")
+                return cached, cached.report
+            if await asyncio.to_thread(self.__acquire_lease, key):
+                break
+            # another worker is crawling this topic, wait for its result
+            await asyncio.sleep(self.poll_interval)
+
+        self.__misses += 1
+        try:
+            researcher = get_researcher(query=topic, report_type=report_type)
+            report = await run_report_generation(researcher=researcher)
+            research = CachedResearch.from_researcher(researcher, report)
+            await asyncio.to_thread(self.put, key, topic, report_type, research)
+        finally:
+            await asyncio.to_thread(self.__release_lease, key)
+        return researcher, report
+
+    async def get_or_research(
+        self,
+        topic: str,
+        report_type: str = "outline_report",
+        span: Optional[StageSpan] = None
+    ) -> Tuple[Any, str]:
+        """Returns ``(researcher, report)`` for the topic, crawling only on a cache miss.
+
+        The researcher is either the GPTResearcher that ran the crawl or a ``CachedResearch``.
+        A caller joining the crawl of another one counts as a hit on ``span``, only the caller
+        that started the crawl records its costs.
+        """
+        key = self.get_key(topic, report_type)
+        task = self.__in_flight.get(key)
+        deduplicated = task is not None
+        if deduplicated:
+            self.__deduplicated += 1
+        else:
+            task = asyncio.ensure_future(self.__get_or_research(key, topic, report_type))
+            self.__in_flight[key] = task
+            task.add_done_callback(lambda _: self.__in_flight.pop(key, None))
+            # a crawl abandoned by every caller still fills the cache, don't warn about its result
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        # shielded so a disconnecting socket does not cancel the crawl for the others
+        researcher, report = await asyncio.shield(task)
+        if span is not None:
+            crawled = not deduplicated and not isinstance(researcher, CachedResearch)
+            span.record_cache(hit=not crawled)
+            if crawled:
+                span.record_cost(researcher.get_costs())
+        return researcher, report
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "deduplicated": self.__deduplicated,
+            "evictions": self.__evictions,
+            "in_flight": len(self.__in_flight),
+        }
+
+
+class DisabledResearchCache:
+    """Runs every research, used when RESEARCH_CACHE_ENABLED is false."""
+
+    async def get_or_research(
+        self,
+        topic: str,
+        report_type: str = "outline_report",
+        span: Optional[StageSpan] = None
+    ) -> Tuple[Any, str]:
+        researcher = get_researcher(query=topic, report_type=report_type)
+        report = await run_report_generation(researcher=researcher)
+        if span is not None:
+            span.record_cost(researcher.get_costs())
+        return researcher, report
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+def __create_research_cache():
+    if os.getenv("RESEARCH_CACHE_ENABLED", "true").lower() != "true":
+        return DisabledResearchCache()
+    return ResearchCache(
+        db_file=os.getenv("RESEARCH_CACHE_DB", "tmp/research_cache.db"),
+        ttl_seconds=int(os.getenv("RESEARCH_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+        max_size_bytes=int(os.getenv("RESEARCH_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    )
+
+
+research_cache = __create_research_cache()
@@ -0,0 +1,173 @@
+import time
+import random
+import asyncio
+import threading
+import httpx
+from typing import Any, Callable, Dict, Iterator, AsyncIterator
+
+
+class PoolStats:
+    """Usage counters of the shared HTTP connection pools.
+
+    A request counts as in flight until its response body is closed, so ``saturation``
+    close to 1 means new requests wait for a free connection.
+    """
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.__lock = threading.Lock()
+        self.__counters = {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "retries": 0, "connect_errors": 0}
+        self.__transports = []
+
+    def add_transport(self, transport: Any):
+        self.__transports.append(transport)
+
+    def enter(self):
+        with self.__lock:
+            self.__counters["requests"] += 1
+            self.__counters["in_flight"] += 1
+            self.__counters["peak_in_flight"] = max(self.__counters["peak_in_flight"], self.__counters["in_flight"])
+
+    def exit(self):
+        with self.__lock:
+            self.__counters["in_flight"] -= 1
+
+    def count(self, name: str):
+        with self.__lock:
+            self.__counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        open_connections = 0
+        idle_connections = 0
+        for transport in self.__transports:
+            # httpx keeps its httpcore pool private, it lists the open connections
+            for connection in getattr(getattr(transport, "_pool", None), "connections", []):
+                open_connections += 1
+                idle_connections += int(connection.is_idle())
+        with self.__lock:
+            counters = dict(self.__counters)
+        return {
+            **counters,
+            "max_connections": self.max_connections,
+            "saturation": round(counters["in_flight"] / self.max_connections, 3),
+            "open_connections": open_connections,
+            "idle_connections": idle_connections,
+        }
+
+
+class _CountedStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, on_close: Callable[[], None]):
+        self.__stream = stream
+        self.__on_close = on_close
+        self.__closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.__stream
+
+    def close(self):
+        try:
+            self.__stream.close()
+        finally:
+            if not self.__closed:
+                self.__closed = True
+                self.__on_close()
+
+
+class _AsyncCountedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self.__stream = stream
+        self.__on_close = on_close
+        self.__closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.__stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.__stream.aclose()
+        finally:
+            if not self.__closed:
+                self.__closed = True
+                self.__on_close()
+
+
+def get_retry_delay(attempt: int, backoff: float, max_backoff: float) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+class PooledTransport(httpx.BaseTransport):
+    """``httpx.HTTPTransport`` retrying failed connects with jittered backoff, counted in ``stats``.
+
+    Only connection failures are retried, the request never reached the server then.
+    Status codes like 429 are retried by the model SDKs themselves.
+    """
+
+    def __init__(self, stats: PoolStats, retries: int, backoff: float, max_backoff: float, **transport_config: Any):
+        self.__transport = httpx.HTTPTransport(**transport_config)
+        self.__stats = stats
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__max_backoff = max_backoff
+        stats.add_transport(self.__transport)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            self.__stats.enter()
+            try:
+                response = self.__transport.handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                self.__stats.exit()
+                self.__stats.count("connect_errors")
+                if attempt >= self.__retries:
+                    raise
+                self.__stats.count("retries")
+                time.sleep(get_retry_delay(attempt, self.__backoff, self.__max_backoff))
+                attempt += 1
+                continue
+            except BaseException:
+                self.__stats.exit()
+                raise
+            response.stream = _CountedStream(response.stream, self.__stats.exit)
+            return response
+
+    def close(self):
+        self.__transport.close()
+
+
+class AsyncPooledTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of ``PooledTransport``."""
+
+    def __init__(self, stats: PoolStats, retries: int, backoff: float, max_backoff: float, **transport_config: Any):
+        self.__transport = httpx.AsyncHTTPTransport(**transport_config)
+        self.__stats = stats
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__max_backoff = max_backoff
+        stats.add_transport(self.__transport)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            self.__stats.enter()
+            try:
+                response = await self.__transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                self.__stats.exit()
+                self.__stats.count("connect_errors")
+                if attempt >= self.__retries:
+                    raise
+                self.__stats.count("retries")
+                await asyncio.sleep(get_retry_delay(attempt, self.__backoff, self.__max_backoff))
+                attempt += 1
+                continue
+            except BaseException:
+                self.__stats.exit()
+                raise
+            response.stream = _AsyncCountedStream(response.stream, self.__stats.exit)
+            return response
+
+    async def aclose(self):
+        await self.__transport.aclose()
@@ -1,17 +1,66 @@
 import os
+import json
+import threading
+import httpx
+from pathlib import Path
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
 from agno.storage.agent.postgres import PostgresAgentStorage
 from agno.storage.workflow.postgres import PostgresWorkflowStorage
 from agno.storage.workflow.sqlite import SqliteWorkflowStorage
 from agno.models.groq import Groq
 from agno.models.openai import OpenAIChat
+from groq import Groq as GroqClient, AsyncGroq as AsyncGroqClient
+from openai import OpenAI as OpenAIClient, AsyncOpenAI as AsyncOpenAIClient
+from src.config.http_pool import PoolStats, PooledTransport, AsyncPooledTransport
+from src.config.logging_config import logger
 
 load_dotenv()
 
+class PooledSqliteWorkflowStorage(SqliteWorkflowStorage):
+    """SqliteWorkflowStorage on a shared engine.
+
+    agno replaces a given ``db_engine`` by an in-memory database, so the engine is bound
+    after the storage is created.
+    """
+
+    def __init__(self, table_name: str, db_engine: Engine):
+        super().__init__(table_name=table_name)
+        self.db_engine = db_engine
+        self.inspector = inspect(db_engine)
+        self.Session = sessionmaker(bind=db_engine)
+
+
 class LlmConfigs:
     def __init__(self):
         self.__use_local_storage = True
         self.__pg_db_url = os.getenv("PG_DB_URL")
+        # sqlite: engine per storage (default), sqlite_wal: WAL mode with a pooled engine,
+        # postgres: PostgresWorkflowStorage with a pooled engine
+        self.__workflow_storage_mode = os.getenv("WORKFLOW_STORAGE", "sqlite").lower()
+        self.__workflow_db_file = os.getenv("WORKFLOW_SQLITE_DB", "tmp/workflows.db")
+        self.__db_pool_size = int(os.getenv("WORKFLOW_DB_POOL_SIZE", "8"))
+        self.__db_max_overflow = int(os.getenv("WORKFLOW_DB_MAX_OVERFLOW", "16"))
+        # engines are shared by every storage of this worker, one pool per database
+        self.__db_engines = {}
+        # HTTP connection pools shared by the model and TTS clients of this worker
+        self.__http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+        self.__http_max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.__http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+        self.__http_timeout = float(os.getenv("HTTP_TIMEOUT_SECONDS", "120"))
+        self.__http_connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+        self.__http_connect_retries = int(os.getenv("HTTP_CONNECT_RETRIES", "2"))
+        self.__http2 = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+        self.__http_stats = {
+            "sync": PoolStats(self.__http_max_connections),
+            "async": PoolStats(self.__http_max_connections),
+        }
+        self.__http_clients = {}
+        self.__model_clients = {}
+        self.__http_lock = threading.Lock()
     
     def get_agent_storage(self, table_name: str):
         return PostgresAgentStorage(
@@ -19,18 +68,167 @@ class LlmConfigs:
             db_url=self.__pg_db_url
         )
     
-    def get_workflow_storage(self, table_name: str):
-        return SqliteWorkflowStorage(
+    def __get_sqlite_wal_engine(self) -> Engine:
+        db_path = Path(self.__workflow_db_file).resolve()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        engine = create_engine(
+            f"sqlite:///{db_path}",
+            pool_size=self.__db_pool_size,
+            max_overflow=self.__db_max_overflow,
+            connect_args={"check_same_thread": False, "timeout": 30}
+        )
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            # readers no longer block the writer, and writers wait on the lock instead of failing
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=30000")
+            cursor.close()
+
+        return engine
+
+    def __get_postgres_engine(self) -> Engine:
+        return create_engine(
+            self.__pg_db_url,
+            pool_size=self.__db_pool_size,
+            max_overflow=self.__db_max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=1800
+        )
+
+    def get_db_engine(self, mode: Optional[str] = None) -> Engine:
+        """Pooled engine of the workflow storage, created once per worker."""
+        mode = mode or self.__workflow_storage_mode
+        if mode not in self.__db_engines:
+            if mode == "postgres":
+                self.__db_engines[mode] = self.__get_postgres_engine()
+            else:
+                self.__db_engines[mode] = self.__get_sqlite_wal_engine()
+        return self.__db_engines[mode]
+
+    def __use_http2(self) -> bool:
+        if not self.__http2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP2_ENABLED is set but h2 is not installed (pip install httpx[http2]), using HTTP/1.1")
+            self.__http2 = False
+        return self.__http2
+
+    def __get_http_config(self) -> Dict[str, Any]:
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.__http_max_connections,
+                max_keepalive_connections=self.__http_max_keepalive_connections,
+                keepalive_expiry=self.__http_keepalive_expiry
+            ),
+            "http2": self.__use_http2(),
+            "retries": self.__http_connect_retries,
+            "backoff": 0.25,
+            "max_backoff": 4.0
+        }
+
+    def get_http_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.__http_timeout, connect=self.__http_connect_timeout)
+
+    def get_http_client(self) -> httpx.Client:
+        """Keep-alive HTTP client of this worker, thread safe and shared by every sync client."""
+        with self.__http_lock:
+            if "sync" not in self.__http_clients:
+                self.__http_clients["sync"] = httpx.Client(
+                    transport=PooledTransport(self.__http_stats["sync"], **self.__get_http_config()),
+                    timeout=self.get_http_timeout()
+                )
+            return self.__http_clients["sync"]
+
+    def get_async_http_client(self) -> httpx.AsyncClient:
+        """Keep-alive HTTP client of this worker for the async clients, used from its event loop."""
+        with self.__http_lock:
+            if "async" not in self.__http_clients:
+                self.__http_clients["async"] = httpx.AsyncClient(
+                    transport=AsyncPooledTransport(self.__http_stats["async"], **self.__get_http_config()),
+                    timeout=self.get_http_timeout()
+                )
+            return self.__http_clients["async"]
+
+    def get_model_clients(self, model) -> Dict[str, Any]:
+        """Groq/OpenAI SDK clients for the model on the shared HTTP clients, one set per configuration."""
+        client_params = model._get_client_params()
+        client_params.setdefault("timeout", self.get_http_timeout())
+        key = (type(model).__name__, json.dumps(client_params, sort_keys=True, default=str))
+        with self.__http_lock:
+            if key in self.__model_clients:
+                return self.__model_clients[key]
+        if isinstance(model, Groq):
+            model_clients = {
+                "client": GroqClient(**client_params, http_client=self.get_http_client()),
+                "async_client": AsyncGroqClient(**client_params, http_client=self.get_async_http_client()),
+            }
+        elif isinstance(model, OpenAIChat):
+            model_clients = {
+                "client": OpenAIClient(**client_params, http_client=self.get_http_client()),
+                "async_client": AsyncOpenAIClient(**client_params, http_client=self.get_async_http_client()),
+            }
+        else:
+            model_clients = {"client": model.get_client(), "async_client": model.get_async_client()}
+        with self.__http_lock:
+            return self.__model_clients.setdefault(key, model_clients)
+
+    def get_http_stats(self) -> Dict[str, Any]:
+        return {name: stats.stats() for name, stats in self.__http_stats.items()}
+
+    @staticmethod
+    def __create_table(storage):
+        # agno creates the table on the first failed read, concurrent first reads race on it
+        try:
+            storage.create()
+        except Exception:
+            # another worker created it first
+            if not storage.table_exists():
+                raise
+        return storage
+
+    def get_workflow_storage(self, table_name: str, mode: Optional[str] = None):
+        mode = mode or self.__workflow_storage_mode
+        if mode == "postgres":
+            return self.__create_table(PostgresWorkflowStorage(
+                table_name=f"workflow_{table_name}",
+                db_engine=self.get_db_engine(mode)
+            ))
+        if mode == "sqlite_wal":
+            return self.__create_table(PooledSqliteWorkflowStorage(
+                table_name=table_name,
+                db_engine=self.get_db_engine(mode)
+            ))
+        return self.__create_table(SqliteWorkflowStorage(
                 table_name=table_name,
-                db_file="tmp/workflows.db"
-            )
-        # return PostgresWorkflowStorage(
-        #     table_name=f"workflow_{table_name}",
-        #     db_url=self.__pg_db_url
-        # )
+                db_file=self.__workflow_db_file
+            ))
     
-    def get_openai_base_model(self, use_slm: bool = True):
+    def get_model(self, provider: str, model_id: str, return_json: bool = False, max_retries: Optional[int] = None):
+        """Model ``model_id`` of ``provider`` ("groq" or "openai"), used by the model routes.
+
+        ``max_retries`` overrides the retries of the SDK client, None keeps its default.
+        """
+        config = {"id": model_id}
+        if max_retries is not None:
+            config["max_retries"] = max_retries
+        if return_json:
+            config["response_format"] = { "type": "json_object" }
+        if provider == "groq":
+            return Groq(**config)
+        if provider == "openai":
+            return OpenAIChat(**config)
+        raise ValueError(f"Unknown model provider {provider}")
+
+    def get_openai_base_model(self, use_slm: bool = True, return_json: bool = False):
         config = {}
+        # add response format for OpenAI
+        if return_json:
+            config["response_format"] = { "type": "json_object" }
         # switch models for SLM or LLM
         if use_slm:
             config["id"] = "gpt-4o-mini"
@@ -0,0 +1,531 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import aclosing, closing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from agno.agent import Agent
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from src.config.llm_config import llm_config_handler
+from src.config.logging_config import logger
+from src.config.rate_limiter import RATE_LIMIT_STATUS_CODES, get_status_code, is_rate_limited, rate_limiter
+from src.api.tracing import tracer
+
+# USD per million output tokens, compared with the cost budget of the routes
+MODEL_PRICES = {
+    "groq/llama-3.1-8b-instant": 0.08,
+    "groq/llama-3.3-70b-versatile": 0.79,
+    "openai/gpt-4o-mini": 0.60,
+    "openai/gpt-4o": 10.00,
+}
+# task classes, the models are tried in this order when they are within the budgets
+DEFAULT_ROUTES = {
+    # short messages such as the confirmation message
+    "chat": {
+        "models": ["groq/llama-3.1-8b-instant", "openai/gpt-4o-mini", "groq/llama-3.3-70b-versatile"],
+        "latency_budget": 2.0,
+        "cost_budget": 1.0,
+        "hedge_after": 1.5,
+        "lane": "interactive",
+    },
+    # structured data out of a report or a lesson plan
+    "extraction": {
+        "models": ["groq/llama-3.3-70b-versatile", "openai/gpt-4o-mini"],
+        "latency_budget": 15.0,
+        "cost_budget": 1.0,
+        "hedge_after": 10.0,
+    },
+    # long lesson plans
+    "planning": {
+        "models": ["openai/gpt-4o-mini", "groq/llama-3.3-70b-versatile", "openai/gpt-4o"],
+        "latency_budget": 60.0,
+        "cost_budget": 1.0,
+        "hedge_after": None,
+    },
+    # study guides, written by llama-3.3-70b-versatile first as before the routes
+    "study_guide": {
+        "models": ["groq/llama-3.3-70b-versatile", "openai/gpt-4o-mini", "openai/gpt-4o"],
+        "latency_budget": 60.0,
+        "cost_budget": 1.0,
+        "hedge_after": None,
+    },
+}
+# requests failing with these or a rate limit fall back to the next model, agno raises connection errors as 502
+UNAVAILABLE_STATUS_CODES = (500, 502, 503, 504)
+
+
+def can_fall_back(error: BaseException) -> bool:
+    """Whether another model may answer the request, the model is rate limited or unavailable."""
+    return get_status_code(error) in RATE_LIMIT_STATUS_CODES + UNAVAILABLE_STATUS_CODES
+
+
+class ModelTier:
+    """One model of a route, named ``"<provider>/<model id>"``."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.provider, _, self.model_id = name.partition("/")
+        self.cost = MODEL_PRICES.get(name, 0.0)
+
+
+class ModelRoute:
+    """Models of a task class with the budgets used to pick one.
+
+    ``latency_budget`` is the p95 in seconds and ``cost_budget`` the USD per million output
+    tokens a model may have to be preferred. Runs still waiting after ``hedge_after`` seconds
+    get a backup request until the p95 of their model is known, None waits for the p95.
+    ``lane`` is the priority lane of its requests in ``rate_limiter``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        models: List[str],
+        latency_budget: float,
+        cost_budget: float,
+        hedge_after: Optional[float] = None,
+        lane: str = "bulk",
+    ):
+        if not models:
+            raise ValueError(f"Model route {name} has no models")
+        self.name = name
+        self.tiers = [ModelTier(model) for model in models]
+        self.latency_budget = latency_budget
+        self.cost_budget = cost_budget
+        self.hedge_after = hedge_after
+        self.lane = lane
+
+
+class LatencyWindow:
+    """Latencies of the last successful requests of a model on a route, with request counts."""
+
+    def __init__(self, size: int):
+        self.latencies: Deque[float] = deque(maxlen=size)
+        self.counts = {"requests": 0, "ok": 0, "rate_limited": 0, "unavailable": 0, "errors": 0, "cancelled": 0}
+
+    def percentile(self, quantile: float, min_samples: int = 1) -> Optional[float]:
+        if len(self.latencies) < max(min_samples, 1):
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(quantile * len(latencies)), len(latencies) - 1)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        percentiles = {
+            name: round(value, 4) if value is not None else None
+            for name, value in (("p50", self.percentile(0.5)), ("p95", self.percentile(0.95)))
+        }
+        return {**self.counts, **percentiles, "samples": len(self.latencies)}
+
+
+class ModelRouter:
+    """Picks the model of every agent run by the task class of the agent.
+
+    Agents get their model from ``get_model(route)``, which is the first model of the route.
+    Each run tries the models of the route in order, models within the latency budget
+    (observed p95) and the cost budget first and models rate limited or unavailable within
+    the last ``cooldown`` seconds last. A run still waiting after the p95 of its model gets a
+    backup request to the fastest other model and the first answer wins. A rate limited or
+    unavailable model falls back to the next one, other errors are raised. The SDK clients
+    of routes with several models don't retry, the next model is the retry. Streams are hedged and fall back
+    until their first chunk. Every request first waits for ``rate_limiter`` in the lane of
+    its route. Latencies are kept per route, kind ("run" or "first_chunk") and model, agents
+    without a route run as they are.
+    """
+
+    def __init__(
+        self,
+        routes: Dict[str, ModelRoute],
+        hedging: bool = True,
+        cooldown: float = 30.0,
+        window: int = 256,
+        min_samples: int = 20,
+        hedge_workers: int = 32,
+    ):
+        self.routes = routes
+        self.hedging = hedging
+        self.cooldown = cooldown
+        self.window = window
+        self.min_samples = min_samples
+        # models handed out by get_model, by id, with their route and tier
+        self.__models: Dict[int, Tuple[Any, str, str]] = {}
+        # copies of the template agents on the other models of their route
+        self.__agents: Dict[Tuple[int, str], Tuple[Agent, Agent]] = {}
+        self.__windows: Dict[Tuple[str, str, str], LatencyWindow] = {}
+        self.__events: Dict[Tuple[str, str], int] = {}
+        self.__cooldowns: Dict[str, float] = {}
+        self.__lock = threading.Lock()
+        # sync runs wait on the primary request from here to hedge it
+        self.__executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="model-hedge")
+
+    def get_model(self, route: str, return_json: bool = False):
+        """Model for an agent of the ``route`` task class, the runs of the agent are routed."""
+        tiers = self.routes[route].tiers
+        model = llm_config_handler.get_model(
+            tiers[0].provider, tiers[0].model_id, return_json=return_json, max_retries=0 if len(tiers) > 1 else None
+        )
+        with self.__lock:
+            self.__models[id(model)] = (model, route, tiers[0].name)
+        return model
+
+    def get_route(self, agent: Agent) -> Optional[ModelRoute]:
+        model = getattr(agent, "model", None)
+        with self.__lock:
+            entry = self.__models.get(id(model))
+        if entry is None or entry[0] is not model:
+            return None
+        return self.routes[entry[1]]
+
+    def __get_agent(self, template: Agent, tier: ModelTier) -> Agent:
+        """The template agent on the model of ``tier``, one copy per template and model."""
+        with self.__lock:
+            if self.__models[id(template.model)][2] == tier.name:
+                return template
+            entry = self.__agents.get((id(template), tier.name))
+            if entry is not None and entry[0] is template:
+                return entry[1]
+        model = llm_config_handler.get_model(
+            tier.provider,
+            tier.model_id,
+            return_json=getattr(template.model, "response_format", None) is not None,
+            max_retries=template.model.max_retries,
+        )
+        agent = template.deep_copy(update={"model": model})
+        with self.__lock:
+            # the pools are keyed by template, the first copy of a race is the one kept
+            entry = self.__agents.get((id(template), tier.name))
+            if entry is None or entry[0] is not template:
+                entry = self.__agents[(id(template), tier.name)] = (template, agent)
+            return entry[1]
+
+    def __get_window(self, route: ModelRoute, kind: str, tier: ModelTier) -> LatencyWindow:
+        key = (route.name, kind, tier.name)
+        window = self.__windows.get(key)
+        if window is None:
+            window = self.__windows.setdefault(key, LatencyWindow(self.window))
+        return window
+
+    def __percentile(self, route: ModelRoute, kind: str, tier: ModelTier, quantile: float) -> Optional[float]:
+        with self.__lock:
+            return self.__get_window(route, kind, tier).percentile(quantile, self.min_samples)
+
+    def __is_cooling_down(self, tier: ModelTier) -> bool:
+        with self.__lock:
+            return self.__cooldowns.get(tier.name, 0.0) > time.monotonic()
+
+    def get_candidates(self, route: ModelRoute, kind: str = "run") -> List[ModelTier]:
+        """Models of the route in the order they are tried."""
+        preferred, over_budget, cooling_down = [], [], []
+        for tier in route.tiers:
+            p95 = self.__percentile(route, kind, tier, 0.95)
+            if self.__is_cooling_down(tier):
+                cooling_down.append(tier)
+            elif tier.cost > route.cost_budget or (p95 is not None and p95 > route.latency_budget):
+                over_budget.append(tier)
+            else:
+                preferred.append(tier)
+        with self.__lock:
+            cooling_down.sort(key=lambda tier: self.__cooldowns.get(tier.name, 0.0))
+        return preferred + over_budget + cooling_down
+
+    def __get_hedge_deadline(self, route: ModelRoute, kind: str, tier: ModelTier, remaining: List[ModelTier]) -> Optional[float]:
+        if not self.hedging or self.__get_backup(route, kind, remaining) is None:
+            return None
+        p95 = self.__percentile(route, kind, tier, 0.95)
+        if p95 is not None:
+            return p95
+        # first chunks are only hedged once their p95 is known
+        return route.hedge_after if kind == "run" else None
+
+    def __get_backup(self, route: ModelRoute, kind: str, remaining: List[ModelTier]) -> Optional[ModelTier]:
+        """The fastest model left that isn't cooling down, models without enough samples last."""
+        backups = [tier for tier in remaining if not self.__is_cooling_down(tier)]
+        if not backups:
+            return None
+        p50s = [self.__percentile(route, kind, tier, 0.5) for tier in backups]
+        return min(zip(backups, p50s), key=lambda backup: float("inf") if backup[1] is None else backup[1])[0]
+
+    def __count_event(self, route: ModelRoute, event: str):
+        with self.__lock:
+            self.__events[(route.name, event)] = self.__events.get((route.name, event), 0) + 1
+        tracer.count_model_route_event(route.name, event)
+
+    def __record(self, route: ModelRoute, kind: str, tier: ModelTier, seconds: float, error: Optional[BaseException]):
+        if error is None:
+            outcome = "ok"
+        elif isinstance(error, asyncio.CancelledError):
+            outcome = "cancelled"
+        elif is_rate_limited(error):
+            outcome = "rate_limited"
+        elif can_fall_back(error):
+            outcome = "unavailable"
+        else:
+            outcome = "errors"
+        with self.__lock:
+            window = self.__get_window(route, kind, tier)
+            window.counts["requests"] += 1
+            window.counts[outcome] += 1
+            if outcome == "ok":
+                window.latencies.append(seconds)
+            elif outcome in ("rate_limited", "unavailable"):
+                self.__cooldowns[tier.name] = time.monotonic() + self.cooldown
+        if outcome in ("rate_limited", "unavailable"):
+            logger.warning(f"{tier.name} is {outcome.replace('_', ' ')}, route {route.name} falls back for {self.cooldown}s")
+        if outcome == "rate_limited":
+            # the other workers hold back their requests to the provider too
+            rate_limiter.penalize(tier.provider)
+        tracer.observe_model_request(route.name, kind, tier.name, seconds, outcome)
+
+    @staticmethod
+    def __settle(tier: ModelTier, tokens: float, result: Any):
+        # the estimate is replaced by the usage once a run reports it
+        metrics = getattr(result, "metrics", None)
+        if isinstance(metrics, dict) and metrics.get("input_tokens", None):
+            used = sum(metrics["input_tokens"]) + sum(metrics.get("output_tokens", None) or [])
+            rate_limiter.settle(tier.provider, used - tokens)
+
+    def __attempt(
+        self, route: ModelRoute, kind: str, tier: ModelTier, template: Agent, start: Callable[[Agent], Any], tokens: float
+    ) -> Any:
+        rate_limiter.acquire(tier.provider, tokens, lane=route.lane)
+        started = time.perf_counter()
+        try:
+            result = start(self.__get_agent(template, tier))
+        except BaseException as error:
+            self.__record(route, kind, tier, time.perf_counter() - started, error)
+            raise
+        self.__record(route, kind, tier, time.perf_counter() - started, None)
+        self.__settle(tier, tokens, result)
+        return result
+
+    async def __aattempt(
+        self,
+        route: ModelRoute,
+        kind: str,
+        tier: ModelTier,
+        template: Agent,
+        start: Callable[[Agent], Awaitable[Any]],
+        tokens: float,
+    ) -> Any:
+        await rate_limiter.aacquire(tier.provider, tokens, lane=route.lane)
+        started = time.perf_counter()
+        try:
+            result = await start(self.__get_agent(template, tier))
+        except BaseException as error:
+            self.__record(route, kind, tier, time.perf_counter() - started, error)
+            raise
+        self.__record(route, kind, tier, time.perf_counter() - started, None)
+        await asyncio.to_thread(self.__settle, tier, tokens, result)
+        return result
+
+    def __submit(self, *args: Any) -> Future:
+        # the request runs in the context of the caller, e.g. its queue listener
+        return self.__executor.submit(contextvars.copy_context().run, self.__attempt, *args)
+
+    def __call(
+        self,
+        route: ModelRoute,
+        kind: str,
+        template: Agent,
+        start: Callable[[Agent], Any],
+        tokens: float = 0,
+        discard: Optional[Callable[[Any], None]] = None,
+    ) -> Any:
+        remaining = self.get_candidates(route, kind)
+        pending: Dict[Future, ModelTier] = {}
+        backups = set()
+        last_error: Optional[Exception] = None
+        try:
+            while remaining or pending:
+                if not pending:
+                    if last_error is not None:
+                        if not can_fall_back(last_error):
+                            raise last_error
+                        self.__count_event(route, "fallbacks")
+                    tier = remaining.pop(0)
+                    deadline = None if backups else self.__get_hedge_deadline(route, kind, tier, remaining)
+                    if deadline is None:
+                        # nothing to hedge with, the request runs on the calling thread
+                        try:
+                            return self.__attempt(route, kind, tier, template, start, tokens)
+                        except Exception as error:
+                            last_error = error
+                            continue
+                    pending[self.__submit(route, kind, tier, template, start, tokens)] = tier
+                    done, _ = wait(pending, timeout=deadline)
+                    backup = None if done else self.__get_backup(route, kind, remaining)
+                    if backup is not None:
+                        remaining.remove(backup)
+                        future = self.__submit(route, kind, backup, template, start, tokens)
+                        pending[future] = backup
+                        backups.add(future)
+                        self.__count_event(route, "hedges")
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.pop(future)
+                    if future.exception() is None:
+                        if future in backups:
+                            self.__count_event(route, "hedge_wins")
+                        return future.result()
+                    last_error = future.exception()
+            raise last_error
+        finally:
+            # sync requests can't be cancelled, the answers of the losers are dropped
+            for future in pending:
+                if discard is not None:
+                    future.add_done_callback(lambda lost: discard(lost.result()) if lost.exception() is None else None)
+
+    async def __acall(
+        self,
+        route: ModelRoute,
+        kind: str,
+        template: Agent,
+        start: Callable[[Agent], Awaitable[Any]],
+        tokens: float = 0,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> Any:
+        remaining = self.get_candidates(route, kind)
+        pending: Dict[asyncio.Task, ModelTier] = {}
+        backups = set()
+        last_error: Optional[Exception] = None
+        try:
+            while remaining or pending:
+                if not pending:
+                    if last_error is not None:
+                        if not can_fall_back(last_error):
+                            raise last_error
+                        self.__count_event(route, "fallbacks")
+                    tier = remaining.pop(0)
+                    deadline = None if backups else self.__get_hedge_deadline(route, kind, tier, remaining)
+                    pending[asyncio.ensure_future(self.__aattempt(route, kind, tier, template, start, tokens))] = tier
+                    done, _ = await asyncio.wait(pending, timeout=deadline)
+                    backup = None if done else self.__get_backup(route, kind, remaining)
+                    if backup is not None:
+                        remaining.remove(backup)
+                        task = asyncio.ensure_future(self.__aattempt(route, kind, backup, template, start, tokens))
+                        pending[task] = backup
+                        backups.add(task)
+                        self.__count_event(route, "hedges")
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        if task in backups:
+                            self.__count_event(route, "hedge_wins")
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            if discard is not None:
+                for task in pending:
+                    if task.done() and not task.cancelled() and task.exception() is None:
+                        await discard(task.result())
+
+    def run(self, agent: Agent, call: Callable[[Agent], Any], tokens: float = 0) -> Any:
+        """Returns ``call(agent)`` with the agent on the model picked by its route.
+
+        ``tokens`` is the estimated usage taken from ``rate_limiter`` before each request.
+        """
+        route = self.get_route(agent)
+        if route is None:
+            return call(agent)
+        return self.__call(route, "run", agent, call, tokens)
+
+    async def arun(self, agent: Agent, call: Callable[[Agent], Awaitable[Any]], tokens: float = 0) -> Any:
+        """Async counterpart of ``run``."""
+        route = self.get_route(agent)
+        if route is None:
+            return await call(agent)
+        return await self.__acall(route, "run", agent, call, tokens)
+
+    def stream(self, agent: Agent, open_stream: Callable[[Agent], Iterator[Any]], tokens: float = 0) -> Iterator[Any]:
+        """Yields from ``open_stream(agent)`` on the model picked by the route, routed until the first chunk."""
+        route = self.get_route(agent)
+        if route is None:
+            yield from open_stream(agent)
+            return
+
+        def start(routed_agent: Agent) -> Tuple[List[Any], Iterator[Any]]:
+            chunks = open_stream(routed_agent)
+            try:
+                return [next(chunks)], chunks
+            except StopIteration:
+                return [], chunks
+
+        first, chunks = self.__call(route, "first_chunk", agent, start, tokens, discard=lambda started: started[1].close())
+        with closing(chunks):
+            yield from first
+            yield from chunks
+
+    async def astream(
+        self, agent: Agent, open_stream: Callable[[Agent], AsyncIterator[Any]], tokens: float = 0
+    ) -> AsyncIterator[Any]:
+        """Async counterpart of ``stream``."""
+        route = self.get_route(agent)
+        if route is None:
+            async for chunk in open_stream(agent):
+                yield chunk
+            return
+
+        async def start(routed_agent: Agent) -> Tuple[List[Any], AsyncIterator[Any]]:
+            chunks = open_stream(routed_agent)
+            try:
+                return [await chunks.__anext__()], chunks
+            except StopAsyncIteration:
+                return [], chunks
+
+        async def discard(started: Tuple[List[Any], AsyncIterator[Any]]):
+            await started[1].aclose()
+
+        first, chunks = await self.__acall(route, "first_chunk", agent, start, tokens, discard=discard)
+        async with aclosing(chunks):
+            for chunk in first:
+                yield chunk
+            async for chunk in chunks:
+                yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            windows = dict(self.__windows)
+            events = dict(self.__events)
+            cooldowns = dict(self.__cooldowns)
+        now = time.monotonic()
+        stats = {}
+        for route in self.routes.values():
+            route_stats = stats[route.name] = {
+                "models": [tier.name for tier in route.tiers],
+                "latency_budget": route.latency_budget,
+                "cost_budget": route.cost_budget,
+                "hedge_after": route.hedge_after,
+                "order": [tier.name for tier in self.get_candidates(route)],
+                **{event: events.get((route.name, event), 0) for event in ("hedges", "hedge_wins", "fallbacks")},
+            }
+            for (route_name, kind, model), window in windows.items():
+                if route_name == route.name:
+                    with self.__lock:
+                        model_stats = window.to_dict()
+                    model_stats["cooling_down"] = cooldowns.get(model, 0.0) > now
+                    route_stats.setdefault(kind, {})[model] = model_stats
+        return stats
+
+
+def __create_model_router() -> ModelRouter:
+    routes = {name: dict(config) for name, config in DEFAULT_ROUTES.items()}
+    # e.g. {"chat": {"models": ["openai/gpt-4o-mini"], "hedge_after": 1.0}}
+    for name, config in json.loads(os.getenv("MODEL_ROUTES", "") or "{}").items():
+        routes[name] = {**routes.get(name, {}), **config}
+    return ModelRouter(
+        routes={name: ModelRoute(name, **config) for name, config in routes.items()},
+        hedging=os.getenv("MODEL_HEDGING", "true").lower() == "true",
+        cooldown=float(os.getenv("MODEL_RATE_LIMIT_COOLDOWN_SECONDS", "30")),
+        window=int(os.getenv("MODEL_ROUTE_STATS_WINDOW", "256")),
+        min_samples=int(os.getenv("MODEL_ROUTE_MIN_SAMPLES", "20")),
+        hedge_workers=int(os.getenv("MODEL_HEDGE_WORKERS", "32")),
+    )
+
+
+model_router = __create_model_router()
@@ -0,0 +1,354 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from src.config.logging_config import logger
+from src.api.tracing import tracer
+
+# callers of a lower number go first, within a lane in the order they queued
+LANES = {"interactive": 0, "bulk": 1}
+# per minute limits of every provider, ElevenLabs tokens are characters of text
+DEFAULT_LIMITS = {
+    "groq": {"requests_per_minute": 1000, "tokens_per_minute": 300_000},
+    "openai": {"requests_per_minute": 500, "tokens_per_minute": 200_000},
+    "elevenlabs": {"requests_per_minute": 120, "tokens_per_minute": 100_000},
+}
+RATE_LIMIT_STATUS_CODES = (429,)
+
+# called with a QUEUED event while a call of the context waits, see listen_queue
+queue_listener: ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = ContextVar("queue_listener", default=None)
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """Status code of a provider error, agno and the SDKs keep the one of the response."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return get_status_code(error) in RATE_LIMIT_STATUS_CODES
+
+
+@contextmanager
+def listen_queue(publish: Callable[[Dict[str, Any]], None]) -> Iterator[None]:
+    """Publishes the ``QUEUED`` events of the calls made within the block, from any thread.
+
+    ``publish`` is called on the running event loop with ``{"type": "QUEUED", "message"}``,
+    the message holds the provider, lane and queue position, position 0 once admitted.
+    """
+    loop = asyncio.get_running_loop()
+    token = queue_listener.set(lambda event: loop.call_soon_threadsafe(publish, event))
+    try:
+        yield
+    finally:
+        queue_listener.reset(token)
+
+
+class RateLimiter:
+    """Token buckets of the outbound LLM and TTS requests, shared by the workers through SQLite.
+
+    Every provider has a bucket of requests and a bucket of tokens, refilled continuously
+    up to their per minute limits. A call takes one request and its estimated tokens. It
+    waits in the queue of the provider while they are missing, or while a caller of a
+    higher priority lane, or of its lane but queued before it, is waiting. Waiters move up
+    a lane every ``promote_after`` seconds. The queue is a table of the same file, so lanes
+    and positions hold across workers. A rate limited response blocks the provider for
+    every worker for ``penalty`` seconds.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, float]],
+        db_file: str = "tmp/rate_limits.db",
+        enabled: bool = True,
+        penalty: float = 5.0,
+        completion_tokens: int = 1000,
+        max_poll: float = 0.5,
+        stale_after: float = 10.0,
+        promote_after: float = 30.0,
+    ):
+        self.limits = limits
+        self.db_file = db_file
+        self.enabled = enabled
+        self.penalty = penalty
+        self.completion_tokens = completion_tokens
+        self.max_poll = max_poll
+        # waiters of a worker that died are dropped once they stop polling
+        self.stale_after = stale_after
+        # a waiter moves up a lane every promote_after seconds, bulk calls aren't starved
+        self.promote_after = promote_after
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__counters: Dict[str, Dict[str, float]] = {}
+        if enabled:
+            self.__create_tables()
+
+    def __connect(self) -> sqlite3.Connection:
+        # one connection per thread, opening one costs more than the transaction
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            # transactions are started explicitly, every acquire takes the write lock right away
+            connection = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+        return connection
+
+    def __create_tables(self):
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        connection = self.__connect()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                provider TEXT PRIMARY KEY,
+                requests REAL NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                blocked_until REAL NOT NULL
+            )
+        """)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS rate_waiters (
+                ticket TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                queued_at REAL NOT NULL,
+                seen REAL NOT NULL
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS rate_waiters_provider ON rate_waiters (provider, priority, queued_at)")
+
+    def __refill(self, connection: sqlite3.Connection, provider: str, now: float) -> Tuple[float, float, float]:
+        limits = self.limits[provider]
+        row = connection.execute(
+            "SELECT requests, tokens, updated, blocked_until FROM rate_buckets WHERE provider = ?", (provider,)
+        ).fetchone()
+        if row is None:
+            return limits["requests_per_minute"], limits["tokens_per_minute"], 0.0
+        requests, tokens, updated, blocked_until = row
+        elapsed = max(now - updated, 0.0)
+        requests = min(limits["requests_per_minute"], requests + elapsed * limits["requests_per_minute"] / 60)
+        tokens = min(limits["tokens_per_minute"], tokens + elapsed * limits["tokens_per_minute"] / 60)
+        return requests, tokens, blocked_until
+
+    @staticmethod
+    def __save(connection: sqlite3.Connection, provider: str, requests: float, tokens: float, now: float, blocked_until: float):
+        connection.execute(
+            "INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?, ?, ?)",
+            (provider, requests, tokens, now, blocked_until)
+        )
+
+    def __try_acquire(self, provider: str, tokens: float, priority: int, ticket: str) -> Tuple[float, int]:
+        """Takes a request and the tokens, else queues the ticket.
+
+        Returns 0 and the position 0 once taken, else the seconds to wait before the next
+        try and the number of callers ahead in the queue.
+        """
+        limits = self.limits[provider]
+        connection = self.__connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            connection.execute("DELETE FROM rate_waiters WHERE seen < ?", (now - self.stale_after,))
+            row = connection.execute("SELECT queued_at FROM rate_waiters WHERE ticket = ?", (ticket,)).fetchone()
+            queued_at = row[0] if row is not None else now
+            lane_priority = priority - int((now - queued_at) / self.promote_after)
+            ahead = connection.execute(
+                """SELECT COUNT(*) FROM (
+                    SELECT priority - CAST((? - queued_at) / ? AS INTEGER) AS lane_priority, queued_at
+                    FROM rate_waiters WHERE provider = ? AND ticket != ?
+                ) WHERE lane_priority < ? OR (lane_priority = ? AND queued_at < ?)""",
+                (now, self.promote_after, provider, ticket, lane_priority, lane_priority, queued_at)
+            ).fetchone()[0]
+            requests, available_tokens, blocked_until = self.__refill(connection, provider, now)
+            # a call larger than the bucket waits for a full bucket and leaves it in debt
+            needed_tokens = min(tokens, limits["tokens_per_minute"])
+            if ahead == 0 and now >= blocked_until and requests >= 1 and available_tokens >= needed_tokens:
+                self.__save(connection, provider, requests - 1, available_tokens - tokens, now, blocked_until)
+                connection.execute("DELETE FROM rate_waiters WHERE ticket = ?", (ticket,))
+                connection.execute("COMMIT")
+                return 0.0, 0
+            self.__save(connection, provider, requests, available_tokens, now, blocked_until)
+            if row is None:
+                connection.execute(
+                    "INSERT INTO rate_waiters VALUES (?, ?, ?, ?, ?)", (ticket, provider, priority, now, now)
+                )
+            else:
+                connection.execute("UPDATE rate_waiters SET seen = ? WHERE ticket = ?", (now, ticket))
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        wait = max(
+            blocked_until - now,
+            (1 - requests) * 60 / limits["requests_per_minute"],
+            (needed_tokens - available_tokens) * 60 / limits["tokens_per_minute"],
+            0.0
+        )
+        # callers ahead are polled for, the bucket may be enough for them and this call
+        return min(wait, self.max_poll) if wait > 0 else min(0.05, self.max_poll), ahead
+
+    def __dequeue(self, ticket: str):
+        self.__connect().execute("DELETE FROM rate_waiters WHERE ticket = ?", (ticket,))
+
+    def __notify(self, provider: str, lane: str, position: int):
+        listener = queue_listener.get()
+        if listener is not None:
+            listener({
+                "type": "QUEUED",
+                "message": json.dumps({"provider": provider, "lane": lane, "position": position})
+            })
+
+    def __count(self, provider: str, lane: str, waited: float):
+        with self.__lock:
+            counters = self.__counters.setdefault(provider, {"acquired": 0, "queued_calls": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0})
+            counters["acquired"] += 1
+            if waited > 0:
+                counters["queued_calls"] += 1
+                counters["wait_seconds"] += waited
+                counters["max_wait_seconds"] = max(counters["max_wait_seconds"], waited)
+        tracer.observe_rate_limit_wait(provider, lane, waited)
+
+    def estimate_tokens(self, *prompt: Any) -> int:
+        """Tokens of an LLM call before it is made, about 4 characters a token plus a completion."""
+        return len(json.dumps(prompt, default=str)) // 4 + self.completion_tokens
+
+    def __is_limited(self, provider: str) -> bool:
+        return self.enabled and provider in self.limits
+
+    def acquire(self, provider: str, tokens: float = 0, lane: str = "bulk") -> float:
+        """Waits for a request and ``tokens`` of the provider, returns the seconds waited."""
+        if not self.__is_limited(provider):
+            return 0.0
+        ticket = uuid.uuid4().hex
+        started = time.perf_counter()
+        position = None
+        try:
+            while True:
+                wait, ahead = self.__try_acquire(provider, tokens, LANES[lane], ticket)
+                if wait <= 0:
+                    break
+                if position != ahead + 1:
+                    position = ahead + 1
+                    self.__notify(provider, lane, position)
+                time.sleep(wait)
+        except BaseException:
+            self.__dequeue(ticket)
+            raise
+        waited = time.perf_counter() - started if position is not None else 0.0
+        if position is not None:
+            self.__notify(provider, lane, 0)
+        self.__count(provider, lane, waited)
+        return waited
+
+    async def aacquire(self, provider: str, tokens: float = 0, lane: str = "bulk") -> float:
+        """Async counterpart of ``acquire``, the SQLite calls are made off the loop."""
+        if not self.__is_limited(provider):
+            return 0.0
+        ticket = uuid.uuid4().hex
+        started = time.perf_counter()
+        position = None
+        try:
+            while True:
+                wait, ahead = await asyncio.to_thread(self.__try_acquire, provider, tokens, LANES[lane], ticket)
+                if wait <= 0:
+                    break
+                if position != ahead + 1:
+                    position = ahead + 1
+                    self.__notify(provider, lane, position)
+                await asyncio.sleep(wait)
+        except BaseException:
+            # also when cancelled, the ticket would hold back the queue until it goes stale
+            self.__dequeue(ticket)
+            raise
+        waited = time.perf_counter() - started if position is not None else 0.0
+        if position is not None:
+            self.__notify(provider, lane, 0)
+        self.__count(provider, lane, waited)
+        return waited
+
+    def __update_bucket(self, provider: str, update: Callable[[float, float, float, float], Tuple[float, float]]):
+        connection = self.__connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            requests, tokens, blocked_until = self.__refill(connection, provider, now)
+            tokens, blocked_until = update(requests, tokens, blocked_until, now)
+            self.__save(connection, provider, requests, tokens, now, blocked_until)
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+    def settle(self, provider: str, extra_tokens: float):
+        """Corrects the estimated tokens of a call by its actual usage, a negative amount is given back."""
+        if not self.__is_limited(provider) or not extra_tokens:
+            return
+        capacity = self.limits[provider]["tokens_per_minute"]
+        self.__update_bucket(
+            provider, lambda requests, tokens, blocked_until, now: (min(tokens - extra_tokens, capacity), blocked_until)
+        )
+
+    def penalize(self, provider: str, seconds: Optional[float] = None):
+        """Blocks the provider for every worker after it rate limited a request."""
+        if not self.__is_limited(provider):
+            return
+        blocked_for = self.penalty if seconds is None else seconds
+        logger.warning(f"{provider} rate limited a request, blocked for {blocked_for}s")
+        self.__update_bucket(
+            provider, lambda requests, tokens, blocked_until, now: (tokens, max(blocked_until, now + blocked_for))
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self.__lock:
+            counters = {provider: dict(values) for provider, values in self.__counters.items()}
+        if not self.enabled:
+            return {"enabled": False, "providers": counters}
+        connection = self.__connect()
+        now = time.time()
+        queued = connection.execute(
+            "SELECT provider, priority, COUNT(*) FROM rate_waiters WHERE seen >= ? GROUP BY provider, priority",
+            (now - self.stale_after,)
+        ).fetchall()
+        buckets = {provider: self.__refill(connection, provider, now) for provider in self.limits}
+        lanes = {priority: lane for lane, priority in LANES.items()}
+        providers = {}
+        for provider, limits in self.limits.items():
+            requests, tokens, blocked_until = buckets[provider]
+            providers[provider] = {
+                **limits,
+                "available_requests": round(requests, 2),
+                "available_tokens": round(tokens, 2),
+                "blocked_for": round(max(blocked_until - now, 0.0), 2),
+                "queued": {lanes.get(priority, str(priority)): count for name, priority, count in queued if name == provider},
+                **counters.get(provider, {}),
+            }
+        return {"enabled": True, "providers": providers}
+
+
+def __create_rate_limiter() -> RateLimiter:
+    limits = {provider: dict(provider_limits) for provider, provider_limits in DEFAULT_LIMITS.items()}
+    # e.g. {"groq": {"requests_per_minute": 30, "tokens_per_minute": 6000}}
+    for provider, provider_limits in json.loads(os.getenv("RATE_LIMITS", "") or "{}").items():
+        limits[provider] = {**limits.get(provider, {}), **provider_limits}
+    return RateLimiter(
+        limits=limits,
+        db_file=os.getenv("RATE_LIMIT_DB", "tmp/rate_limits.db"),
+        enabled=os.getenv("RATE_LIMITER_ENABLED", "true").lower() == "true",
+        penalty=float(os.getenv("RATE_LIMIT_PENALTY_SECONDS", "5")),
+        completion_tokens=int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", "1000")),
+    )
+
+
+rate_limiter = __create_rate_limiter()